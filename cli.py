@@ -0,0 +1,172 @@
+"""
+Command-line entry point for the Python model tooling
+
+Dispatches to the training, conversion and report scripts through a single
+command. Only the module for the requested command is imported, and each
+script imports TensorFlow, pandas, scikit-learn and matplotlib lazily inside
+the functions that use them, so `--help`, argument errors and other trivial
+invocations start in well under the startup budget.
+
+Usage:
+    python cli.py train --data-dir model/data --task age
+    python cli.py convert --model-path models/age/age_model_best.h5 --output-path models/age.tflite
+    python cli.py report
+    python cli.py check-startup --budget-ms 200
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(ROOT_DIR, 'model')
+
+# command -> (module, help text); modules are imported only when dispatched to
+COMMANDS = {
+    'train': ('train_model', 'train the age, gender and expression models'),
+    'archive-dataset': ('archive_dataset', 'index and benchmark streaming of tar/zip dataset shards'),
+    'autotune': ('autotune', 'tune interpreter threads/XNNPACK and TensorFlow thread pools for this host'),
+    'backbone-weights': ('backbone_weights', 'pre-fetch and verify the offline MobileNetV2 weight bundle'),
+    'cascade': ('cascade', 'tune the confidence threshold of the fast/full age and gender cascade'),
+    'cold-start': ('cold_start', 'measure model cold start and per-worker memory for N concurrent workers'),
+    'convert': ('convert_to_tflite', 'convert a trained Keras model to TensorFlow Lite'),
+    'decode-workers': ('decode_workers', 'benchmark shared-memory multiprocess image decoding by worker count'),
+    'embedding-cache': ('embedding_cache', 'export the face-embedding model used to cache age/gender results'),
+    'export': ('model_export', 'export inference-only SavedModel/.keras models and compare formats'),
+    'face-store': ('face_store', 'precompute aligned face crops into a deduplicated store'),
+    'optimize-graph': ('graph_optimizer', 'fold BatchNorm and strip Dropout before TFLite conversion'),
+    'hparam-search': ('hparam_search', 'random / successive-halving / Hyperband hyperparameter search'),
+    'profile-tflite': ('tflite_profiler', 'op-level latency profile and diff of .tflite models'),
+    'select': ('model_selection', 'pick the most accurate model within a TFLite latency/size budget'),
+    'serve': ('inference_server', 'local HTTP inference server with dynamic batching, and its load-test client'),
+    'registry': ('model_registry', 'list and inspect registered model artifacts'),
+    'report': ('create_evaluation_table', 'generate the detailed evaluation tables and report'),
+    'video': ('video_pipeline', 'run the face models over a video file with per-track result caching'),
+    'visual-tables': ('create_visual_tables', 'render the visual evaluation tables'),
+    'stream-eval': ('streaming_eval', 'evaluate a TFLite model over a large dataset with bounded memory'),
+    'summary-charts': ('evaluation', 'render the accuracy summary and project timeline charts'),
+}
+
+# Modules that must not be imported just to print help text
+HEAVY_MODULES = ('tensorflow', 'keras', 'numpy', 'pandas', 'sklearn', 'matplotlib', 'tabulate')
+
+DEFAULT_STARTUP_BUDGET_MS = 200
+
+
+def loaded_heavy_modules():
+    """
+    Return the heavy dependencies currently present in sys.modules
+    """
+    return sorted(name for name in HEAVY_MODULES if name in sys.modules)
+
+
+def load_command(name):
+    """
+    Import the module implementing a command
+    """
+    for path in (MODEL_DIR, ROOT_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return importlib.import_module(COMMANDS[name][0])
+
+
+def measure_startup(argv, repeat):
+    """
+    Time a fresh interpreter running `cli.py <argv>`
+
+    Args:
+        argv (list): Arguments passed to cli.py
+        repeat (int): Number of runs
+
+    Returns:
+        Tuple of (median wall time in ms, heavy modules the command imported)
+    """
+    env = dict(os.environ, CLI_REPORT_IMPORTS='1')
+    timings = []
+    leaked = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__)] + argv,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+        for line in proc.stderr.splitlines():
+            if line.startswith('heavy-imports:'):
+                leaked = line.split(':', 1)[1].split()
+    timings.sort()
+    return timings[len(timings) // 2], leaked
+
+
+def check_startup(argv=None):
+    """
+    Verify that `--help` for every command stays within the startup budget
+    and does not import any heavy dependency
+    """
+    parser = argparse.ArgumentParser(prog='cli.py check-startup',
+                                     description='Measure CLI startup time for each command')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_STARTUP_BUDGET_MS,
+                      help=f'maximum median startup time (default: {DEFAULT_STARTUP_BUDGET_MS} ms)')
+    parser.add_argument('--repeat', type=int, default=5,
+                      help='runs per command (default: 5)')
+    parser.add_argument('commands', nargs='*', metavar='command',
+                      help='commands to check (default: all)')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.commands if name not in COMMANDS]
+    if unknown:
+        parser.error(f"unknown command(s): {', '.join(unknown)}")
+
+    failures = 0
+    for name in [None] + (args.commands or sorted(COMMANDS)):
+        cmd = ([name] if name else []) + ['--help']
+        median_ms, leaked = measure_startup(cmd, args.repeat)
+        ok = median_ms <= args.budget_ms and not leaked
+        failures += not ok
+        label = ' '.join(cmd)
+        extra = f"  imported: {', '.join(leaked)}" if leaked else ''
+        print(f"{'ok  ' if ok else 'FAIL'} {label:<32} {median_ms:7.1f} ms{extra}")
+
+    print(f"\nBudget: {args.budget_ms:.0f} ms, {failures} command(s) over budget")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    subcommands = dict((name, help_text) for name, (_, help_text) in COMMANDS.items())
+    subcommands['check-startup'] = 'measure startup time of every command against a budget'
+    epilog = 'commands:\n' + '\n'.join(f'  {name:<16} {help_text}' for name, help_text in sorted(subcommands.items()))
+    epilog += '\n\nRun "cli.py <command> --help" for command options.'
+
+    parser = argparse.ArgumentParser(
+        description='Age, gender and expression model tooling',
+        epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('command', choices=sorted(subcommands), metavar='command',
+                      help='command to run (see below)')
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                      help='arguments for the command')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'check-startup':
+        return check_startup(args.args)
+
+    module = load_command(args.command)
+    sys.argv[0] = f'cli.py {args.command}'
+    return module.main(args.args)
+
+
+if __name__ == '__main__':
+    try:
+        status = main()
+    finally:
+        if os.environ.get('CLI_REPORT_IMPORTS'):
+            print(f"heavy-imports: {' '.join(loaded_heavy_modules())}", file=sys.stderr)
+    sys.exit(status or 0)
@@ -1,9 +1,15 @@
-import pandas as pd
-import numpy as np
-from tabulate import tabulate
-from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score, confusion_matrix
-import matplotlib.pyplot as plt
-import matplotlib as mpl
+"""
+Detailed evaluation report
+
+Computes accuracy, precision, recall and F1 for the age, gender and expression
+models on the test set and writes them as CSV, Markdown and PNG tables along
+with a combined report image. pandas, scikit-learn, tabulate and matplotlib
+are only imported when the report is actually built.
+"""
+
+import argparse
+
+from report_cache import ReportCache
 
 # Test data from evaluation.py
 data = {
@@ -33,11 +39,11 @@ data = {
                            'Neutral', 'Happy', 'Sad', 'Happy', 'Sad']
 }
 
-df = pd.DataFrame(data)
-
 # Calculate all the metrics
 def calculate_metrics(true_labels, predicted_labels, classes=None):
     """Calculate all evaluation metrics for classification"""
+    from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score, confusion_matrix
+    
     accuracy = accuracy_score(true_labels, predicted_labels)
     
     # For multi-class problems use weighted averaging
@@ -59,85 +65,109 @@ def calculate_metrics(true_labels, predicted_labels, classes=None):
         'Confusion Matrix': cm
     }
 
-# Calculate metrics for each model
-age_metrics = calculate_metrics(df['Category'], df['Predicted_Age'])
-gender_metrics = calculate_metrics(df['Gender'], df['Predicted_Gender'])
-expression_metrics = calculate_metrics(df['Expression'], df['Predicted_Expression'], 
-                                      classes=['Happy', 'Sad', 'Neutral'])
-
-# Create a detailed metrics table
-metrics_table = pd.DataFrame({
-    'Model': ['Age Recognition', 'Age Recognition', 'Age Recognition', 'Age Recognition',
-             'Gender Recognition', 'Gender Recognition', 'Gender Recognition', 'Gender Recognition',
-             'Expression Recognition', 'Expression Recognition', 'Expression Recognition', 'Expression Recognition'],
-    'Metric': ['Accuracy', 'Precision', 'Recall', 'F1 Score',
-              'Accuracy', 'Precision', 'Recall', 'F1 Score',
-              'Accuracy', 'Precision', 'Recall', 'F1 Score'],
-    'Value (%)': [
-        age_metrics['Accuracy'], age_metrics['Precision'], age_metrics['Recall'], age_metrics['F1 Score'],
-        gender_metrics['Accuracy'], gender_metrics['Precision'], gender_metrics['Recall'], gender_metrics['F1 Score'],
-        expression_metrics['Accuracy'], expression_metrics['Precision'], expression_metrics['Recall'], expression_metrics['F1 Score']
-    ],
-    'Sample Size': ['20 images'] * 12,
-    'Description': [
-        'Percentage of correctly classified age categories',
-        'Ability to correctly identify age categories without false positives',
-        'Ability to find all instances of each age category',
-        'Harmonic mean of precision and recall for age detection',
-        'Percentage of correctly classified genders',
-        'Ability to correctly identify genders without false positives',
-        'Ability to find all instances of each gender',
-        'Harmonic mean of precision and recall for gender detection',
-        'Percentage of correctly classified expressions',
-        'Ability to correctly identify expressions without false positives',
-        'Ability to find all instances of each expression',
-        'Harmonic mean of precision and recall for expression detection'
-    ]
-})
+def build_tables():
+    """Compute the metrics table and confusion matrix DataFrames from the test data"""
+    import pandas as pd
+    
+    df = pd.DataFrame(data)
+    
+    # Calculate metrics for each model
+    age_metrics = calculate_metrics(df['Category'], df['Predicted_Age'])
+    gender_metrics = calculate_metrics(df['Gender'], df['Predicted_Gender'])
+    expression_metrics = calculate_metrics(df['Expression'], df['Predicted_Expression'], 
+                                          classes=['Happy', 'Sad', 'Neutral'])
 
-# Format values to 2 decimal places
-metrics_table['Value (%)'] = metrics_table['Value (%)'].round(2)
+    # Create a detailed metrics table
+    metrics_table = pd.DataFrame({
+        'Model': ['Age Recognition', 'Age Recognition', 'Age Recognition', 'Age Recognition',
+                 'Gender Recognition', 'Gender Recognition', 'Gender Recognition', 'Gender Recognition',
+                 'Expression Recognition', 'Expression Recognition', 'Expression Recognition', 'Expression Recognition'],
+        'Metric': ['Accuracy', 'Precision', 'Recall', 'F1 Score',
+                  'Accuracy', 'Precision', 'Recall', 'F1 Score',
+                  'Accuracy', 'Precision', 'Recall', 'F1 Score'],
+        'Value (%)': [
+            age_metrics['Accuracy'], age_metrics['Precision'], age_metrics['Recall'], age_metrics['F1 Score'],
+            gender_metrics['Accuracy'], gender_metrics['Precision'], gender_metrics['Recall'], gender_metrics['F1 Score'],
+            expression_metrics['Accuracy'], expression_metrics['Precision'], expression_metrics['Recall'], expression_metrics['F1 Score']
+        ],
+        'Sample Size': ['20 images'] * 12,
+        'Description': [
+            'Percentage of correctly classified age categories',
+            'Ability to correctly identify age categories without false positives',
+            'Ability to find all instances of each age category',
+            'Harmonic mean of precision and recall for age detection',
+            'Percentage of correctly classified genders',
+            'Ability to correctly identify genders without false positives',
+            'Ability to find all instances of each gender',
+            'Harmonic mean of precision and recall for gender detection',
+            'Percentage of correctly classified expressions',
+            'Ability to correctly identify expressions without false positives',
+            'Ability to find all instances of each expression',
+            'Harmonic mean of precision and recall for expression detection'
+        ]
+    })
 
-# Save the table to CSV
-metrics_table.to_csv('detailed_evaluation_metrics.csv', index=False)
+    # Format values to 2 decimal places
+    metrics_table['Value (%)'] = metrics_table['Value (%)'].round(2)
 
-# Also save as markdown for easy copy-paste into reports
-with open('detailed_evaluation_metrics.md', 'w') as f:
-    f.write("# Comprehensive Model Evaluation Results\n\n")
-    f.write(tabulate(metrics_table, headers='keys', tablefmt='pipe', showindex=False))
-    f.write("\n\n## Confusion Matrices\n\n")
-    
-    # Add confusion matrices
-    f.write("### Age Recognition Confusion Matrix\n\n")
+    # Create confusion matrix DataFrames
     age_cm_df = pd.DataFrame(age_metrics['Confusion Matrix'], 
                            index=['True Adult', 'True Elderly'], 
                            columns=['Pred Adult', 'Pred Elderly'])
-    f.write(tabulate(age_cm_df, headers='keys', tablefmt='pipe'))
-    
-    f.write("\n\n### Gender Recognition Confusion Matrix\n\n")
+
     gender_cm_df = pd.DataFrame(gender_metrics['Confusion Matrix'], 
                               index=['True Female', 'True Male'], 
                               columns=['Pred Female', 'Pred Male'])
-    f.write(tabulate(gender_cm_df, headers='keys', tablefmt='pipe'))
-    
-    f.write("\n\n### Expression Recognition Confusion Matrix\n\n")
+
     expr_cm_df = pd.DataFrame(expression_metrics['Confusion Matrix'], 
                             index=['True Happy', 'True Sad', 'True Neutral'], 
                             columns=['Pred Happy', 'Pred Sad', 'Pred Neutral'])
-    f.write(tabulate(expr_cm_df, headers='keys', tablefmt='pipe'))
-    
-    f.write("\n\n## Performance Analysis Summary\n\n")
-    f.write("This evaluation demonstrates the model's strong performance across all three recognition tasks. ")
-    f.write("The gender recognition model achieved the highest accuracy at {:.2f}%, ".format(gender_metrics['Accuracy']))
-    f.write("followed by age and expression recognition models at {:.2f}% and {:.2f}% respectively. ".format(
-        age_metrics['Accuracy'], expression_metrics['Accuracy']))
-    f.write("The high F1 scores across all models indicate good balance between precision and recall, ")
-    f.write("suggesting the models are effective at both identifying positive cases and avoiding false classifications.\n\n")
-    f.write("The models were evaluated on a test set of 20 carefully selected images representing various age groups, genders, ")
-    f.write("and facial expressions. The results provide a reliable indication of the model's performance in real-world applications.")
+    
+    return {
+        'metrics_table': metrics_table,
+        'age_cm_df': age_cm_df,
+        'gender_cm_df': gender_cm_df,
+        'expr_cm_df': expr_cm_df,
+        'accuracies': {
+            'age': age_metrics['Accuracy'],
+            'gender': gender_metrics['Accuracy'],
+            'expression': expression_metrics['Accuracy'],
+        },
+    }
+
+def write_markdown_report(filename, metrics_table, age_cm_df, gender_cm_df, expr_cm_df, accuracies):
+    """Write the metrics table and confusion matrices as Markdown."""
+    from tabulate import tabulate
+    
+    with open(filename, 'w') as f:
+        f.write("# Comprehensive Model Evaluation Results\n\n")
+        f.write(tabulate(metrics_table, headers='keys', tablefmt='pipe', showindex=False))
+        f.write("\n\n## Confusion Matrices\n\n")
+        
+        # Add confusion matrices
+        f.write("### Age Recognition Confusion Matrix\n\n")
+        f.write(tabulate(age_cm_df, headers='keys', tablefmt='pipe'))
+        
+        f.write("\n\n### Gender Recognition Confusion Matrix\n\n")
+        f.write(tabulate(gender_cm_df, headers='keys', tablefmt='pipe'))
+        
+        f.write("\n\n### Expression Recognition Confusion Matrix\n\n")
+        f.write(tabulate(expr_cm_df, headers='keys', tablefmt='pipe'))
+        
+        f.write("\n\n## Performance Analysis Summary\n\n")
+        f.write("This evaluation demonstrates the model's strong performance across all three recognition tasks. ")
+        f.write("The gender recognition model achieved the highest accuracy at {:.2f}%, ".format(accuracies['gender']))
+        f.write("followed by age and expression recognition models at {:.2f}% and {:.2f}% respectively. ".format(
+            accuracies['age'], accuracies['expression']))
+        f.write("The high F1 scores across all models indicate good balance between precision and recall, ")
+        f.write("suggesting the models are effective at both identifying positive cases and avoiding false classifications.\n\n")
+        f.write("The models were evaluated on a test set of 20 carefully selected images representing various age groups, genders, ")
+        f.write("and facial expressions. The results provide a reliable indication of the model's performance in real-world applications.")
 
 # Create visualization of the metrics table using matplotlib
 def create_metrics_table_image(metrics_df):
+    import matplotlib.pyplot as plt
+    
     # Create a figure and axis with the right size
     plt.figure(figsize=(14, 8))
     
@@ -230,14 +260,11 @@ def create_metrics_table_image(metrics_df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('evaluation_table.png', dpi=300, bbox_inches='tight')
-    
-    # Create a separate table for each confusion matrix
-    create_confusion_matrix_image(age_cm_df, 'Age Recognition', 'age_confusion_matrix.png')
-    create_confusion_matrix_image(gender_cm_df, 'Gender Recognition', 'gender_confusion_matrix.png')
-    create_confusion_matrix_image(expr_cm_df, 'Expression Recognition', 'expression_confusion_matrix.png')
 
 def create_confusion_matrix_image(cm_df, title, filename):
     """Create a visualization of a confusion matrix."""
+    import matplotlib.pyplot as plt
+    
     plt.figure(figsize=(8, 6))
     ax = plt.subplot(111)
     ax.axis('off')
@@ -295,12 +322,11 @@ def create_confusion_matrix_image(cm_df, title, filename):
     plt.tight_layout()
     plt.savefig(filename, dpi=300, bbox_inches='tight')
 
-# Create the visualization
-create_metrics_table_image(metrics_table)
-
 # Create a combined visualization with all information
-def create_combined_report():
+def create_combined_report(metrics_table, age_cm_df, gender_cm_df, expr_cm_df, accuracies):
     """Create a single comprehensive report image."""
+    import matplotlib.pyplot as plt
+    
     plt.figure(figsize=(16, 24))
     
     # Set the basic layout: 4 rows (metrics table, 3 confusion matrices, summary)
@@ -504,8 +530,8 @@ def create_combined_report():
     
     summary_text = (
         f"This evaluation demonstrates the model's strong performance across all three recognition tasks. "
-        f"The gender recognition model achieved the highest accuracy at {gender_metrics['Accuracy']:.2f}%, "
-        f"followed by age and expression recognition models at {age_metrics['Accuracy']:.2f}% and {expression_metrics['Accuracy']:.2f}% respectively.\n\n"
+        f"The gender recognition model achieved the highest accuracy at {accuracies['gender']:.2f}%, "
+        f"followed by age and expression recognition models at {accuracies['age']:.2f}% and {accuracies['expression']:.2f}% respectively.\n\n"
         f"The high F1 scores across all models indicate good balance between precision and recall, "
         f"suggesting the models are effective at both identifying positive cases and avoiding false classifications.\n\n"
         f"The models were evaluated on a test set of 20 carefully selected images representing various age groups, genders, "
@@ -536,14 +562,66 @@ def create_combined_report():
     plt.tight_layout(rect=[0, 0, 1, 0.97])
     plt.savefig('complete_evaluation_report.png', dpi=300, bbox_inches='tight')
 
-# Create the full report
-create_combined_report()
+def main(argv=None):
+    """Build every report artifact, skipping those whose inputs are unchanged"""
+    parser = argparse.ArgumentParser(description='Generate detailed evaluation tables and the combined report')
+    parser.add_argument('--force', action='store_true',
+                      help='rebuild every artifact, ignoring the report cache')
+    args = parser.parse_args(argv)
+    
+    tables = build_tables()
+    metrics_table = tables['metrics_table']
+    age_cm_df = tables['age_cm_df']
+    gender_cm_df = tables['gender_cm_df']
+    expr_cm_df = tables['expr_cm_df']
+    
+    # Only rewrite artifacts whose content or styling changed since the last run
+    cache = ReportCache(force=args.force)
+    
+    # Save the table to CSV
+    cache.build(
+        'detailed_evaluation_metrics.csv',
+        metrics_table.to_csv,
+        'detailed_evaluation_metrics.csv',
+        index=False,
+        depends_on=(metrics_table,)
+    )
+    
+    # Also save as markdown for easy copy-paste into reports
+    cache.build(
+        'detailed_evaluation_metrics.md',
+        write_markdown_report,
+        'detailed_evaluation_metrics.md',
+        metrics_table, age_cm_df, gender_cm_df, expr_cm_df, tables['accuracies']
+    )
+    
+    # Create the visualization
+    cache.build('evaluation_table.png', create_metrics_table_image, metrics_table)
+
+    # Create a separate table for each confusion matrix
+    cache.build('age_confusion_matrix.png', create_confusion_matrix_image,
+                age_cm_df, 'Age Recognition', 'age_confusion_matrix.png')
+    cache.build('gender_confusion_matrix.png', create_confusion_matrix_image,
+                gender_cm_df, 'Gender Recognition', 'gender_confusion_matrix.png')
+    cache.build('expression_confusion_matrix.png', create_confusion_matrix_image,
+                expr_cm_df, 'Expression Recognition', 'expression_confusion_matrix.png')
+    
+    # Create the full report
+    cache.build(
+        'complete_evaluation_report.png',
+        create_combined_report,
+        metrics_table, age_cm_df, gender_cm_df, expr_cm_df, tables['accuracies']
+    )
+
+    print("Evaluation tables and visualizations have been generated:")
+    print("1. detailed_evaluation_metrics.csv - CSV format for data analysis")
+    print("2. detailed_evaluation_metrics.md - Markdown format for report inclusion")
+    print("3. evaluation_table.png - Visual table with gridlines")
+    print("4. age_confusion_matrix.png - Age recognition confusion matrix visualization")
+    print("5. gender_confusion_matrix.png - Gender recognition confusion matrix visualization") 
+    print("6. expression_confusion_matrix.png - Expression recognition confusion matrix visualization")
+    print("7. complete_evaluation_report.png - Complete visual report with all metrics and analysis")
+    print(cache.summary())
 
-print("Evaluation tables and visualizations have been generated:")
-print("1. detailed_evaluation_metrics.csv - CSV format for data analysis")
-print("2. detailed_evaluation_metrics.md - Markdown format for report inclusion")
-print("3. evaluation_table.png - Visual table with gridlines")
-print("4. age_confusion_matrix.png - Age recognition confusion matrix visualization")
-print("5. gender_confusion_matrix.png - Gender recognition confusion matrix visualization") 
-print("6. expression_confusion_matrix.png - Expression recognition confusion matrix visualization")
-print("7. complete_evaluation_report.png - Complete visual report with all metrics and analysis") 
\ No newline at end of file
+if __name__ == '__main__':
+    main()
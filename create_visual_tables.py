@@ -1,7 +1,20 @@
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score, confusion_matrix
+"""
+Visual evaluation tables
+
+Renders the metrics table and the per-task confusion matrices as PNG tables
+(`<task>_confusion_table.png`), plus a combined report image
+(`complete_visual_report.png`). The names and the cache index differ from
+create_evaluation_table.py's so the two scripts never overwrite, and keep
+rebuilding, each other's artifacts. pandas, scikit-learn and matplotlib are
+only imported when the tables are actually built.
+"""
+
+import argparse
+
+from report_cache import ReportCache
+
+# Separate from create_evaluation_table.py's index, which tracks other artifacts
+CACHE_FILE = '.report_cache_visual.json'
 
 # Test data from evaluation.py
 data = {
@@ -31,11 +44,11 @@ data = {
                            'Neutral', 'Happy', 'Sad', 'Happy', 'Sad']
 }
 
-df = pd.DataFrame(data)
-
 # Calculate all the metrics
 def calculate_metrics(true_labels, predicted_labels, classes=None):
     """Calculate all evaluation metrics for classification"""
+    from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score, confusion_matrix
+    
     accuracy = accuracy_score(true_labels, predicted_labels)
     
     # For multi-class problems use weighted averaging
@@ -57,61 +70,81 @@ def calculate_metrics(true_labels, predicted_labels, classes=None):
         'Confusion Matrix': cm
     }
 
-# Calculate metrics for each model
-age_metrics = calculate_metrics(df['Category'], df['Predicted_Age'])
-gender_metrics = calculate_metrics(df['Gender'], df['Predicted_Gender'])
-expression_metrics = calculate_metrics(df['Expression'], df['Predicted_Expression'], 
-                                      classes=['Happy', 'Sad', 'Neutral'])
+def build_tables():
+    """Compute the metrics table and confusion matrix DataFrames from the test data"""
+    import pandas as pd
+    
+    df = pd.DataFrame(data)
+    
+    # Calculate metrics for each model
+    age_metrics = calculate_metrics(df['Category'], df['Predicted_Age'])
+    gender_metrics = calculate_metrics(df['Gender'], df['Predicted_Gender'])
+    expression_metrics = calculate_metrics(df['Expression'], df['Predicted_Expression'], 
+                                          classes=['Happy', 'Sad', 'Neutral'])
 
-# Create a detailed metrics table
-metrics_table = pd.DataFrame({
-    'Model': ['Age Recognition', 'Age Recognition', 'Age Recognition', 'Age Recognition',
-             'Gender Recognition', 'Gender Recognition', 'Gender Recognition', 'Gender Recognition',
-             'Expression Recognition', 'Expression Recognition', 'Expression Recognition', 'Expression Recognition'],
-    'Metric': ['Accuracy', 'Precision', 'Recall', 'F1 Score',
-              'Accuracy', 'Precision', 'Recall', 'F1 Score',
-              'Accuracy', 'Precision', 'Recall', 'F1 Score'],
-    'Value (%)': [
-        age_metrics['Accuracy'], age_metrics['Precision'], age_metrics['Recall'], age_metrics['F1 Score'],
-        gender_metrics['Accuracy'], gender_metrics['Precision'], gender_metrics['Recall'], gender_metrics['F1 Score'],
-        expression_metrics['Accuracy'], expression_metrics['Precision'], expression_metrics['Recall'], expression_metrics['F1 Score']
-    ],
-    'Sample Size': ['20 images'] * 12,
-    'Description': [
-        'Percentage of correctly classified age categories',
-        'Ability to correctly identify age categories without false positives',
-        'Ability to find all instances of each age category',
-        'Harmonic mean of precision and recall for age detection',
-        'Percentage of correctly classified genders',
-        'Ability to correctly identify genders without false positives',
-        'Ability to find all instances of each gender',
-        'Harmonic mean of precision and recall for gender detection',
-        'Percentage of correctly classified expressions',
-        'Ability to correctly identify expressions without false positives',
-        'Ability to find all instances of each expression',
-        'Harmonic mean of precision and recall for expression detection'
-    ]
-})
+    # Create a detailed metrics table
+    metrics_table = pd.DataFrame({
+        'Model': ['Age Recognition', 'Age Recognition', 'Age Recognition', 'Age Recognition',
+                 'Gender Recognition', 'Gender Recognition', 'Gender Recognition', 'Gender Recognition',
+                 'Expression Recognition', 'Expression Recognition', 'Expression Recognition', 'Expression Recognition'],
+        'Metric': ['Accuracy', 'Precision', 'Recall', 'F1 Score',
+                  'Accuracy', 'Precision', 'Recall', 'F1 Score',
+                  'Accuracy', 'Precision', 'Recall', 'F1 Score'],
+        'Value (%)': [
+            age_metrics['Accuracy'], age_metrics['Precision'], age_metrics['Recall'], age_metrics['F1 Score'],
+            gender_metrics['Accuracy'], gender_metrics['Precision'], gender_metrics['Recall'], gender_metrics['F1 Score'],
+            expression_metrics['Accuracy'], expression_metrics['Precision'], expression_metrics['Recall'], expression_metrics['F1 Score']
+        ],
+        'Sample Size': ['20 images'] * 12,
+        'Description': [
+            'Percentage of correctly classified age categories',
+            'Ability to correctly identify age categories without false positives',
+            'Ability to find all instances of each age category',
+            'Harmonic mean of precision and recall for age detection',
+            'Percentage of correctly classified genders',
+            'Ability to correctly identify genders without false positives',
+            'Ability to find all instances of each gender',
+            'Harmonic mean of precision and recall for gender detection',
+            'Percentage of correctly classified expressions',
+            'Ability to correctly identify expressions without false positives',
+            'Ability to find all instances of each expression',
+            'Harmonic mean of precision and recall for expression detection'
+        ]
+    })
 
-# Format values to 2 decimal places
-metrics_table['Value (%)'] = metrics_table['Value (%)'].round(2)
+    # Format values to 2 decimal places
+    metrics_table['Value (%)'] = metrics_table['Value (%)'].round(2)
 
-# Create confusion matrix DataFrames
-age_cm_df = pd.DataFrame(age_metrics['Confusion Matrix'], 
-                     index=['True Adult', 'True Elderly'], 
-                     columns=['Pred Adult', 'Pred Elderly'])
+    # Create confusion matrix DataFrames
+    age_cm_df = pd.DataFrame(age_metrics['Confusion Matrix'], 
+                         index=['True Adult', 'True Elderly'], 
+                         columns=['Pred Adult', 'Pred Elderly'])
 
-gender_cm_df = pd.DataFrame(gender_metrics['Confusion Matrix'], 
-                        index=['True Female', 'True Male'], 
-                        columns=['Pred Female', 'Pred Male'])
+    gender_cm_df = pd.DataFrame(gender_metrics['Confusion Matrix'], 
+                            index=['True Female', 'True Male'], 
+                            columns=['Pred Female', 'Pred Male'])
 
-expr_cm_df = pd.DataFrame(expression_metrics['Confusion Matrix'], 
-                      index=['True Happy', 'True Sad', 'True Neutral'], 
-                      columns=['Pred Happy', 'Pred Sad', 'Pred Neutral'])
+    expr_cm_df = pd.DataFrame(expression_metrics['Confusion Matrix'], 
+                          index=['True Happy', 'True Sad', 'True Neutral'], 
+                          columns=['Pred Happy', 'Pred Sad', 'Pred Neutral'])
+    
+    return {
+        'metrics_table': metrics_table,
+        'age_cm_df': age_cm_df,
+        'gender_cm_df': gender_cm_df,
+        'expr_cm_df': expr_cm_df,
+        'accuracies': {
+            'age': age_metrics['Accuracy'],
+            'gender': gender_metrics['Accuracy'],
+            'expression': expression_metrics['Accuracy'],
+        },
+    }
 
 # Function to create a nice table visualization with matplotlib
 def create_table_plot(data_frame, title, filename, cell_colors=None, highlight_diag=False):
     """Create a nice looking table with matplotlib"""
+    import matplotlib.pyplot as plt
+    
     # Create figure and axis
     fig, ax = plt.subplots(figsize=(12, len(data_frame) * 0.5 + 2))
     ax.axis('off')
@@ -169,38 +202,11 @@ def create_table_plot(data_frame, title, filename, cell_colors=None, highlight_d
     plt.savefig(filename, dpi=300, bbox_inches='tight')
     plt.close()
 
-# Create the main metrics table
-create_table_plot(
-    metrics_table,
-    'Comprehensive Model Evaluation Metrics',
-    'evaluation_metrics_table.png'
-)
-
-# Create confusion matrices tables
-create_table_plot(
-    age_cm_df,
-    'Age Recognition Confusion Matrix',
-    'age_confusion_matrix.png',
-    highlight_diag=True
-)
-
-create_table_plot(
-    gender_cm_df,
-    'Gender Recognition Confusion Matrix',
-    'gender_confusion_matrix.png',
-    highlight_diag=True
-)
-
-create_table_plot(
-    expr_cm_df,
-    'Expression Recognition Confusion Matrix',
-    'expression_confusion_matrix.png',
-    highlight_diag=True
-)
-
 # Create a combined visualization with all information
-def create_comprehensive_report():
+def create_comprehensive_report(metrics_table, age_cm_df, gender_cm_df, expr_cm_df, accuracies):
     """Create a single comprehensive report with all tables and analysis"""
+    import matplotlib.pyplot as plt
+    
     plt.figure(figsize=(12, 20))
     
     # Configure the grid layout
@@ -315,8 +321,8 @@ def create_comprehensive_report():
     
     summary_text = (
         f"This evaluation demonstrates the model's strong performance across all three recognition tasks. "
-        f"The gender recognition model achieved the highest accuracy at {gender_metrics['Accuracy']:.2f}%, "
-        f"followed by age and expression recognition models at {age_metrics['Accuracy']:.2f}% and {expression_metrics['Accuracy']:.2f}% respectively.\n\n"
+        f"The gender recognition model achieved the highest accuracy at {accuracies['gender']:.2f}%, "
+        f"followed by age and expression recognition models at {accuracies['age']:.2f}% and {accuracies['expression']:.2f}% respectively.\n\n"
         f"The high F1 scores across all models indicate good balance between precision and recall, "
         f"suggesting the models are effective at both identifying positive cases and avoiding false classifications.\n\n"
         f"The models were evaluated on a test set of 20 carefully selected images representing various age groups, genders, "
@@ -338,15 +344,77 @@ def create_comprehensive_report():
     
     # Save figure
     plt.tight_layout(rect=[0, 0, 1, 0.97])
-    plt.savefig('complete_evaluation_report.png', dpi=300, bbox_inches='tight')
+    plt.savefig('complete_visual_report.png', dpi=300, bbox_inches='tight')
     plt.close()
 
-# Create the complete report
-create_comprehensive_report()
 
-print("The following visual evaluation tables have been generated:")
-print("1. evaluation_metrics_table.png - Main metrics table")
-print("2. age_confusion_matrix.png - Age recognition confusion matrix")
-print("3. gender_confusion_matrix.png - Gender recognition confusion matrix")
-print("4. expression_confusion_matrix.png - Expression recognition confusion matrix")
-print("5. complete_evaluation_report.png - Complete visual report with all metrics and analysis") 
\ No newline at end of file
+def main(argv=None):
+    """Build every visual evaluation table, skipping those whose inputs are unchanged"""
+    parser = argparse.ArgumentParser(description='Render visual evaluation tables and the combined report')
+    parser.add_argument('--force', action='store_true',
+                      help='rebuild every artifact, ignoring the report cache')
+    args = parser.parse_args(argv)
+    
+    tables = build_tables()
+    metrics_table = tables['metrics_table']
+    age_cm_df = tables['age_cm_df']
+    gender_cm_df = tables['gender_cm_df']
+    expr_cm_df = tables['expr_cm_df']
+    
+    # Only redraw tables whose content or styling changed since the last run
+    cache = ReportCache(path=CACHE_FILE, force=args.force)
+
+    # Create the main metrics table
+    cache.build(
+        'evaluation_metrics_table.png',
+        create_table_plot,
+        metrics_table,
+        'Comprehensive Model Evaluation Metrics',
+        'evaluation_metrics_table.png'
+    )
+
+    # Create confusion matrices tables
+    cache.build(
+        'age_confusion_table.png',
+        create_table_plot,
+        age_cm_df,
+        'Age Recognition Confusion Matrix',
+        'age_confusion_table.png',
+        highlight_diag=True
+    )
+
+    cache.build(
+        'gender_confusion_table.png',
+        create_table_plot,
+        gender_cm_df,
+        'Gender Recognition Confusion Matrix',
+        'gender_confusion_table.png',
+        highlight_diag=True
+    )
+
+    cache.build(
+        'expression_confusion_table.png',
+        create_table_plot,
+        expr_cm_df,
+        'Expression Recognition Confusion Matrix',
+        'expression_confusion_table.png',
+        highlight_diag=True
+    )
+    
+    # Create the complete report
+    cache.build(
+        'complete_visual_report.png',
+        create_comprehensive_report,
+        metrics_table, age_cm_df, gender_cm_df, expr_cm_df, tables['accuracies']
+    )
+
+    print("The following visual evaluation tables have been generated:")
+    print("1. evaluation_metrics_table.png - Main metrics table")
+    print("2. age_confusion_table.png - Age recognition confusion matrix")
+    print("3. gender_confusion_table.png - Gender recognition confusion matrix")
+    print("4. expression_confusion_table.png - Expression recognition confusion matrix")
+    print("5. complete_visual_report.png - Complete visual report with all metrics and analysis")
+    print(cache.summary())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,448 @@
+"""
+Streaming Dataset Reader for tar/zip Shards
+
+UTKFace, FER2013 and similar datasets arrive as archives. Extracting them
+doubles their storage, takes hours on network filesystems, and leaves
+millions of small files to open at training time. `ArchiveReader` instead
+streams samples straight out of the archives, WebDataset-style:
+
+- each shard is read front to back in one pass (tar in stream mode, zip
+  members in file order); no member is extracted to disk
+- shard order is reshuffled on every pass, and --readers threads each read a
+  different shard at once, feeding one bounded queue (back-pressure)
+- a shuffle buffer of encoded samples mixes those streams before decoding;
+  images are decoded, augmented and rescaled in a thread pool
+- the first use of a shard builds a small sidecar index of its image members
+  (`<shard>.index.json`, rebuilt when the shard changes) so sample counts,
+  classes and the validation split are known without reading image data
+
+Labels come from each image's parent directory (`--archive-labels
+directory`, e.g. `train/happy/0001.jpg`) or from UTKFace file names
+(`utkface`: `<age>_<gender>_<race>_<date>.jpg`, binned to the task's
+classes). Samples are assigned to the validation set (20%, as with
+ImageDataGenerator's validation_split) by a hash of their member name, so the
+split does not depend on shard order. The validation reader is built with
+`repeat=False`: one reader thread reads the shards once, in order, so each
+epoch is evaluated over the same samples.
+
+`train_model.py --archives` plugs this into `create_data_generators` through
+data_loader.ArchiveSequence.
+
+Usage:
+    python archive_dataset.py index --archives /data/utkface/shard-*.tar --archive-labels utkface --task age
+    python archive_dataset.py benchmark --archives /data/fer2013.zip --task expression --readers 4
+"""
+
+import os
+import io
+import glob
+import json
+import time
+import zlib
+import queue
+import random
+import tarfile
+import zipfile
+import argparse
+import threading
+
+from face_store import IMAGE_EXTENSIONS
+from train_model import AGE_RANGES, GENDERS
+
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.zip')
+
+VALIDATION_SPLIT = 0.2
+
+# Queued by the reader of a non-repeating stream after its single pass
+_END = object()
+
+
+def expand_shards(patterns):
+    """
+    Archive paths from files, directories (every archive inside) and glob
+    patterns, in sorted order
+    """
+    patterns = [patterns] if isinstance(patterns, str) else patterns
+    shards = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            shards.extend(os.path.join(pattern, name) for name in os.listdir(pattern)
+                          if name.lower().endswith(ARCHIVE_EXTENSIONS))
+        else:
+            shards.extend(glob.glob(pattern) or ([pattern] if os.path.exists(pattern) else []))
+    if not shards:
+        raise FileNotFoundError(f"No tar/zip shards match {', '.join(patterns)}")
+    return sorted(set(shards))
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(name).startswith('.')
+
+
+def iter_members(shard):
+    """
+    Yield (member name, bytes) for every image in a shard, reading it
+    sequentially
+    """
+    if shard.lower().endswith('.zip'):
+        with zipfile.ZipFile(shard) as archive:
+            for info in sorted(archive.infolist(), key=lambda info: info.header_offset):
+                if not info.is_dir() and is_image(info.filename):
+                    yield info.filename, archive.read(info)
+    else:
+        with tarfile.open(shard, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and is_image(member.name):
+                    yield member.name, archive.extractfile(member).read()
+
+
+def scan_shard(shard):
+    """
+    Names of the image members of a shard; zip and uncompressed tar
+    shards are listed without reading their data
+    """
+    if shard.lower().endswith('.zip'):
+        with zipfile.ZipFile(shard) as archive:
+            return [name for name in archive.namelist() if not name.endswith('/') and is_image(name)]
+    with tarfile.open(shard) as archive:
+        return [member.name for member in archive.getmembers() if member.isfile() and is_image(member.name)]
+
+
+def load_index(shard, index_dir=None):
+    """
+    Image member names of a shard, from its sidecar index when it is
+    current, else by scanning the shard and writing the index
+
+    Args:
+        shard (str): Archive path
+        index_dir (str): Where sidecar indexes live (default: next to the shard)
+
+    Returns:
+        list: Member names
+    """
+    index_path = os.path.join(index_dir or os.path.dirname(shard), os.path.basename(shard) + '.index.json')
+    stat = os.stat(shard)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get('size') == stat.st_size and index.get('mtime_ns') == stat.st_mtime_ns:
+            return index['members']
+
+    members = scan_shard(shard)
+    try:
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        with open(index_path, 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'members': members}, f)
+    except OSError as e:
+        print(f"Warning: could not write {index_path} ({e}); the shard will be rescanned next time")
+    return members
+
+
+def directory_label(name):
+    """
+    Class of a member from its parent directory
+    """
+    parent = os.path.basename(os.path.dirname(name))
+    return parent or None
+
+
+def utkface_label(name, task):
+    """
+    Class of a UTKFace member from its `<age>_<gender>_<race>_<date>` name,
+    or None for malformed names
+    """
+    parts = os.path.basename(name).split('_')
+    try:
+        age, gender = int(parts[0]), int(parts[1])
+    except (IndexError, ValueError):
+        return None
+    if task == 'age':
+        return AGE_RANGES[0 if age <= 10 else min((age - 1) // 10, len(AGE_RANGES) - 1)]
+    # UTKFace encodes 0 as male and 1 as female
+    return {0: 'Male', 1: 'Female'}.get(gender)
+
+
+def make_labeler(mode, task):
+    """
+    Member name -> class name (or None to skip) for a label mode
+
+    Returns:
+        tuple: (labeler, fixed class names or None to use the labels found)
+    """
+    if mode == 'utkface':
+        if task not in ('age', 'gender'):
+            raise ValueError("UTKFace names only carry age and gender labels")
+        return (lambda name: utkface_label(name, task)), (AGE_RANGES if task == 'age' else GENDERS)
+    return directory_label, None
+
+
+def is_validation(name, validation_split=VALIDATION_SPLIT):
+    """
+    Stable split of a sample by the hash of its member name
+    """
+    return zlib.crc32(name.encode('utf-8')) % 10000 < validation_split * 10000
+
+
+class ArchiveReader:
+    """
+    Stream one subset of a sharded dataset as shuffled, decoded batches
+    """
+
+    def __init__(self, shards, labeler, decoder, class_names=None, subset='training',
+                 validation_split=VALIDATION_SPLIT, readers=4, shuffle=True, shuffle_buffer=1000,
+                 repeat=True, decode_threads=None, index_dir=None, seed=None):
+        """
+        Args:
+            shards (list): Archive paths
+            labeler: Member name -> class name, or None to skip the member
+            decoder (BatchDecoder): Decodes, augments and rescales images
+            class_names (list): Class order (default: sorted labels found)
+            subset (str): 'training' or 'validation'
+            validation_split (float): Share of samples in the validation set
+            readers (int): Shards read concurrently
+            shuffle (bool): Shuffle shard order each pass and mix samples
+            shuffle_buffer (int): Encoded samples held for mixing
+            repeat (bool): Cycle over the shards endlessly; False reads them
+                once, in order, with a single reader (restart() begins a
+                new pass), so every sample is seen exactly once
+            decode_threads (int): Decode thread pool size (default: CPUs)
+            index_dir (str): Sidecar index directory (default: next to each shard)
+            seed (int): Seed for shard order and sample mixing
+        """
+        import numpy as np
+
+        self.shards = list(shards)
+        self.labeler = labeler
+        self.decoder = decoder
+        self.repeat = repeat
+        self.readers = max(1, min(readers, len(self.shards))) if repeat else 1
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer if shuffle else 0
+        self.decode_threads = decode_threads or os.cpu_count() or 1
+        self.rng = random.Random(seed)
+
+        self.validation = subset == 'validation'
+        self.validation_split = validation_split
+        labels = [
+            (name, labeler(name)) for shard in self.shards for name in load_index(shard, index_dir)
+        ]
+        names = class_names or sorted({label for _, label in labels if label is not None})
+        self.class_indices = {name: i for i, name in enumerate(names)}
+        self.classes = np.array([self.class_indices[label] for name, label in labels
+                                 if label in self.class_indices
+                                 and is_validation(name, validation_split) == self.validation], dtype=np.int64)
+        if not len(self.classes):
+            raise ValueError(f"No labelled {subset} samples in {len(self.shards)} shard(s)")
+
+        self.passes = 0
+        self._queue = None
+        self._threads = []
+        self._pool = None
+        self._buffer = []
+
+    def _next_shard(self):
+        with self._lock:
+            if not self._pending:
+                if not self.repeat and self._started_pass:
+                    return None
+                self._started_pass = True
+                self._pending = list(self.shards)
+                if self.shuffle:
+                    self.rng.shuffle(self._pending)
+                else:
+                    self._pending.reverse()
+                self.passes += 1
+            return self._pending.pop()
+
+    def _put(self, item):
+        # Block on the bounded queue, but give up once the reader is stopped
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        # Reader thread: stream whole shards into the bounded queue until stopped
+        try:
+            while not self._stop.is_set():
+                shard = self._next_shard()
+                if shard is None:
+                    self._put(_END)
+                    return
+                for name, data in iter_members(shard):
+                    label = self.labeler(name)
+                    if (label not in self.class_indices
+                            or is_validation(name, self.validation_split) != self.validation):
+                        continue
+                    if not self._put((data, self.class_indices[label])):
+                        return
+        except Exception as e:
+            self._put(e)
+
+    def start(self):
+        """
+        Start the reader threads (done on the first batch request)
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self._threads:
+            return
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pending = []
+        self._started_pass = False
+        self._queue = queue.Queue(maxsize=max(64, 2 * self.shuffle_buffer))
+        self._pool = ThreadPoolExecutor(self.decode_threads)
+        self._threads = [threading.Thread(target=self._read, daemon=True) for _ in range(self.readers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _take(self):
+        item = self._queue.get()
+        if item is _END:
+            raise EOFError("The single pass over the shards is exhausted; call restart()")
+        if isinstance(item, Exception):
+            raise RuntimeError(f"Reading shards failed: {item}") from item
+        return item
+
+    def next_samples(self, count):
+        """
+        Next `count` (encoded image, class index) samples of the stream
+        """
+        self.start()
+        samples = []
+        while len(samples) < count:
+            if not self.shuffle_buffer:
+                samples.append(self._take())
+                continue
+            while len(self._buffer) < self.shuffle_buffer:
+                self._buffer.append(self._take())
+            # Swap a random buffered sample out for the next one from the stream
+            i = self.rng.randrange(len(self._buffer))
+            samples.append(self._buffer[i])
+            self._buffer[i] = self._take()
+        return samples
+
+    def next_batch(self, batch_size):
+        """
+        Decode the next batch of the stream
+
+        Returns:
+            tuple: (float32 images, class indices)
+        """
+        import numpy as np
+
+        samples = self.next_samples(batch_size)
+        images = list(self._pool.map(lambda sample: self.decoder.decode(io.BytesIO(sample[0])), samples))
+        return np.stack(images).astype(np.float32, copy=False), np.array([c for _, c in samples], dtype=np.int64)
+
+    def restart(self):
+        """
+        Drop the rest of the current stream and start a new pass from the
+        first shard (on the next batch request)
+        """
+        self.close()
+
+    def close(self):
+        """
+        Stop the reader threads and the decode pool
+        """
+        if not self._threads:
+            return
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._pool.shutdown()
+        self._threads = []
+        self._buffer = []
+
+
+def create_reader(archives, task, target_size, color_mode='rgb', labels='directory', subset='training',
+                  transform=None, **options):
+    """
+    ArchiveReader for a task's shards, with flow_from_directory's decoding
+
+    Args:
+        archives: Archive paths, directories or glob patterns
+        task (str): 'age', 'gender' or 'expression'
+        target_size (tuple): (height, width)
+        color_mode (str): 'rgb' or 'grayscale'
+        labels (str): 'directory' or 'utkface'
+        subset (str): 'training' or 'validation'
+        transform (dict): ImageDataGenerator arguments (rescale, augmentation)
+        **options: Passed to ArchiveReader
+    """
+    from decode_workers import BatchDecoder
+
+    labeler, class_names = make_labeler(labels, task)
+    decoder = BatchDecoder(None, target_size, color_mode=color_mode, transform=transform)
+    return ArchiveReader(expand_shards(archives), labeler, decoder, class_names=class_names, subset=subset,
+                         **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream training samples from tar/zip dataset shards')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    index_parser = subparsers.add_parser('index', help='build the shard indexes and print the class counts')
+    bench_parser = subparsers.add_parser('benchmark', help='measure streaming and decode throughput')
+    bench_parser.add_argument('--batches', type=int, default=20,
+                      help='batches to read (default: 20)')
+    bench_parser.add_argument('--batch-size', type=int, default=32,
+                      help='images per batch (default: 32)')
+    bench_parser.add_argument('--readers', type=int, default=4,
+                      help='shards read concurrently (default: 4)')
+
+    for subparser in (index_parser, bench_parser):
+        subparser.add_argument('--archives', type=str, nargs='+', required=True,
+                          help='tar/zip shards, directories of shards or glob patterns')
+        subparser.add_argument('--task', type=str, choices=['age', 'gender', 'expression'], default='age',
+                          help='task whose classes and input size are used (default: age)')
+        subparser.add_argument('--archive-labels', type=str, choices=['directory', 'utkface'], default='directory',
+                          help='take labels from parent directories or UTKFace file names (default: directory)')
+        subparser.add_argument('--index-dir', type=str, default=None,
+                          help='directory for sidecar indexes (default: next to each shard)')
+
+    args = parser.parse_args(argv)
+
+    from streaming_eval import input_shape
+
+    height, width, channels = input_shape(args.task)
+    color_mode = 'grayscale' if channels == 1 else 'rgb'
+    try:
+        readers = {
+            subset: create_reader(args.archives, args.task, (height, width), color_mode, labels=args.archive_labels,
+                                  subset=subset, transform={'rescale': 1. / 255}, index_dir=args.index_dir,
+                                  readers=getattr(args, 'readers', 4))
+            for subset in ('training', 'validation')
+        }
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+
+    if args.command == 'index':
+        import numpy as np
+
+        train = readers['training']
+        print(f"{len(train.shards)} shard(s): {len(train.classes)} training, "
+              f"{len(readers['validation'].classes)} validation samples")
+        counts = np.bincount(train.classes, minlength=len(train.class_indices))
+        for name, i in train.class_indices.items():
+            print(f"  {name:<12} {counts[i]:8d}")
+        return
+
+    reader = readers['training']
+    reader.next_batch(args.batch_size)  # fill the shuffle buffer
+    start = time.perf_counter()
+    for _ in range(args.batches):
+        reader.next_batch(args.batch_size)
+    rate = args.batches * args.batch_size / (time.perf_counter() - start)
+    reader.close()
+    print(f"Streamed {args.batches} x {args.batch_size} images from {len(reader.shards)} shard(s) "
+          f"with {reader.readers} reader(s): {rate:.1f} images/sec")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Vectorized Batch Augmentation
+
+`ImageDataGenerator` applies rotation, shift, shear, zoom and flip one image
+at a time in Python. This module applies the same augmentation to a whole
+batch with tensor ops:
+
+- `augment_batch` samples one affine transform per image and warps the entire
+  batch with a single ImageProjectiveTransformV3 call
+- `BatchAugmentedSequence` wraps a training generator (with augmentation
+  disabled) and augments each batch as it is fetched
+- `add_augmentation_layers` prepends Keras preprocessing layers to a model so
+  augmentation runs inside the compiled training graph (these are identity at
+  inference and carry no shear, which Keras has no built-in layer for)
+
+The `benchmark` command compares images/sec of the three approaches.
+
+Usage:
+    python augmentation.py benchmark --task age --batches 20
+"""
+
+import math
+import time
+import argparse
+
+import tensorflow as tf
+
+from train_model import AUGMENTATION, BATCH_SIZE, IMG_SIZE, EMOTION_IMG_SIZE, LEARNING_RATE
+
+
+def random_affine_transforms(batch_size, height, width, rotation_range=20, width_shift_range=0.2,
+                             height_shift_range=0.2, shear_range=0.2, zoom_range=0.2,
+                             horizontal_flip=True, seed=None):
+    """
+    Sample one output-to-input affine transform per image
+
+    Parameters follow ImageDataGenerator: rotation and shear in degrees,
+    shifts as fractions of the image size, zoom in [1 - zoom_range, 1 + zoom_range].
+
+    Returns:
+        tf.Tensor: (batch_size, 8) transforms for ImageProjectiveTransformV3
+    """
+    rng = tf.random.Generator.from_seed(seed) if seed is not None else tf.random.get_global_generator()
+
+    def uniform(limit):
+        return rng.uniform((batch_size,), -limit, limit)
+
+    theta = uniform(rotation_range) * (math.pi / 180.0)
+    shear = uniform(shear_range) * (math.pi / 180.0)
+    tx = uniform(width_shift_range) * width
+    ty = uniform(height_shift_range) * height
+    zx = rng.uniform((batch_size,), 1.0 - zoom_range, 1.0 + zoom_range)
+    zy = rng.uniform((batch_size,), 1.0 - zoom_range, 1.0 + zoom_range)
+    if horizontal_flip:
+        flip = tf.where(rng.uniform((batch_size,)) < 0.5, -1.0, 1.0)
+    else:
+        flip = tf.ones((batch_size,))
+
+    # Compose rotation @ shear @ zoom @ flip in centred coordinates
+    cos_t, sin_t = tf.cos(theta), tf.sin(theta)
+    a00 = cos_t * zx * flip
+    a01 = (-cos_t * tf.sin(shear) - sin_t * tf.cos(shear)) * zy
+    a10 = sin_t * zx * flip
+    a11 = (-sin_t * tf.sin(shear) + cos_t * tf.cos(shear)) * zy
+
+    # Move the origin to the image centre, transform, move back, then shift
+    cx, cy = (width - 1) / 2.0, (height - 1) / 2.0
+    a02 = cx - a00 * cx - a01 * cy + tx
+    a12 = cy - a10 * cx - a11 * cy + ty
+
+    zeros = tf.zeros((batch_size,))
+    return tf.stack([a00, a01, a02, a10, a11, a12, zeros, zeros], axis=1)
+
+
+def augment_batch(images, seed=None, **options):
+    """
+    Augment a batch of images with one vectorized warp
+
+    Args:
+        images: (batch, height, width, channels) float array or tensor
+        seed (int): Optional seed for reproducible transforms
+        **options: Overrides for AUGMENTATION
+
+    Returns:
+        tf.Tensor: Augmented batch, same shape and dtype as images
+    """
+    images = tf.convert_to_tensor(images, dtype=tf.float32)
+    shape = tf.shape(images)
+    params = dict(AUGMENTATION, **options)
+    transforms = random_affine_transforms(shape[0], tf.cast(shape[1], tf.float32),
+                                          tf.cast(shape[2], tf.float32), seed=seed, **params)
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=shape[1:3],
+        fill_value=0.0,
+        interpolation='BILINEAR',
+        fill_mode='NEAREST'
+    )
+
+
+class BatchAugmentedSequence(tf.keras.utils.Sequence):
+    """
+    Wrap a Keras Sequence and augment each batch with augment_batch
+
+    The wrapped generator should have augmentation disabled (rescale only).
+    """
+
+    def __init__(self, sequence, **options):
+        super().__init__()
+        self.sequence = sequence
+        self.options = options
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, index):
+        images, labels = self.sequence[index]
+        return augment_batch(images, **self.options).numpy(), labels
+
+    def on_epoch_end(self):
+        self.sequence.on_epoch_end()
+
+    def __getattr__(self, name):
+        # Expose generator attributes such as class_indices and batch_size
+        if name == 'sequence':
+            raise AttributeError(name)
+        return getattr(self.sequence, name)
+
+
+def create_augmentation_layers():
+    """
+    Keras preprocessing layers equivalent to AUGMENTATION (without shear)
+    """
+    from tensorflow.keras import layers
+
+    return tf.keras.Sequential([
+        layers.RandomFlip('horizontal'),
+        layers.RandomRotation(AUGMENTATION['rotation_range'] / 360.0, fill_mode='nearest'),
+        layers.RandomTranslation(AUGMENTATION['height_shift_range'], AUGMENTATION['width_shift_range'],
+                                 fill_mode='nearest'),
+        layers.RandomZoom(AUGMENTATION['zoom_range'], fill_mode='nearest'),
+    ], name='augmentation')
+
+
+def add_augmentation_layers(model):
+    """
+    Prepend the augmentation layers to a model and compile it the same way as
+    the create_*_model functions. The layers are only active while training.
+    """
+    from tensorflow.keras.layers import Input
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.optimizers import Adam
+
+    inputs = Input(shape=model.input_shape[1:])
+    outputs = model(create_augmentation_layers()(inputs))
+    augmented = Model(inputs=inputs, outputs=outputs, name=f'{model.name}_augmented')
+
+    augmented.compile(
+        optimizer=Adam(learning_rate=LEARNING_RATE),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+
+    return augmented
+
+
+def benchmark(task='age', batches=20, batch_size=BATCH_SIZE):
+    """
+    Compare augmentation throughput (images/sec) on synthetic images
+
+    Returns:
+        dict: images/sec for the generator, batch warp and layer approaches
+    """
+    import numpy as np
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+    size = EMOTION_IMG_SIZE if task == 'expression' else IMG_SIZE
+    channels = 1 if task == 'expression' else 3
+    images = np.random.rand(batch_size * batches, size, size, channels).astype(np.float32)
+    labels = np.zeros((len(images), 1), dtype=np.float32)
+    results = {}
+
+    generator = ImageDataGenerator(**AUGMENTATION).flow(images, labels, batch_size=batch_size, shuffle=False)
+    start = time.perf_counter()
+    for i in range(batches):
+        generator[i]
+    results['generator'] = len(images) / (time.perf_counter() - start)
+
+    augment_batch(images[:batch_size])  # warm up
+    start = time.perf_counter()
+    for i in range(batches):
+        augment_batch(images[i * batch_size:(i + 1) * batch_size]).numpy()
+    results['batch'] = len(images) / (time.perf_counter() - start)
+
+    layers = create_augmentation_layers()
+    run_layers = tf.function(lambda x: layers(x, training=True))
+    run_layers(images[:batch_size])  # trace
+    start = time.perf_counter()
+    for i in range(batches):
+        run_layers(images[i * batch_size:(i + 1) * batch_size]).numpy()
+    results['layers'] = len(images) / (time.perf_counter() - start)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Vectorized batch augmentation tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    bench_parser = subparsers.add_parser('benchmark', help='compare augmentation throughput')
+    bench_parser.add_argument('--task', type=str, choices=['age', 'gender', 'expression'], default='age',
+                      help='input shape to benchmark (default: age)')
+    bench_parser.add_argument('--batches', type=int, default=20,
+                      help='batches per approach (default: 20)')
+    bench_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                      help=f'images per batch (default: {BATCH_SIZE})')
+
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.task, batches=args.batches, batch_size=args.batch_size)
+    baseline = results['generator']
+    print(f"Augmentation throughput for {args.task} inputs ({args.batches} x {args.batch_size} images):")
+    for name, rate in results.items():
+        print(f"  {name:<10} {rate:9.1f} images/sec  ({rate / baseline:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
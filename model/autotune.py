@@ -0,0 +1,337 @@
+"""
+Interpreter and Training Thread Autotuner
+
+The best TFLite `num_threads`, XNNPACK on/off and TensorFlow intra/inter-op
+thread counts depend on the CPU, so this script measures them on the current
+host and records the winners in a per-host config file:
+
+    models/host/<hostname>.json
+
+- each converted model is invoked with every thread count with and without
+  the XNNPACK delegate; the setting with the lowest batch-1 latency (or the
+  highest throughput at --batch-size with --objective throughput) wins
+- training runs a few steps of `train_on_batch` on synthetic data for each
+  intra/inter-op combination, each in a fresh process because TensorFlow's
+  thread pools cannot be changed once created; the highest examples/sec wins
+
+`tflite_inference.load_interpreter` (and so TFLiteModel, the inference server,
+video pipeline and evaluation tools) and `train_model.py` read this file
+automatically whenever no explicit thread setting is passed. Set
+EDGE_AI_HOST_CONFIG to use a different file.
+
+Usage:
+    python autotune.py tune --models-dir models --training-task age
+    python autotune.py tune --models models/age/age_model.tflite --threads 1 2 4 --skip-training
+    python autotune.py show
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+import platform
+import functools
+
+DEFAULT_CONFIG_DIR = os.path.join('models', 'host')
+
+HOST_CONFIG_ENV = 'EDGE_AI_HOST_CONFIG'
+
+
+def host_config_path(config_dir=DEFAULT_CONFIG_DIR):
+    """
+    Config file for this host: $EDGE_AI_HOST_CONFIG or <config_dir>/<hostname>.json
+    """
+    if os.environ.get(HOST_CONFIG_ENV):
+        return os.environ[HOST_CONFIG_ENV]
+    host = re.sub(r'[^A-Za-z0-9_.-]', '_', platform.node() or 'localhost')
+    return os.path.join(config_dir, f'{host}.json')
+
+
+@functools.lru_cache(maxsize=None)
+def _read_config(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_host_config(path=None):
+    """
+    The tuned settings of this host, or {} when it has not been tuned
+    """
+    return _read_config(path or host_config_path())
+
+
+def interpreter_settings(model_path, config=None):
+    """
+    Tuned interpreter options for a model: its own entry (by file name),
+    else the host-wide default
+
+    Returns:
+        dict: 'num_threads' and 'xnnpack', or {} when untuned
+    """
+    config = load_host_config() if config is None else config
+    tflite = config.get('tflite', {})
+    entry = tflite.get('models', {}).get(os.path.basename(model_path)) or tflite.get('default') or {}
+    return {key: entry[key] for key in ('num_threads', 'xnnpack') if key in entry}
+
+
+def training_settings(task=None, config=None):
+    """
+    Tuned TensorFlow thread pools for a task (else any tuned task)
+
+    Returns:
+        dict: 'intra_op_threads' and 'inter_op_threads', or {} when untuned
+    """
+    config = load_host_config() if config is None else config
+    training = config.get('training', {})
+    entry = training.get(task) or next(iter(training.values()), {})
+    return {key: entry[key] for key in ('intra_op_threads', 'inter_op_threads') if key in entry}
+
+
+def apply_training_settings(intra_op_threads=None, inter_op_threads=None, task=None):
+    """
+    Set TensorFlow's thread pools from explicit values or the host config;
+    must run before TensorFlow executes any op
+
+    Returns:
+        dict: The settings applied ({} if none)
+    """
+    settings = training_settings(task)
+    if intra_op_threads:
+        settings['intra_op_threads'] = intra_op_threads
+    if inter_op_threads:
+        settings['inter_op_threads'] = inter_op_threads
+    if not settings:
+        return settings
+
+    import tensorflow as tf
+
+    if 'intra_op_threads' in settings:
+        tf.config.threading.set_intra_op_parallelism_threads(settings['intra_op_threads'])
+    if 'inter_op_threads' in settings:
+        tf.config.threading.set_inter_op_parallelism_threads(settings['inter_op_threads'])
+    return settings
+
+
+def default_thread_options():
+    """
+    1, 2, 4, ... up to the number of CPUs (always including it)
+    """
+    cpus = os.cpu_count() or 1
+    options = []
+    threads = 1
+    while threads < cpus:
+        options.append(threads)
+        threads *= 2
+    return options + [cpus]
+
+
+def tune_interpreter(model_path, thread_options, runs=50, batch_size=8, objective='latency'):
+    """
+    Measure a model under every thread count with and without XNNPACK
+
+    Returns:
+        Tuple of (best setting dict, list of all measured settings)
+    """
+    from tflite_profiler import measure_invoke
+
+    results = []
+    for xnnpack in (True, False):
+        for threads in thread_options:
+            latency = measure_invoke(model_path, runs=runs, num_threads=threads, xnnpack=xnnpack)
+            batched = measure_invoke(model_path, runs=max(runs // 4, 5), num_threads=threads, xnnpack=xnnpack,
+                                     batch_size=batch_size)
+            results.append({
+                'num_threads': threads,
+                'xnnpack': xnnpack,
+                'latency_ms': latency['mean_ms'],
+                'p90_ms': latency['p90_ms'],
+                'images_per_sec': 1000 * batch_size / batched['mean_ms'],
+            })
+            print(f"  threads={threads:<3} xnnpack={'on ' if xnnpack else 'off'} "
+                  f"{results[-1]['latency_ms']:8.2f} ms  {results[-1]['images_per_sec']:9.1f} images/sec")
+
+    if objective == 'throughput':
+        best = max(results, key=lambda row: row['images_per_sec'])
+    else:
+        best = min(results, key=lambda row: row['latency_ms'])
+    return dict(best, objective=objective), results
+
+
+def _training_benchmark(task, intra_op_threads, inter_op_threads, steps, batch_size):
+    """
+    Examples/sec of `train_on_batch` on synthetic data (runs in a fresh
+    process so the thread pools can still be configured)
+    """
+    import numpy as np
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+    from train_model import create_model
+
+    model = create_model(task)
+    images = np.random.rand(batch_size, *model.input_shape[1:]).astype(np.float32)
+    classes = model.output_shape[-1]
+    labels = np.eye(classes, dtype=np.float32)[np.random.randint(classes, size=batch_size)]
+    for _ in range(2):
+        model.train_on_batch(images, labels)
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.train_on_batch(images, labels)
+    return steps * batch_size / (time.perf_counter() - start)
+
+
+def tune_training(task, thread_options, inter_op_options=(1, 2), steps=10, batch_size=32):
+    """
+    Measure training throughput for each intra/inter-op combination, one
+    process at a time
+
+    Returns:
+        Tuple of (best setting dict, list of all measured settings)
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for inter in inter_op_options:
+        for intra in thread_options:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                rate = pool.submit(_training_benchmark, task, intra, inter, steps, batch_size).result()
+            results.append({'intra_op_threads': intra, 'inter_op_threads': inter, 'examples_per_sec': rate})
+            print(f"  intra={intra:<3} inter={inter:<2} {rate:9.1f} examples/sec")
+    return max(results, key=lambda row: row['examples_per_sec']), results
+
+
+def find_models(models_dir):
+    """
+    Converted models under models_dir (<task>/*.tflite)
+    """
+    found = []
+    for dirpath, _, filenames in os.walk(models_dir):
+        found.extend(os.path.join(dirpath, name) for name in sorted(filenames) if name.endswith('.tflite'))
+    return sorted(found)
+
+
+def write_host_config(updates, path=None):
+    """
+    Merge tuned settings into the host config file
+
+    Returns:
+        str: The config path
+    """
+    path = path or host_config_path()
+    config = dict(_read_config(path))
+    config.update({
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'tuned_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    })
+    for section in ('tflite', 'training'):
+        if section in updates:
+            merged = dict(config.get(section, {}))
+            for key, value in updates[section].items():
+                merged[key] = dict(merged.get(key, {}), **value) if key == 'models' else value
+            config[section] = merged
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2)
+    _read_config.cache_clear()
+    return path
+
+
+def print_config(config, path):
+    if not config:
+        print(f"No tuned settings for this host ({path})")
+        return
+    print(f"{path} (tuned {config.get('tuned_at')}, {config.get('cpu_count')} CPUs)")
+    tflite = config.get('tflite', {})
+    for name, entry in sorted(tflite.get('models', {}).items()):
+        print(f"  {name:<32} threads={entry['num_threads']:<3} xnnpack={'on' if entry['xnnpack'] else 'off'} "
+              f"{entry['latency_ms']:.2f} ms, {entry['images_per_sec']:.1f} images/sec")
+    if 'default' in tflite:
+        print(f"  {'(other models)':<32} threads={tflite['default']['num_threads']:<3} "
+              f"xnnpack={'on' if tflite['default']['xnnpack'] else 'off'}")
+    for task, entry in sorted(config.get('training', {}).items()):
+        print(f"  training {task:<23} intra={entry['intra_op_threads']:<3} inter={entry['inter_op_threads']:<2} "
+              f"{entry['examples_per_sec']:.1f} examples/sec")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tune interpreter and training thread settings for this host')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    tune_parser = subparsers.add_parser('tune', help='measure settings and write the host config')
+    tune_parser.add_argument('--models', type=str, nargs='+', default=None,
+                      help='.tflite models to tune (default: every .tflite under --models-dir)')
+    tune_parser.add_argument('--models-dir', type=str, default='models',
+                      help='directory searched for .tflite models (default: models)')
+    tune_parser.add_argument('--threads', type=int, nargs='+', default=None,
+                      help='thread counts to try (default: 1, 2, 4, ... up to the CPU count)')
+    tune_parser.add_argument('--objective', type=str, choices=['latency', 'throughput'], default='latency',
+                      help='pick interpreter settings by batch-1 latency or batched throughput (default: latency)')
+    tune_parser.add_argument('--batch-size', type=int, default=8,
+                      help='batch size for the throughput measurement (default: 8)')
+    tune_parser.add_argument('--runs', type=int, default=50,
+                      help='timed invokes per setting (default: 50)')
+    tune_parser.add_argument('--training-task', type=str, choices=['age', 'gender', 'expression'], default=None,
+                      help='also tune TensorFlow thread pools by training this task on synthetic data')
+    tune_parser.add_argument('--training-steps', type=int, default=10,
+                      help='timed training steps per setting (default: 10)')
+    tune_parser.add_argument('--skip-training', action='store_true',
+                      help='only tune interpreters')
+    tune_parser.add_argument('--config', type=str, default=None,
+                      help='config file to write (default: models/host/<hostname>.json); other tools '
+                           f'only read it when ${HOST_CONFIG_ENV} points at it')
+
+    show_parser = subparsers.add_parser('show', help='print the tuned settings of this host')
+    show_parser.add_argument('--config', type=str, default=None,
+                      help='config file to read (default: models/host/<hostname>.json)')
+
+    args = parser.parse_args(argv)
+    path = args.config or host_config_path()
+
+    if args.command == 'show':
+        print_config(load_host_config(path), path)
+        return
+
+    thread_options = args.threads or default_thread_options()
+    models = args.models or find_models(args.models_dir)
+    updates = {}
+
+    if models:
+        tuned = {}
+        for model_path in models:
+            print(f"Tuning {model_path}")
+            best, _ = tune_interpreter(model_path, thread_options, runs=args.runs, batch_size=args.batch_size,
+                                       objective=args.objective)
+            tuned[os.path.basename(model_path)] = best
+        # Host-wide default for models tuned elsewhere: the most common winner
+        winners = [(entry['num_threads'], entry['xnnpack']) for entry in tuned.values()]
+        threads, xnnpack = max(set(winners), key=winners.count)
+        updates['tflite'] = {'models': tuned, 'default': {'num_threads': threads, 'xnnpack': xnnpack}}
+    else:
+        print(f"No .tflite models found under {args.models_dir}")
+
+    if args.training_task and not args.skip_training:
+        print(f"Tuning training threads for {args.training_task}")
+        best, _ = tune_training(args.training_task, thread_options, steps=args.training_steps)
+        updates['training'] = {args.training_task: best}
+
+    if updates:
+        write_host_config(updates, path)
+        print()
+        print_config(load_host_config(path), path)
+        if os.path.abspath(path) != os.path.abspath(host_config_path()):
+            print(f"Note: {path} is not this host's config; set {HOST_CONFIG_ENV}={path} to apply it")
+
+
+if __name__ == '__main__':
+    main()
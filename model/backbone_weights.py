@@ -0,0 +1,249 @@
+"""
+Offline MobileNetV2 Backbone Weight Bundle
+
+`train_model.create_base_model` used to pass `weights='imagenet'`, which
+makes Keras download the ImageNet weights whenever its cache is empty; the
+training nodes have no network access. This script pre-fetches the weight
+files once into a versioned bundle that can be copied to those nodes:
+
+    models/backbones/manifest.json    version, source and SHA-256 per file
+    models/backbones/<keras file>.h5  one no-top weight file per alpha/size
+
+`create_base_model` resolves its weights from the bundle (EDGE_AI_BACKBONE_WEIGHTS
+overrides the directory), verifies the checksum once per process and builds
+each backbone variant only once, cloning its weights for every later head.
+When the bundle has no entry for a variant it warns and falls back to the
+Keras download; a checksum mismatch is an error.
+
+By default the variants the repo trains are fetched: alpha 1.0 at 224 (age,
+gender) and alpha 0.35 at 96 (fast cascade models, face embeddings).
+
+Usage:
+    python backbone_weights.py fetch --version 2024.1
+    python backbone_weights.py fetch --source ~/.keras/models --variants 1.0:224 0.35:96
+    python backbone_weights.py verify --bundle-dir /mnt/shared/backbones
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import warnings
+import functools
+
+from model_registry import file_digest
+
+DEFAULT_BUNDLE_DIR = os.path.join('models', 'backbones')
+
+BUNDLE_DIR_ENV = 'EDGE_AI_BACKBONE_WEIGHTS'
+
+KERAS_WEIGHTS_URL = 'https://storage.googleapis.com/tensorflow/keras-applications/mobilenet_v2/'
+
+# Input sizes Keras has MobileNetV2 weights for; any other size uses the 224 weights
+WEIGHT_SIZES = (96, 128, 160, 192, 224)
+
+DEFAULT_VARIANTS = ((1.0, 224), (0.35, 96))
+
+MANIFEST = 'manifest.json'
+
+
+def bundle_dir(path=None):
+    """
+    Bundle directory: path, else $EDGE_AI_BACKBONE_WEIGHTS, else models/backbones
+    """
+    return path or os.environ.get(BUNDLE_DIR_ENV) or DEFAULT_BUNDLE_DIR
+
+
+def weight_file_name(alpha, size):
+    """
+    Keras' file name for the no-top MobileNetV2 weights of a width
+    multiplier and input size
+    """
+    size = size if size in WEIGHT_SIZES else 224
+    return f'mobilenet_v2_weights_tf_dim_ordering_tf_kernels_{float(alpha)}_{size}_no_top.h5'
+
+
+def read_manifest(path=None):
+    """
+    The bundle's manifest, or None when the directory holds no bundle
+    """
+    manifest_path = os.path.join(bundle_dir(path), MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def _verified_digest(path, size, mtime_ns):
+    # Keyed by size and mtime so each file is hashed once per process
+    return file_digest(path)
+
+
+def verify_file(path, expected_sha256):
+    """
+    Raise ValueError unless the file's SHA-256 matches the manifest
+    """
+    stat = os.stat(path)
+    digest = _verified_digest(path, stat.st_size, stat.st_mtime_ns)
+    if digest != expected_sha256:
+        raise ValueError(f"Checksum mismatch for {path}: expected {expected_sha256[:12]}, got {digest[:12]}; "
+                         f"re-run `backbone_weights.py fetch`")
+
+
+def resolve_weights(input_shape, alpha=1.0, path=None):
+    """
+    Verified local weight file for a backbone variant
+
+    Args:
+        input_shape: Backbone input shape (rows, cols, channels)
+        alpha: MobileNetV2 width multiplier
+        path: Bundle directory (default: see bundle_dir)
+
+    Returns:
+        str: Path to the .h5 file, or 'imagenet' (Keras download) when the
+            bundle has no entry for this variant
+    """
+    directory = bundle_dir(path)
+    name = weight_file_name(alpha, input_shape[0])
+    entry = ((read_manifest(directory) or {}).get('files') or {}).get(name)
+    if entry is None:
+        warnings.warn(f"No {name} in the backbone bundle {directory}; downloading ImageNet weights instead. "
+                      f"Run `python cli.py backbone-weights fetch` to pre-fetch them")
+        return 'imagenet'
+
+    weights_path = os.path.join(directory, name)
+    if not os.path.exists(weights_path):
+        raise FileNotFoundError(f"{weights_path} is listed in {MANIFEST} but missing")
+    verify_file(weights_path, entry['sha256'])
+    return weights_path
+
+
+def bundle_version(path=None):
+    """
+    Version string of the bundle, or None when there is no bundle
+    """
+    manifest = read_manifest(path)
+    return manifest.get('version') if manifest else None
+
+
+def parse_variant(value):
+    """
+    Parse an 'alpha:size' variant such as '0.35:96'
+    """
+    alpha, _, size = value.partition(':')
+    try:
+        return float(alpha), int(size or 224)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected ALPHA:SIZE, got {value!r}")
+
+
+def fetch(variants=DEFAULT_VARIANTS, path=None, version=None, source=KERAS_WEIGHTS_URL):
+    """
+    Download (or copy from a local directory such as ~/.keras/models) the
+    weight files of each variant into the bundle and record their checksums
+
+    Args:
+        variants: Iterable of (alpha, input size)
+        path: Bundle directory (default: see bundle_dir)
+        version: Bundle version (default: today's date)
+        source: Base URL, or a directory holding the Keras weight files
+
+    Returns:
+        dict: The written manifest
+    """
+    from urllib.request import urlretrieve
+
+    directory = bundle_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory) or {'files': {}}
+
+    for alpha, size in variants:
+        name = weight_file_name(alpha, size)
+        target = os.path.join(directory, name)
+        partial = target + '.part'
+        if os.path.isdir(os.path.expanduser(source)):
+            shutil.copyfile(os.path.join(os.path.expanduser(source), name), partial)
+        else:
+            print(f"Downloading {name}")
+            urlretrieve(source.rstrip('/') + '/' + name, partial)
+        os.replace(partial, target)
+        manifest['files'][name] = {
+            'alpha': float(alpha),
+            'size': size if size in WEIGHT_SIZES else 224,
+            'bytes': os.path.getsize(target),
+            'sha256': file_digest(target),
+        }
+
+    manifest['version'] = version or time.strftime('%Y.%m.%d')
+    manifest['source'] = source
+    manifest['created'] = time.time()
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def verify(path=None):
+    """
+    Check every file in the bundle against its manifest checksum
+
+    Returns:
+        list: (file name, error or None) per manifest entry
+    """
+    directory = bundle_dir(path)
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No {MANIFEST} in {directory}")
+
+    results = []
+    for name, entry in sorted(manifest['files'].items()):
+        try:
+            verify_file(os.path.join(directory, name), entry['sha256'])
+            results.append((name, None))
+        except (OSError, ValueError) as e:
+            results.append((name, str(e)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-fetch and verify the offline MobileNetV2 weight bundle')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help='download the backbone weights into the bundle')
+    fetch_parser.add_argument('--variants', type=parse_variant, nargs='+', default=list(DEFAULT_VARIANTS),
+                      metavar='ALPHA:SIZE',
+                      help='backbone variants to fetch (default: 1.0:224 0.35:96)')
+    fetch_parser.add_argument('--version', type=str, default=None,
+                      help="bundle version recorded in the manifest (default: today's date)")
+    fetch_parser.add_argument('--source', type=str, default=KERAS_WEIGHTS_URL,
+                      help='base URL, or a directory such as ~/.keras/models to copy the files from '
+                           '(default: the Keras applications bucket)')
+
+    verify_parser = subparsers.add_parser('verify', help='check the bundle files against their checksums')
+
+    for subparser in (fetch_parser, verify_parser):
+        subparser.add_argument('--bundle-dir', type=str, default=None,
+                          help=f'bundle directory (default: ${BUNDLE_DIR_ENV} or {DEFAULT_BUNDLE_DIR})')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'fetch':
+        manifest = fetch(args.variants, path=args.bundle_dir, version=args.version, source=args.source)
+        print(f"Bundle {manifest['version']} written to {bundle_dir(args.bundle_dir)}")
+        for name, entry in sorted(manifest['files'].items()):
+            print(f"  {name}  {entry['bytes'] / 1e6:.1f} MB  sha256 {entry['sha256'][:12]}")
+    else:
+        try:
+            results = verify(args.bundle_dir)
+        except FileNotFoundError as e:
+            parser.error(str(e))
+        print(f"Bundle {bundle_version(args.bundle_dir)} in {bundle_dir(args.bundle_dir)}")
+        for name, error in results:
+            print(f"  {'OK  ' if error is None else 'FAIL'} {name}" + (f": {error}" if error else ''))
+        if any(error for _, error in results):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+Confidence-Gated Age/Gender Cascade Tuning
+
+A cascade runs a small fast model (`train_model.py --variant fast`, MobileNetV2
+alpha 0.35 at 96x96) on every face and escalates only the crops whose
+top-class confidence is below a threshold to the full model
+(tflite_inference.CascadeModel). This script picks that threshold:
+
+- both converted models are run once over an evaluation set, streamed in
+  chunks as in streaming_eval.py; per face only the fast model's confidence
+  and whether each model was right are kept
+- with --data-dir, crops are read at their native size and each model
+  resizes them itself, as CascadeModel does at runtime. A --cache holds
+  crops already resized to the full model's size, so the fast model sees a
+  second resize and its confidences can differ from the deployed path
+- each stage's per-face cost is its measured batch-1 invoke latency
+- every threshold is then scored without re-running inference: accuracy,
+  share of faces escalated, and average cost per face
+  (fast + escalated share x full)
+
+The suggested threshold is the cheapest one within --max-accuracy-drop of the
+full model's accuracy; pass it to `video_pipeline.py --cascade-threshold`.
+
+Usage:
+    python cascade.py sweep --task age --fast-model models/age/age_fast_model.tflite \\
+        --full-model models/age/age_model.tflite --data-dir model/data/test/age
+    python cascade.py sweep --task gender --fast-model models/gender/gender_fast_model.tflite \\
+        --full-model models/gender/gender_model.tflite --cache eval_cache/gender --max-accuracy-drop 0.005
+"""
+
+import os
+import json
+import argparse
+
+from face_store import iter_images
+from streaming_eval import class_names, iter_cache_chunks
+from tflite_inference import TASKS
+
+CASCADE_TASKS = ('age', 'gender')
+
+DEFAULT_THRESHOLDS = [round(0.05 * i, 2) for i in range(8, 20)] + [0.97, 0.99]
+
+
+def iter_native_chunks(data_dir, task, chunk_size=256):
+    """
+    Yield (uint8 crops at their native size, class indices) chunks in the
+    task's color mode, leaving the resize to each model as at runtime
+    """
+    import numpy as np
+    from PIL import Image
+
+    _, _, color_mode = TASKS[task]
+    classes = {name: i for i, name in enumerate(class_names(data_dir))}
+    crops, targets = [], []
+    for path, label in iter_images(data_dir):
+        if label not in classes:
+            continue
+        with Image.open(path) as image:
+            crops.append(np.asarray(image.convert('L' if color_mode == 'grayscale' else 'RGB'), dtype=np.uint8))
+        targets.append(classes[label])
+        if len(crops) == chunk_size:
+            yield crops, np.array(targets, dtype=np.int64)
+            crops, targets = [], []
+    if crops:
+        yield crops, np.array(targets, dtype=np.int64)
+
+
+def collect_predictions(fast, full, chunks, max_batch_size=64):
+    """
+    Run both stages over uint8 chunks and keep per-face outcomes only
+
+    Args:
+        fast (TFLiteModel): First-stage model
+        full (TFLiteModel): Full model
+        chunks: Iterable of (uint8 images or list of crops, class indices)
+        max_batch_size (int): Faces per invoke
+
+    Returns:
+        dict: 'confidence' (fast top-class probability), 'fast_correct' and
+            'full_correct' arrays, one entry per face
+    """
+    import numpy as np
+
+    confidence, fast_correct, full_correct = [], [], []
+    for images, targets in chunks:
+        for offset in range(0, len(images), max_batch_size):
+            # uint8 crops; each model resizes them to its own input
+            crops = list(images[offset:offset + max_batch_size])
+            batch_targets = targets[offset:offset + max_batch_size]
+            fast_probabilities = fast.predict(crops)
+            full_probabilities = full.predict(crops)
+            confidence.append(fast_probabilities.max(axis=1))
+            fast_correct.append(fast_probabilities.argmax(axis=1) == batch_targets)
+            full_correct.append(full_probabilities.argmax(axis=1) == batch_targets)
+
+    if not confidence:
+        raise ValueError("The evaluation set is empty")
+    return {
+        'confidence': np.concatenate(confidence).astype(np.float32),
+        'fast_correct': np.concatenate(fast_correct),
+        'full_correct': np.concatenate(full_correct),
+    }
+
+
+def stage_cost_ms(tflite_path, runs=50, num_threads=None):
+    """
+    Batch-1 mean invoke latency of a stage, used as its cost per face
+    """
+    from tflite_profiler import measure_invoke
+
+    return measure_invoke(tflite_path, runs=runs, num_threads=num_threads)['mean_ms']
+
+
+def sweep_thresholds(predictions, thresholds, fast_ms, full_ms):
+    """
+    Score the cascade at each confidence threshold
+
+    Returns:
+        list: One dict per threshold with accuracy, escalation_rate and
+            cost_ms (average per face), in threshold order
+    """
+    import numpy as np
+
+    confidence = predictions['confidence']
+    rows = []
+    for threshold in sorted(thresholds):
+        escalate = confidence < threshold
+        correct = np.where(escalate, predictions['full_correct'], predictions['fast_correct'])
+        rate = float(escalate.mean())
+        rows.append({
+            'threshold': float(threshold),
+            'accuracy': float(correct.mean()),
+            'escalation_rate': rate,
+            'cost_ms': fast_ms + rate * full_ms,
+        })
+    return rows
+
+
+def suggest_threshold(rows, full_accuracy, max_accuracy_drop=0.01):
+    """
+    Cheapest threshold whose accuracy is within max_accuracy_drop of the full
+    model's, or None if no threshold qualifies
+    """
+    eligible = [row for row in rows if row['accuracy'] >= full_accuracy - max_accuracy_drop]
+    return min(eligible, key=lambda row: (row['cost_ms'], -row['accuracy'])) if eligible else None
+
+
+def print_sweep(result):
+    baselines = result['baselines']
+    print(f"\nFaces: {result['faces']}")
+    print(f"Fast only: accuracy {baselines['fast']['accuracy']:.4f}, {baselines['fast']['cost_ms']:.2f} ms/face")
+    print(f"Full only: accuracy {baselines['full']['accuracy']:.4f}, {baselines['full']['cost_ms']:.2f} ms/face")
+    print(f"\n{'Threshold':>10}{'Accuracy':>10}{'Escalated':>11}{'ms/face':>9}{'Speedup':>9}")
+    for row in result['sweep']:
+        speedup = baselines['full']['cost_ms'] / row['cost_ms'] if row['cost_ms'] else 0.0
+        print(f"{row['threshold']:>10.2f}{row['accuracy']:>10.4f}{100 * row['escalation_rate']:>10.1f}%"
+              f"{row['cost_ms']:>9.2f}{speedup:>8.2f}x")
+
+    suggested = result['suggested']
+    if suggested:
+        print(f"\nSuggested --cascade-threshold {suggested['threshold']:.2f}: accuracy {suggested['accuracy']:.4f}, "
+              f"{suggested['cost_ms']:.2f} ms/face ({100 * suggested['escalation_rate']:.1f}% escalated)")
+    else:
+        print(f"\nNo threshold is within {result['max_accuracy_drop']} of the full model's accuracy")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tune the confidence threshold of an age/gender model cascade')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sweep_parser = subparsers.add_parser('sweep', help='report accuracy vs cost per face for each threshold')
+    sweep_parser.add_argument('--task', type=str, choices=CASCADE_TASKS, required=True,
+                      help='task of both models')
+    sweep_parser.add_argument('--fast-model', type=str, required=True,
+                      help='first-stage .tflite model (train_model.py --variant fast)')
+    sweep_parser.add_argument('--full-model', type=str, required=True,
+                      help='full .tflite model')
+    sweep_parser.add_argument('--data-dir', type=str, default=None,
+                      help='evaluation set with one sub-directory per class')
+    sweep_parser.add_argument('--cache', type=str, default=None,
+                      help='evaluation cache built with streaming_eval.py cache')
+    sweep_parser.add_argument('--thresholds', type=float, nargs='+', default=DEFAULT_THRESHOLDS,
+                      help='confidence thresholds to score (default: 0.40 to 0.99)')
+    sweep_parser.add_argument('--max-accuracy-drop', type=float, default=0.01,
+                      help='accuracy loss vs the full model allowed for the suggestion (default: 0.01)')
+    sweep_parser.add_argument('--chunk-size', type=int, default=256,
+                      help='images read per chunk (default: 256)')
+    sweep_parser.add_argument('--batch-size', type=int, default=64,
+                      help='faces per invoke (default: 64)')
+    sweep_parser.add_argument('--threads', type=int, default=None,
+                      help='interpreter threads, for inference and latency measurement')
+    sweep_parser.add_argument('--runs', type=int, default=50,
+                      help='timed invokes per model for the cost estimate (default: 50)')
+    sweep_parser.add_argument('--json', type=str, default=None,
+                      help='also write the sweep to this JSON file')
+
+    args = parser.parse_args(argv)
+
+    if bool(args.data_dir) == bool(args.cache):
+        parser.error('pass exactly one of --data-dir or --cache')
+
+    from tflite_inference import TFLiteModel
+
+    if args.cache:
+        with open(os.path.join(args.cache, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['task'] != args.task:
+            parser.error(f"cache {args.cache} was built for task {meta['task']}")
+        print(f"Note: cached crops are already resized to {meta['shape'][0]} px and the fast model resizes "
+              f"them again, unlike at runtime; use --data-dir for native-size crops")
+        chunks = iter_cache_chunks(args.cache, args.chunk_size)
+    else:
+        chunks = iter_native_chunks(args.data_dir, args.task, args.chunk_size)
+
+    fast = TFLiteModel(args.fast_model, args.task, num_threads=args.threads)
+    full = TFLiteModel(args.full_model, args.task, num_threads=args.threads)
+    predictions = collect_predictions(fast, full, chunks, max_batch_size=args.batch_size)
+
+    fast_ms = stage_cost_ms(args.fast_model, runs=args.runs, num_threads=args.threads)
+    full_ms = stage_cost_ms(args.full_model, runs=args.runs, num_threads=args.threads)
+    rows = sweep_thresholds(predictions, args.thresholds, fast_ms, full_ms)
+    full_accuracy = float(predictions['full_correct'].mean())
+
+    result = {
+        'task': args.task,
+        'faces': len(predictions['confidence']),
+        'baselines': {
+            'fast': {'accuracy': float(predictions['fast_correct'].mean()), 'cost_ms': fast_ms},
+            'full': {'accuracy': full_accuracy, 'cost_ms': full_ms},
+        },
+        'sweep': rows,
+        'max_accuracy_drop': args.max_accuracy_drop,
+        'suggested': suggest_threshold(rows, full_accuracy, args.max_accuracy_drop),
+    }
+    print_sweep(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Sweep written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
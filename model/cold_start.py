@@ -0,0 +1,274 @@
+"""
+Model Cold-Start and Worker Memory Benchmark
+
+Autoscaled inference workers start and stop constantly, so the time to a
+first result and the memory each worker adds matter as much as steady-state
+latency. This script starts N fresh worker processes at once for each
+loading mode and reports, per mode:
+
+- TensorFlow import, interpreter load and first invoke time
+- per-process RSS and PSS (proportional set size: shared pages are divided
+  between the processes mapping them, so PSS drops as workers share more)
+- RSS/PSS of the model file mapping itself
+
+Modes:
+    bytes   the file is read into Python bytes (`model_content`); every
+            worker holds a private copy
+    mmap    loaded by path, as tflite_inference.load_interpreter does; TFLite
+            memory-maps the file and workers share it through the page cache
+    cache   mmap plus a persisted XNNPACK weight cache, so packed weights are
+            mapped from disk instead of repacked; needs the XNNPACK delegate
+            library (TFLITE_XNNPACK_DELEGATE). The cache is filled by one
+            warm-up worker before the measured start
+
+Memory figures come from /proc/self/smaps_rollup and are Linux only.
+
+Usage:
+    python cold_start.py models/age/age_model.tflite --workers 4
+    python cold_start.py models/age/age_model.tflite --workers 8 --modes mmap cache \\
+        --weight-cache-dir /tmp/xnnpack
+"""
+
+import os
+import json
+import time
+import queue
+import threading
+import argparse
+import tempfile
+
+MODES = ('bytes', 'mmap', 'cache')
+
+
+def process_memory(model_path=None):
+    """
+    RSS and PSS of this process in MB, plus those of the model file's
+    mapping when model_path is given (Linux only; {} elsewhere)
+    """
+    memory = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    memory[key.lower() + '_mb'] = int(value.split()[0]) / 1024
+    except OSError:
+        return memory
+
+    if model_path:
+        target = os.path.realpath(model_path)
+        mapped = {'Rss': 0, 'Pss': 0}
+        current = False
+        with open('/proc/self/smaps') as f:
+            for line in f:
+                fields = line.split()
+                if '-' in fields[0] and len(fields) >= 5:
+                    # Mapping header: address perms offset dev inode [path]
+                    current = len(fields) >= 6 and fields[5] == target
+                elif current and fields[0].rstrip(':') in mapped:
+                    mapped[fields[0].rstrip(':')] += int(fields[1])
+        memory['model_rss_mb'] = mapped['Rss'] / 1024
+        memory['model_pss_mb'] = mapped['Pss'] / 1024
+    return memory
+
+
+def _worker(model_path, mode, num_threads, weight_cache_dir, barrier, results, timeout):
+    """
+    One worker process: import, load, first invoke, then report memory once
+    every worker is loaded
+
+    A failing worker reports its error and breaks the barrier, so the others
+    stop waiting for it.
+    """
+    try:
+        result = _cold_start(model_path, mode, num_threads, weight_cache_dir)
+        # Measure memory while all workers are alive, so PSS reflects sharing
+        barrier.wait(timeout)
+        result.update(process_memory(model_path))
+    except threading.BrokenBarrierError:
+        results.put({'error': 'another worker failed or timed out', 'broken_barrier': True})
+        return
+    except Exception as e:
+        barrier.abort()
+        results.put({'error': f'{type(e).__name__}: {e}'})
+        return
+    results.put(result)
+    try:
+        barrier.wait(timeout)
+    except threading.BrokenBarrierError:
+        pass
+
+
+def _cold_start(model_path, mode, num_threads, weight_cache_dir):
+    """
+    Import, load and invoke once, timing each stage
+    """
+    start = time.perf_counter()
+    import numpy as np
+    import tensorflow as tf
+    from tflite_inference import WEIGHT_CACHE_DIR_ENV, load_interpreter
+    imported = time.perf_counter()
+
+    if mode != 'cache':
+        # Only the cache mode may pick up a weight cache from the environment
+        os.environ.pop(WEIGHT_CACHE_DIR_ENV, None)
+
+    if mode == 'bytes':
+        with open(model_path, 'rb') as f:
+            content = f.read()
+        interpreter = tf.lite.Interpreter(model_content=content, num_threads=num_threads)
+        interpreter.allocate_tensors()
+    else:
+        interpreter = load_interpreter(model_path, num_threads=num_threads, use_host_config=False,
+                                       weight_cache_dir=weight_cache_dir if mode == 'cache' else None)
+    loaded = time.perf_counter()
+
+    detail = interpreter.get_input_details()[0]
+    if np.issubdtype(detail['dtype'], np.integer):
+        data = np.zeros(detail['shape'], dtype=detail['dtype'])
+    else:
+        data = np.random.rand(*detail['shape']).astype(detail['dtype'])
+    interpreter.set_tensor(detail['index'], data)
+    interpreter.invoke()
+    invoked = time.perf_counter()
+
+    return {
+        'import_ms': (imported - start) * 1000,
+        'load_ms': (loaded - imported) * 1000,
+        'first_invoke_ms': (invoked - loaded) * 1000,
+        'cold_start_ms': (invoked - start) * 1000,
+    }
+
+
+def start_workers(model_path, mode, workers, num_threads=1, weight_cache_dir=None, timeout=300):
+    """
+    Start `workers` fresh processes at once and collect their measurements
+
+    Args:
+        timeout (float): Seconds to wait for the workers at each stage
+
+    Returns:
+        list: One result dict per worker
+
+    Raises:
+        RuntimeError: A worker failed (e.g. a delegate load error) or did not
+            report in time; all workers are stopped first
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    worker_args = (model_path, mode, num_threads, weight_cache_dir, barrier, results, timeout)
+    processes = [context.Process(target=_worker, args=worker_args, daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        collected = [results.get(timeout=timeout) for _ in processes]
+    except queue.Empty:
+        collected = [{'error': f'no result within {timeout} s'}]
+    finally:
+        for process in processes:
+            process.join(5.0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    # Report the worker that failed, not the ones it released from the barrier
+    errors = sorted((r for r in collected if 'error' in r), key=lambda r: r.get('broken_barrier', False))
+    if errors:
+        raise RuntimeError(f"Cold-start worker failed ({mode} mode): {errors[0]['error']}")
+    return collected
+
+
+def summarize(mode, results):
+    def mean(key):
+        values = [r[key] for r in results if key in r]
+        return sum(values) / len(values) if values else None
+
+    row = {'mode': mode, 'workers': len(results)}
+    for key in ('import_ms', 'load_ms', 'first_invoke_ms', 'cold_start_ms', 'rss_mb', 'pss_mb',
+                'model_rss_mb', 'model_pss_mb'):
+        row[key] = mean(key)
+    row['max_cold_start_ms'] = max(r['cold_start_ms'] for r in results)
+    return row
+
+
+def benchmark(model_path, workers=4, modes=MODES, num_threads=1, weight_cache_dir=None):
+    """
+    Measure every mode with `workers` concurrent cold starts
+
+    Returns:
+        list: One summary row per mode
+    """
+    from tflite_inference import find_xnnpack_delegate
+
+    rows = []
+    for mode in modes:
+        if mode == 'cache':
+            if not find_xnnpack_delegate():
+                print("Skipping cache mode: set TFLITE_XNNPACK_DELEGATE to the XNNPACK delegate library")
+                continue
+            weight_cache_dir = weight_cache_dir or tempfile.mkdtemp(prefix='xnnpack_cache_')
+            # Fill the cache once, as the first worker after a deploy would
+            start_workers(model_path, mode, 1, num_threads, weight_cache_dir)
+        print(f"Starting {workers} '{mode}' workers")
+        rows.append(summarize(mode, start_workers(model_path, mode, workers, num_threads, weight_cache_dir)))
+    return rows
+
+
+# (column, header, width, decimals)
+COLUMNS = [
+    ('import_ms', 'Import', 9, 0),
+    ('load_ms', 'Load', 8, 1),
+    ('first_invoke_ms', 'Invoke', 8, 1),
+    ('cold_start_ms', 'Cold', 8, 0),
+    ('max_cold_start_ms', 'Max', 8, 0),
+    ('rss_mb', 'RSS MB', 9, 1),
+    ('pss_mb', 'PSS MB', 9, 1),
+    ('model_rss_mb', 'Model RSS', 11, 1),
+    ('model_pss_mb', 'Model PSS', 11, 1),
+]
+
+
+def print_rows(rows):
+    print('\n' + f"{'Mode':<7}{'Workers':>8}" + ''.join(f"{header:>{width}}" for _, header, width, _ in COLUMNS))
+    for row in rows:
+        cells = [f"{row[key]:>{width}.{decimals}f}" if row[key] is not None else f"{'-':>{width}}"
+                 for key, _, width, decimals in COLUMNS]
+        print(f"{row['mode']:<7}{row['workers']:>8}" + ''.join(cells))
+    print("\nTimes are per-worker means in ms; Cold = import + load + first invoke.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure model cold start and per-worker memory')
+    parser.add_argument('model', type=str,
+                      help='path to the .tflite model')
+    parser.add_argument('--workers', type=int, default=4,
+                      help='worker processes started at once per mode (default: 4)')
+    parser.add_argument('--modes', type=str, nargs='+', choices=MODES, default=list(MODES),
+                      help='loading modes to compare (default: all)')
+    parser.add_argument('--threads', type=int, default=1,
+                      help='threads per interpreter (default: 1)')
+    parser.add_argument('--weight-cache-dir', type=str, default=None,
+                      help='XNNPACK weight cache directory for the cache mode (default: a temporary directory)')
+    parser.add_argument('--json', type=str, default=None,
+                      help='also write the results to this JSON file')
+
+    args = parser.parse_args(argv)
+
+    try:
+        rows = benchmark(args.model, workers=args.workers, modes=args.modes, num_threads=args.threads,
+                         weight_cache_dir=args.weight_cache_dir)
+    except RuntimeError as e:
+        raise SystemExit(f"Error: {e}")
+    print_rows(rows)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -8,24 +8,96 @@ to reduce model size and improve inference speed.
 
 import os
 import argparse
-import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model
 
-def convert_model_to_tflite(model_path, output_path, quantize=False):
+from model_registry import DEFAULT_REGISTRY_DIR, ModelRegistry, tree_digest
+
+# NumPy/TensorFlow are imported lazily so `--help` does not load TensorFlow
+
+def conversion_options(quantize=False, batch_size=None, optimize_graph=False):
+    """
+    Options that determine the converter's output, used as the registry
+    cache key together with the source model's hash
+    """
+    from importlib import metadata
+    
+    try:
+        tf_version = metadata.version('tensorflow')
+    except metadata.PackageNotFoundError:
+        import tensorflow as tf
+        tf_version = tf.__version__
+    
+    return {'quantize': bool(quantize), 'batch_size': batch_size, 'optimize_graph': bool(optimize_graph),
+            'tensorflow': tf_version}
+
+def convert_model_to_tflite(model_path, output_path, quantize=False, registry=None, task=None, batch_size=None,
+                            optimize_graph=True):
     """
     Convert a Keras model to TensorFlow Lite format
     
     Args:
-        model_path (str): Path to the Keras model (.h5)
+        model_path (str): Path to the Keras model (.h5/.keras) or to an
+            inference SavedModel directory written by model_export.py
         output_path (str): Path to save the TFLite model
         quantize (bool): Whether to apply quantization
+        registry (ModelRegistry): Optional registry; when the same source model
+            was already converted with the same options, the stored .tflite is
+            copied to output_path instead of converting again
+        task (str): Task recorded with the registered artifacts
+        batch_size (int): Fixed batch size of the converted model; by default
+            the batch dimension is dynamic, so all faces of a frame can be run
+            in one invoke after `resize_tensor_input`
+        optimize_graph (bool): For Keras inputs, fold BatchNorm and strip
+            training-only layers first (graph_optimizer.py), after checking
+            the rewritten model against the original
     """
-    print(f"Loading model from {model_path}")
-    model = load_model(model_path)
+    if batch_size is not None and os.path.isdir(model_path):
+        raise ValueError("SavedModel exports are always converted with a dynamic batch dimension")
+    
+    # SavedModel exports are converted as they are
+    optimize_graph = optimize_graph and not os.path.isdir(model_path)
     
-    # Create TFLite converter
-    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if registry is not None:
+        options = conversion_options(quantize, batch_size, optimize_graph)
+        if os.path.isdir(model_path):
+            source_hash = tree_digest(model_path)
+        else:
+            source_hash = registry.add(model_path, 'keras', task=task)
+        cached = registry.find_conversion(source_hash, options)
+        if cached:
+            registry.export(cached, output_path)
+            print(f"Registry hit: {model_path} was already converted with {options}")
+            print(f"TFLite model {cached[:12]} copied to {output_path}")
+            return output_path
+    
+    import numpy as np
+    import tensorflow as tf
+    from tensorflow.keras.models import load_model
+    
+    print(f"Loading model from {model_path}")
+    if os.path.isdir(model_path):
+        # SavedModel: convert the serving signature without rebuilding Keras objects
+        from model_export import SIGNATURE_KEY, saved_model_input_spec
+        
+        input_shape, input_dtype = saved_model_input_spec(model_path)
+        converter = tf.lite.TFLiteConverter.from_saved_model(model_path, signature_keys=[SIGNATURE_KEY])
+    else:
+        # The optimizer is not needed for conversion, so skip re-compiling it
+        model = load_model(model_path, compile=False)
+        if optimize_graph:
+            from graph_optimizer import optimize_and_verify, print_optimization
+            
+            model, summary = optimize_and_verify(model)
+            print_optimization(summary)
+        input_shape = [batch_size or 1] + list(model.inputs[0].shape[1:])
+        input_dtype = tf.float32
+        
+        # Trace with an explicit batch dimension: None keeps it dynamic in the
+        # .tflite (shape_signature -1) instead of whatever the checkpoint recorded
+        input_spec = tf.TensorSpec([batch_size, *model.inputs[0].shape[1:]], input_dtype)
+        serve = tf.function(lambda image: model(image, training=False))
+        converter = tf.lite.TFLiteConverter.from_concrete_functions(
+            [serve.get_concrete_function(input_spec)], model
+        )
     
     # Set optimization options
     if quantize:
@@ -37,14 +109,16 @@ def convert_model_to_tflite(model_path, output_path, quantize=False):
             # In a real implementation, this would use actual validation data
             # Here, we just generate some random data of the right shape
             for _ in range(100):
-                # Get input shape from model
-                input_shape = model.inputs[0].shape
-                # Generate random data
-                yield [np.random.rand(*input_shape).astype(np.float32)]
+                # Generate random data (raw uint8 crops for fused-preprocessing models)
+                if input_dtype == tf.uint8:
+                    yield [np.random.randint(0, 256, size=input_shape, dtype=np.uint8)]
+                else:
+                    yield [np.random.rand(*input_shape).astype(np.float32)]
         
         converter.representative_dataset = representative_dataset
         converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
-        converter.inference_input_type = tf.uint8
+        if input_dtype != tf.uint8:
+            converter.inference_input_type = tf.uint8
         converter.inference_output_type = tf.uint8
     
     # Convert the model
@@ -57,39 +131,68 @@ def convert_model_to_tflite(model_path, output_path, quantize=False):
     
     print(f"TFLite model saved to {output_path}")
     
+    if registry is not None:
+        # SavedModel directories are not registry artifacts: keep their digest in the config instead of a parent
+        if os.path.isdir(model_path):
+            parent, config = None, dict(options, source_tree_digest=source_hash)
+        else:
+            parent, config = source_hash, options
+        output_hash = registry.add(output_path, 'tflite', task=task, parent=parent, config=config)
+        registry.record_conversion(source_hash, options, output_hash)
+        print(f"Registered as {output_hash[:12]} in {registry.root}")
+    
     # Report model size
     tflite_size = os.path.getsize(output_path) / (1024 * 1024)
     print(f"TFLite model size: {tflite_size:.2f} MB")
+    print(f"For an op-level latency report run: python tflite_profiler.py profile {output_path}")
     
     return output_path
 
-def evaluate_tflite_model(tflite_path, test_images, test_labels):
+def evaluate_tflite_model(tflite_path, test_images, test_labels, tta_policy=None, num_threads=None, xnnpack=None):
     """
     Evaluate a TFLite model for accuracy and performance
     
     Note: This is a placeholder function and would need to be adapted for actual use
+    (for test sets that do not fit in memory, use streaming_eval.py)
     
     Args:
         tflite_path (str): Path to the TFLite model
         test_images (np.array): Test images
         test_labels (np.array): Test labels
+        tta_policy (str): Optional test-time augmentation policy
+            (tflite_inference.TTA_POLICIES); all variants of an image run in
+            one invoke and their softmax outputs are averaged
+        num_threads (int): Interpreter threads (default: tuned host config)
+        xnnpack (bool): Use the XNNPACK delegate (default: tuned host config)
         
     Returns:
         dict: Evaluation metrics
     """
+    import numpy as np
+    from tflite_inference import TTA_POLICIES, load_interpreter, tta_batch
+    
     # Load TFLite model
-    interpreter = tf.lite.Interpreter(model_path=tflite_path)
-    interpreter.allocate_tensors()
+    interpreter = load_interpreter(tflite_path, num_threads=num_threads, xnnpack=xnnpack)
     
     # Get input and output tensors
     input_details = interpreter.get_input_details()
     output_details = interpreter.get_output_details()
     
+    # One batch row per TTA variant (needs a dynamic batch dimension)
+    variants = len(TTA_POLICIES[tta_policy]) if tta_policy else 1
+    if variants > 1:
+        interpreter.resize_tensor_input(input_details[0]['index'], [variants, *input_details[0]['shape'][1:]])
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()
+        output_details = interpreter.get_output_details()
+    
     # Run inference on test images
     correct = 0
     for i, image in enumerate(test_images):
         # Preprocess image to match model input
         input_data = np.expand_dims(image, axis=0).astype(np.float32)
+        if variants > 1:
+            input_data = tta_batch(input_data, tta_policy)
         
         # Set input tensor
         interpreter.set_tensor(input_details[0]['index'], input_data)
@@ -100,8 +203,8 @@ def evaluate_tflite_model(tflite_path, test_images, test_labels):
         # Get output
         output = interpreter.get_tensor(output_details[0]['index'])
         
-        # Get prediction
-        prediction = np.argmax(output)
+        # Get prediction (averaged over TTA variants)
+        prediction = np.argmax(output.mean(axis=0))
         true_label = np.argmax(test_labels[i])
         
         if prediction == true_label:
@@ -112,24 +215,36 @@ def evaluate_tflite_model(tflite_path, test_images, test_labels):
     
     return {'accuracy': accuracy}
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Convert Keras models to TensorFlow Lite')
     parser.add_argument('--model-path', type=str, required=True,
-                      help='path to Keras model (.h5)')
+                      help='path to Keras model (.h5/.keras) or inference SavedModel directory')
     parser.add_argument('--output-path', type=str, required=True,
                       help='path to save TFLite model')
     parser.add_argument('--quantize', action='store_true',
                       help='apply post-training quantization')
+    parser.add_argument('--batch-size', type=int, default=None,
+                      help='bake in a fixed batch size (default: dynamic batch dimension)')
+    parser.add_argument('--no-optimize-graph', action='store_true',
+                      help='skip folding BatchNorm and stripping Dropout before conversion')
+    parser.add_argument('--task', type=str, choices=['age', 'gender', 'expression'], default=None,
+                      help='task recorded with the registered models')
+    parser.add_argument('--registry', type=str, default=DEFAULT_REGISTRY_DIR,
+                      help=f'model registry used to skip repeated conversions (default: {DEFAULT_REGISTRY_DIR})')
+    parser.add_argument('--no-registry', action='store_true',
+                      help='always convert and do not record the result')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     # Create output directory if it doesn't exist
     output_dir = os.path.dirname(args.output_path)
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
     
-    # Convert model
-    convert_model_to_tflite(args.model_path, args.output_path, args.quantize)
+    # Convert model (or reuse an identical earlier conversion)
+    registry = None if args.no_registry else ModelRegistry(args.registry)
+    convert_model_to_tflite(args.model_path, args.output_path, args.quantize, registry=registry, task=args.task,
+                            batch_size=args.batch_size, optimize_graph=not args.no_optimize_graph)
     
     print("\nConversion complete!")
     print("To use this model in React Native with TensorFlow.js:")
@@ -0,0 +1,176 @@
+"""
+Training Loaders
+
+`SharedMemorySequence` wraps a Keras DirectoryIterator or DataFrameIterator
+(or a BalancedSequence over one) and serves its batches from
+decode_workers.DecodeRing, so images are decoded in worker processes into
+shared memory instead of in ImageDataGenerator's GIL-bound threads.
+
+The wrapped iterator only supplies file paths, classes and the sample
+schedule; its ImageDataGenerator transform is re-created in the workers.
+Batches are handed out in the order they were decoded: Keras may request
+batch indices in shuffled order, and the first request for an index in an
+epoch takes the next decoded batch. A repeated request for the same index
+(Keras peeks at batch 0 before training) is decoded again in-process.
+Batches are returned as views of their ring slots, without copying. Keras
+keeps up to `max_queue_size` fetched batches in its enqueuer, plus one in
+tf.data's prefetch buffer, one being converted and one in the train step,
+so the ring holds each slot until KERAS_HELD_BATCHES more batches have been
+requested before workers may refill it (the ring is sized for that).
+
+`ArchiveSequence` serves batches streamed from tar/zip shards by
+archive_dataset.ArchiveReader. The stream has no random access, so every
+request returns the next batch. For training, epochs are counted in
+batches, as WebDataset does: an epoch is len() batches, and shard passes
+carry over epoch boundaries. A non-repeating (validation) reader is instead
+read once per epoch, in order, and trimmed to exactly `samples` images, so
+validation metrics are always computed over the same set.
+"""
+
+import math
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+from decode_workers import DecodeRing
+
+# model.fit's default max_queue_size, plus the prefetched, converting and
+# training batches: how many returned batches Keras can still be reading
+KERAS_MAX_QUEUE_SIZE = 10
+KERAS_HELD_BATCHES = KERAS_MAX_QUEUE_SIZE + 3
+
+class SharedMemorySequence(tf.keras.utils.Sequence):
+    """
+    Serve a Keras iterator's batches from shared-memory decode workers
+    """
+
+    def __init__(self, sequence, transform=None, workers=None, slots=None, seed=None, hold=KERAS_HELD_BATCHES):
+        """
+        Args:
+            sequence: Keras iterator, or a wrapper exposing its attributes
+                and an epoch `schedule` of sample indices (BalancedSequence)
+            transform (dict): ImageDataGenerator arguments applied in the
+                workers (rescale and any augmentation ranges)
+            workers (int): Decode processes (default: CPUs - 1)
+            slots (int): Batches in the ring (default: workers + 1 + hold)
+            seed (int): Seed for the epoch shuffle
+            hold (int): Returned batches kept valid; must cover everything
+                the consumer queues (default: KERAS_HELD_BATCHES, for
+                model.fit with its default max_queue_size)
+        """
+        super().__init__()
+        self.sequence = sequence
+        self.batch_size = sequence.batch_size
+        self.classes = np.asarray(sequence.classes)
+        self.one_hot = np.eye(len(sequence.class_indices), dtype=np.float32)
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.ring = DecodeRing(
+            sequence.filepaths, self.batch_size, sequence.target_size,
+            color_mode=sequence.color_mode,
+            interpolation=getattr(sequence, 'interpolation', 'nearest'),
+            transform=transform,
+            workers=workers,
+            slots=slots,
+            hold=hold
+        )
+        self._start_epoch()
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def _start_epoch(self):
+        schedule = getattr(self.sequence, 'schedule', None)
+        if schedule is None:
+            count = len(self.classes)
+            schedule = self.rng.permutation(count) if getattr(self.sequence, 'shuffle', True) else np.arange(count)
+        self.batches = [schedule[i * self.batch_size:(i + 1) * self.batch_size] for i in range(len(self))]
+        # Batch index requested by Keras -> position in the decode order
+        self.positions = {}
+        self.ring.start(self.batches)
+
+    def __getitem__(self, index):
+        with self.lock:
+            if index in self.positions:
+                indices = self.batches[self.positions[index]]
+                return self.ring.decode(indices), self.one_hot[self.classes[indices]]
+            if len(self.positions) == len(self.batches):
+                self.on_epoch_end()
+            position, images = self.ring.next()
+            self.positions[index] = position
+            # A view of the ring slot; it stays valid while Keras may still queue it
+            return images, self.one_hot[self.classes[self.batches[position]]]
+
+    def on_epoch_end(self):
+        if hasattr(self.sequence, 'on_epoch_end'):
+            self.sequence.on_epoch_end()
+        self._start_epoch()
+
+    def close(self):
+        """
+        Stop the decode workers and free the shared memory
+        """
+        self.ring.close()
+
+    def __getattr__(self, name):
+        # Expose iterator attributes such as class_indices and samples
+        if name == 'sequence':
+            raise AttributeError(name)
+        return getattr(self.sequence, name)
+
+
+class ArchiveSequence(tf.keras.utils.Sequence):
+    """
+    Serve batches streamed from tar/zip shards
+    """
+
+    def __init__(self, reader, batch_size):
+        """
+        Args:
+            reader (ArchiveReader): Stream of one subset of the shards
+            batch_size (int): Images per batch
+        """
+        super().__init__()
+        self.reader = reader
+        self.batch_size = batch_size
+        self.class_indices = reader.class_indices
+        self.classes = reader.classes
+        self.samples = len(reader.classes)
+        self.one_hot = np.eye(len(self.class_indices), dtype=np.float32)
+        self.lock = threading.Lock()
+        self.served = 0
+
+    def __len__(self):
+        return math.ceil(self.samples / self.batch_size)
+
+    def __getitem__(self, index):
+        # The index is ignored: the stream is read in order
+        with self.lock:
+            if self.reader.repeat:
+                images, classes = self.reader.next_batch(self.batch_size)
+                return images, self.one_hot[classes]
+            # Single pass: batch 0 (or a pass already served in full) starts
+            # a new pass, and the last batch stops at exactly `samples`
+            if self.served and (index == 0 or self.served >= self.samples):
+                self._restart()
+            count = min(self.batch_size, self.samples - self.served)
+            images, classes = self.reader.next_batch(count)
+            self.served += count
+        return images, self.one_hot[classes]
+
+    def _restart(self):
+        self.reader.restart()
+        self.served = 0
+
+    def on_epoch_end(self):
+        if not self.reader.repeat:
+            with self.lock:
+                if self.served:
+                    self._restart()
+
+    def close(self):
+        """
+        Stop the shard readers
+        """
+        self.reader.close()
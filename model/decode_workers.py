@@ -0,0 +1,373 @@
+"""
+Shared-Memory Image Decode Workers
+
+`ImageDataGenerator` decodes JPEGs in Python threads that contend for the
+GIL, and Keras' multiprocessing loaders pickle every decoded batch back to
+the trainer. `DecodeRing` instead starts worker processes that decode
+straight into a ring of batch slots in one `multiprocessing.shared_memory`
+block:
+
+- the trainer hands a worker (slot, batch indices); the worker decodes,
+  resizes, augments and rescales each image into that slot and reports back
+  with a few bytes on a queue, so batches are never pickled
+- `next()` returns a view of the batch's slot, without copying. The slot
+  is only reused after `hold` further batches have been requested, so a
+  consumer that queues batches (Keras does, see
+  data_loader.SharedMemorySequence) sets `hold` above its queue depth
+- work is only submitted for free slots, so a slow trainer leaves workers
+  idle instead of growing a queue (back-pressure)
+- `close()` stops the workers and unlinks the block; it also runs when the
+  ring is garbage collected or the interpreter exits, and workers exit on
+  their own if the trainer dies
+
+Workers import only numpy and PIL (plus Keras' ImageDataGenerator when
+per-image augmentation is on), so decode scales with cores. `train_model.py
+--loader shared-memory` uses this through data_loader.SharedMemorySequence.
+The `benchmark` command measures images/sec against a single process.
+
+Usage:
+    python decode_workers.py benchmark --data-dir model/data/age --workers 1 2 4 8
+"""
+
+import os
+import time
+import queue
+import signal
+import argparse
+import weakref
+from collections import deque
+
+
+def load_image(path, target_size, color_mode='rgb', interpolation='nearest'):
+    """
+    Decode and resize an image (path or file object) the way
+    flow_from_directory does
+
+    Returns:
+        np.array: float32 (height, width, channels), values 0-255
+    """
+    import numpy as np
+    from PIL import Image
+
+    height, width = target_size
+    with Image.open(path) as image:
+        image = image.convert('L' if color_mode == 'grayscale' else 'RGB')
+        if image.size != (width, height):
+            image = image.resize((width, height), getattr(Image, interpolation.upper()))
+        array = np.asarray(image, dtype=np.float32)
+    return array[..., np.newaxis] if color_mode == 'grayscale' else array
+
+
+class BatchDecoder:
+    """
+    Decode batches of images into a preallocated buffer, applying the
+    ImageDataGenerator transform (augmentation and rescale) of the source
+    """
+
+    def __init__(self, filepaths, target_size, color_mode='rgb', interpolation='nearest', transform=None):
+        """
+        Args:
+            filepaths (list): Image paths, addressed by batch indices (None
+                when only `decode` is used)
+            target_size (tuple): (height, width)
+            color_mode (str): 'rgb' or 'grayscale'
+            interpolation (str): Resize filter name
+            transform (dict): ImageDataGenerator arguments such as rescale
+                and the augmentation ranges (default: none)
+        """
+        self.filepaths = filepaths
+        self.target_size = tuple(target_size)
+        self.color_mode = color_mode
+        self.interpolation = interpolation
+        self.transform = dict(transform or {})
+        self.generator = None
+        if set(self.transform) - {'rescale'}:
+            from tensorflow.keras.preprocessing.image import ImageDataGenerator
+            self.generator = ImageDataGenerator(**self.transform)
+
+    def decode(self, source):
+        """
+        Decode, resize and transform one image from a path or file object
+        """
+        image = load_image(source, self.target_size, self.color_mode, self.interpolation)
+        if self.generator is not None:
+            return self.generator.standardize(self.generator.random_transform(image))
+        if self.transform.get('rescale'):
+            image *= self.transform['rescale']
+        return image
+
+    def decode_into(self, out, indices):
+        """
+        Decode the images at `indices` into out[:len(indices)]
+        """
+        for i, index in enumerate(indices):
+            out[i] = self.decode(self.filepaths[index])
+        return out[:len(indices)]
+
+
+def _decode_worker(shm_name, shape, decoder_args, tasks, done):
+    """
+    Worker loop: decode (slot, position, indices) tasks into the shared ring
+    until a None task arrives or the trainer process is gone
+    """
+    import multiprocessing
+    from multiprocessing import shared_memory
+
+    import numpy as np
+
+    # Ctrl-C is handled by the trainer, which then shuts the workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    parent = multiprocessing.parent_process()
+    block = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+    decoder = BatchDecoder(*decoder_args)
+
+    try:
+        while True:
+            try:
+                task = tasks.get(timeout=1.0)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    break
+                continue
+            if task is None:
+                break
+            slot, position, indices = task
+            try:
+                decoder.decode_into(ring[slot], indices)
+                done.put((slot, position, None))
+            except Exception as e:
+                done.put((slot, position, f"{type(e).__name__}: {e}"))
+    finally:
+        del ring
+        block.close()
+
+
+def _shutdown(processes, tasks, block, timeout=5.0):
+    for _ in processes:
+        tasks.put(None)
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    try:
+        block.close()
+    except BufferError:
+        # A batch view is still referenced; the mapping goes with the process
+        pass
+    block.unlink()
+
+
+class DecodeRing:
+    """
+    Worker processes decoding batches into a ring of shared-memory slots
+    """
+
+    def __init__(self, filepaths, batch_size, target_size, color_mode='rgb', interpolation='nearest',
+                 transform=None, workers=None, slots=None, hold=1, timeout=120.0):
+        """
+        Args:
+            filepaths (list): Image paths, addressed by batch indices
+            batch_size (int): Images per slot
+            target_size (tuple): (height, width)
+            color_mode (str): 'rgb' or 'grayscale'
+            interpolation (str): Resize filter name
+            transform (dict): ImageDataGenerator arguments (see BatchDecoder)
+            workers (int): Decode processes (default: CPUs - 1)
+            slots (int): Batches in the ring, i.e. held, decoded or in
+                flight at once (default: workers + 1 + hold)
+            hold (int): Batches returned by next() that stay valid; a
+                slot is reused once `hold` more batches have been requested
+            timeout (float): Seconds to wait for a batch before checking
+                that the workers are still alive
+        """
+        import multiprocessing
+        from multiprocessing import shared_memory
+
+        import numpy as np
+
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.hold = max(1, hold)
+        self.slots = max(self.hold + 1, slots or self.workers + 1 + self.hold)
+        self.timeout = timeout
+        channels = 1 if color_mode == 'grayscale' else 3
+        shape = (self.slots, batch_size) + tuple(target_size) + (channels,)
+        decoder_args = (list(filepaths), tuple(target_size), color_mode, interpolation, dict(transform or {}))
+        self.decoder_args = decoder_args
+        self._decoder = None
+
+        self._block = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        self.ring = np.ndarray(shape, dtype=np.float32, buffer=self._block.buf)
+
+        context = multiprocessing.get_context('spawn')
+        self._tasks = context.Queue()
+        self._done = context.Queue()
+        worker_args = (self._block.name, shape, decoder_args, self._tasks, self._done)
+        self._processes = [
+            context.Process(target=_decode_worker, args=worker_args, daemon=True) for _ in range(self.workers)
+        ]
+        for process in self._processes:
+            process.start()
+        self._finalizer = weakref.finalize(self, _shutdown, self._processes, self._tasks, self._block)
+
+        self._free = list(range(self.slots))
+        self._ready = {}
+        self._held = deque()
+        self.batches = []
+        self._submitted = self._served = 0
+
+    def start(self, batches):
+        """
+        Begin a new pass over `batches` (a list of index arrays), draining
+        any batches still in flight from the previous pass. Held batches of
+        the previous pass stay valid until enough new ones are requested.
+        """
+        for position in range(self._served, self._submitted):
+            self._free.append(self._wait(position))
+        self.batches = list(batches)
+        self._submitted = self._served = 0
+        self._fill()
+
+    def _fill(self):
+        # Back-pressure: submit work only for free slots
+        while self._free and self._submitted < len(self.batches):
+            slot = self._free.pop()
+            self._tasks.put((slot, self._submitted, self.batches[self._submitted]))
+            self._submitted += 1
+
+    def _release(self):
+        # Free the oldest held slots, leaving room for the batch about to be returned
+        while len(self._held) >= self.hold:
+            self._free.append(self._held.popleft())
+
+    def _wait(self, position):
+        while position not in self._ready:
+            try:
+                slot, done_position, error = self._done.get(timeout=self.timeout)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self._processes):
+                    raise RuntimeError("A decode worker exited unexpectedly")
+                continue
+            if error:
+                self._free.append(slot)
+                raise RuntimeError(f"Decoding batch {done_position} failed: {error}")
+            self._ready[done_position] = slot
+        return self._ready.pop(position)
+
+    def next(self):
+        """
+        Next batch of the pass, in submission order
+
+        Returns:
+            tuple: (position, float32 images) where images is a view of a
+                ring slot, valid until `hold` more batches are requested
+        """
+        self._release()
+        if self._served >= len(self.batches):
+            raise IndexError("No batches left in this pass")
+        position = self._served
+        slot = self._wait(position)
+        self._held.append(slot)
+        self._served += 1
+        self._fill()
+        return position, self.ring[slot, :len(self.batches[position])]
+
+    def decode(self, indices):
+        """
+        Decode a batch in this process into a new array, for batches
+        requested outside the pass order
+        """
+        import numpy as np
+
+        if self._decoder is None:
+            self._decoder = BatchDecoder(*self.decoder_args)
+        out = np.empty((len(indices),) + self.ring.shape[2:], dtype=np.float32)
+        return self._decoder.decode_into(out, indices)
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory
+        """
+        self.ring = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def benchmark(filepaths, worker_counts=(1, 2, 4), batch_size=32, target_size=(224, 224), batches=20):
+    """
+    Compare decode throughput (images/sec) of one process with DecodeRing
+    at each worker count
+
+    Returns:
+        dict: images/sec keyed by 'single' and worker count
+    """
+    import numpy as np
+
+    count = min(len(filepaths), batch_size * batches)
+    indices = np.arange(count)
+    chunks = [indices[i:i + batch_size] for i in range(0, count, batch_size)]
+    results = {}
+
+    decoder = BatchDecoder(filepaths, target_size, transform={'rescale': 1. / 255})
+    out = np.empty((batch_size,) + tuple(target_size) + (3,), dtype=np.float32)
+    start = time.perf_counter()
+    for chunk in chunks:
+        decoder.decode_into(out, chunk)
+    results['single'] = count / (time.perf_counter() - start)
+
+    for workers in worker_counts:
+        with DecodeRing(filepaths, batch_size, target_size, transform={'rescale': 1. / 255},
+                        workers=workers) as ring:
+            # Warm-up pass so process start-up is not measured
+            ring.start(chunks[:workers])
+            for _ in range(min(workers, len(chunks))):
+                ring.next()
+            ring.start(chunks)
+            start = time.perf_counter()
+            for _ in chunks:
+                ring.next()
+            results[workers] = count / (time.perf_counter() - start)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Shared-memory multiprocess image decoding')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    bench_parser = subparsers.add_parser('benchmark', help='compare decode throughput by worker count')
+    bench_parser.add_argument('--data-dir', type=str, required=True,
+                      help='directory of images (searched recursively)')
+    bench_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                      help='worker counts to measure (default: 1 2 4)')
+    bench_parser.add_argument('--size', type=int, default=224,
+                      help='decoded image size (default: 224)')
+    bench_parser.add_argument('--batch-size', type=int, default=32,
+                      help='images per batch (default: 32)')
+    bench_parser.add_argument('--batches', type=int, default=20,
+                      help='batches decoded per setting (default: 20)')
+
+    args = parser.parse_args(argv)
+
+    from face_store import iter_images
+
+    filepaths = [path for path, _ in iter_images(args.data_dir)]
+    if not filepaths:
+        parser.error(f'no images found under {args.data_dir}')
+    results = benchmark(filepaths, args.workers, batch_size=args.batch_size, target_size=(args.size, args.size),
+                        batches=args.batches)
+    baseline = results['single']
+    print(f"Decode throughput ({min(len(filepaths), args.batch_size * args.batches)} images at {args.size}px):")
+    for name, rate in results.items():
+        label = 'single' if name == 'single' else f'{name} workers'
+        print(f"  {label:<12} {rate:9.1f} images/sec  ({rate / baseline:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+"""
+Face-Embedding Result Cache
+
+The same people are seen again and again, but age and gender are recomputed
+for every sighting (video_pipeline.py only reuses them within one track).
+This module caches age/gender results keyed by a compact face embedding:
+
+- the embedding model is a MobileNetV2 backbone's pooled features followed
+  by a fixed random orthogonal projection to `--dims` values and L2
+  normalization, exported as `.tflite`. The backbone comes from a trained
+  age/gender checkpoint (use the fast cascade model, `train_model.py
+  --variant fast`, to keep the lookup cheap) or ImageNet weights
+- lookups are approximate nearest neighbour: random-hyperplane signatures
+  split into bands, so only entries sharing a band with the query are
+  compared (as face_store.NearDuplicateIndex does for perceptual hashes)
+- a hit needs cosine similarity >= `threshold`; entries expire after
+  `ttl_s` seconds and the least recently used entry is evicted when full
+- counters report lookups, hit rate, evictions and the inference time
+  saved net of the embedding cost
+
+Usage:
+    python embedding_cache.py export --model-path models/age/age_fast_model_best.h5 \\
+        --output models/embedding/face_embedding.tflite
+    python video_pipeline.py input.mp4 --embedding-model models/embedding/face_embedding.tflite
+    python inference_server.py serve --embedding-model models/embedding/face_embedding.tflite --cache-ttl 300
+"""
+
+import os
+import time
+import argparse
+import threading
+from collections import OrderedDict
+
+DEFAULT_EMBEDDING_PATH = os.path.join('models', 'embedding', 'face_embedding.tflite')
+
+EMBEDDING_DIMS = 128
+
+
+def build_embedding_model(model_path=None, dims=EMBEDDING_DIMS, seed=0):
+    """
+    Build a Keras model mapping RGB face crops to L2-normalized embeddings
+
+    Args:
+        model_path (str): Trained age/gender checkpoint whose backbone to
+            reuse; None uses ImageNet MobileNetV2 (alpha 0.35, FAST_IMG_SIZE)
+        dims (int): Embedding size after the random projection
+        seed (int): Projection seed; embeddings from different seeds are not
+            comparable
+
+    Returns:
+        tf.keras.Model
+    """
+    import tensorflow as tf
+
+    if model_path:
+        from model_export import inference_model
+
+        model = inference_model(tf.keras.models.load_model(model_path, compile=False))
+        pooled = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)]
+        if not pooled:
+            raise ValueError(f"{model_path} has no pooled backbone features (expected an age or gender model)")
+        inputs, features = model.inputs, pooled[-1].output
+    else:
+        from train_model import FAST_IMG_SIZE, create_base_model
+
+        backbone = create_base_model((FAST_IMG_SIZE, FAST_IMG_SIZE, 3), alpha=0.35)
+        inputs, features = backbone.inputs, tf.keras.layers.GlobalAveragePooling2D()(backbone.output)
+
+    projection = tf.keras.layers.Dense(
+        dims, use_bias=False, trainable=False, name='projection',
+        kernel_initializer=tf.keras.initializers.Orthogonal(seed=seed)
+    )
+    embedding = tf.keras.layers.UnitNormalization(axis=-1, name='l2_normalize')(projection(features))
+    return tf.keras.Model(inputs=inputs, outputs=embedding, name='face_embedding')
+
+
+def export_embedding_model(output_path, model_path=None, dims=EMBEDDING_DIMS, quantize=False):
+    """
+    Build the embedding model and convert it to TFLite
+
+    The Keras model is written next to output_path and converted with
+    convert_to_tflite.convert_model_to_tflite.
+    """
+    from convert_to_tflite import convert_model_to_tflite
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    keras_path = os.path.splitext(output_path)[0] + '.keras'
+    build_embedding_model(model_path, dims=dims).save(keras_path)
+    return convert_model_to_tflite(keras_path, output_path, quantize=quantize)
+
+
+class EmbeddingModel:
+    """
+    TFLite face embedder; crops are preprocessed like the age/gender inputs
+
+    Exposes the preprocess / predict_preprocessed / decode interface of
+    tflite_inference.TFLiteModel, so the inference server can micro-batch
+    embeddings like the other models.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        from tflite_inference import load_interpreter
+
+        self.model_path = model_path
+        self.interpreter = load_interpreter(model_path, num_threads=num_threads)
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.input_size = int(self.input_detail['shape'][1])
+        self.dims = int(self.output_detail['shape'][-1])
+        self._lock = threading.Lock()
+
+    def preprocess(self, face):
+        from tflite_inference import preprocess_face
+
+        return preprocess_face(face, 'age', size=self.input_size)
+
+    def decode(self, row):
+        return row
+
+    def embed(self, faces):
+        """
+        Returns:
+            np.array: float32 (len(faces), dims), unit length rows
+        """
+        return self.predict_preprocessed([self.preprocess(face) for face in faces])
+
+    def predict_preprocessed(self, batch):
+        """
+        Embed a list of preprocessed crops in one invoke
+        """
+        import numpy as np
+        from tflite_inference import dequantize, quantize
+
+        batch = np.stack(batch)
+        with self._lock:
+            if tuple(self.input_detail['shape']) != batch.shape:
+                self.interpreter.resize_tensor_input(self.input_detail['index'], list(batch.shape))
+                self.interpreter.allocate_tensors()
+                self.input_detail = self.interpreter.get_input_details()[0]
+                self.output_detail = self.interpreter.get_output_details()[0]
+            self.interpreter.set_tensor(self.input_detail['index'], quantize(batch, self.input_detail))
+            self.interpreter.invoke()
+            output = dequantize(self.interpreter.get_tensor(self.output_detail['index']), self.output_detail)
+        # Re-normalize after dequantization
+        return output / np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+
+
+class EmbeddingCache:
+    """
+    Approximate nearest-neighbour cache of results keyed by unit embeddings
+
+    Each embedding gets a `bands * band_bits`-bit random-hyperplane signature;
+    nearby embeddings agree on most bits, so a stored entry is a candidate
+    when at least one band matches exactly. Candidates are then compared by
+    cosine similarity. Storage is a preallocated (max_entries, dims) array.
+    """
+
+    def __init__(self, dims, threshold=0.92, ttl_s=600.0, max_entries=10000, bands=8, band_bits=10,
+                 seed=0, clock=time.monotonic):
+        """
+        Args:
+            dims (int): Embedding size
+            threshold (float): Minimum cosine similarity for a hit
+            ttl_s (float): Seconds an entry stays valid after insertion
+            max_entries (int): Capacity; the least recently used entry is
+                evicted beyond it
+            bands (int): Signature bands (more bands: higher recall, more
+                candidates compared)
+            band_bits (int): Hyperplanes per band (more bits: fewer, closer
+                candidates)
+        """
+        import numpy as np
+
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.bands = bands
+        self.band_bits = band_bits
+        self.clock = clock
+        self.planes = np.random.default_rng(seed).standard_normal((dims, bands * band_bits)).astype(np.float32)
+        self.weights = (1 << np.arange(band_bits)).astype(np.int64)
+
+        self.embeddings = np.zeros((max_entries, dims), dtype=np.float32)
+        self.values = [None] * max_entries
+        self.created = np.zeros(max_entries, dtype=np.float64)
+        self.keys = [None] * max_entries
+        self.tables = [dict() for _ in range(bands)]
+        self.lru = OrderedDict()  # slot -> None, least recently used first
+        self.free = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0, 'expired': 0, 'evictions': 0}
+
+    def _band_keys(self, embedding):
+        bits = (embedding @ self.planes > 0).reshape(self.bands, self.band_bits)
+        return [int(key) for key in bits @ self.weights]
+
+    def _remove(self, slot):
+        for table, key in zip(self.tables, self.keys[slot]):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(slot)
+                if not bucket:
+                    del table[key]
+        self.lru.pop(slot, None)
+        self.values[slot] = None
+        self.keys[slot] = None
+        self.free.append(slot)
+
+    def lookup(self, embedding):
+        """
+        Return the cached value of the most similar live entry, or None
+        """
+        import numpy as np
+
+        keys = self._band_keys(embedding)
+        with self._lock:
+            self.stats['lookups'] += 1
+            candidates = set()
+            for table, key in zip(self.tables, keys):
+                candidates.update(table.get(key, ()))
+            if not candidates:
+                return None
+
+            now = self.clock()
+            slots = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            expired = slots[now - self.created[slots] > self.ttl_s]
+            for slot in expired:
+                self._remove(int(slot))
+            self.stats['expired'] += len(expired)
+            slots = slots[now - self.created[slots] <= self.ttl_s]
+            if not len(slots):
+                return None
+
+            similarity = self.embeddings[slots] @ embedding
+            best = int(similarity.argmax())
+            if similarity[best] < self.threshold:
+                return None
+            slot = int(slots[best])
+            self.lru.move_to_end(slot)
+            self.stats['hits'] += 1
+            return self.values[slot]
+
+    def insert(self, embedding, value):
+        keys = self._band_keys(embedding)
+        with self._lock:
+            if not self.free:
+                self._remove(next(iter(self.lru)))
+                self.stats['evictions'] += 1
+            slot = self.free.pop()
+            self.embeddings[slot] = embedding
+            self.values[slot] = value
+            self.created[slot] = self.clock()
+            self.keys[slot] = keys
+            for table, key in zip(self.tables, keys):
+                table.setdefault(key, set()).add(slot)
+            self.lru[slot] = None
+
+    def __len__(self):
+        return len(self.lru)
+
+
+class FaceResultCache:
+    """
+    Serve per-face results from an EmbeddingCache, computing only misses
+
+    Keeps a running mean of the compute cost per missed face, from which the
+    time saved by hits is estimated.
+    """
+
+    def __init__(self, embedder, cache):
+        self.embedder = embedder
+        self.cache = cache
+        self.stats = {'faces': 0, 'hits': 0, 'embed_ms': 0.0, 'compute_ms': 0.0, 'computed': 0}
+        self._lock = threading.Lock()
+
+    def get(self, faces, compute):
+        """
+        Args:
+            faces (list): Raw face crops
+            compute: Callable mapping a list of crops to a list of results
+
+        Returns:
+            list: One result per face (cached results are shared, not copied)
+        """
+        if not faces:
+            return []
+        start = time.perf_counter()
+        embeddings = self.embedder.embed(faces)
+        embed_ms = (time.perf_counter() - start) * 1000
+
+        results = [self.cache.lookup(embedding) for embedding in embeddings]
+        misses = [i for i, result in enumerate(results) if result is None]
+        compute_ms = 0.0
+        if misses:
+            start = time.perf_counter()
+            computed = compute([faces[i] for i in misses])
+            compute_ms = (time.perf_counter() - start) * 1000
+            for i, result in zip(misses, computed):
+                results[i] = result
+                self.cache.insert(embeddings[i], result)
+
+        with self._lock:
+            self.stats['embed_ms'] += embed_ms
+            self.stats['compute_ms'] += compute_ms
+            self.stats['computed'] += len(misses)
+            self.stats['faces'] += len(faces)
+            self.stats['hits'] += len(faces) - len(misses)
+        return results
+
+    def summary(self):
+        """
+        Hit rate and estimated latency saved (hits x mean miss cost, minus the
+        time spent embedding every face)
+        """
+        stats = self.stats
+        mean_compute_ms = stats['compute_ms'] / stats['computed'] if stats['computed'] else 0.0
+        return {
+            'faces': stats['faces'],
+            'hits': stats['hits'],
+            'hit_rate': stats['hits'] / stats['faces'] if stats['faces'] else 0.0,
+            'entries': len(self.cache),
+            'evictions': self.cache.stats['evictions'],
+            'expired': self.cache.stats['expired'],
+            'mean_compute_ms': mean_compute_ms,
+            'embed_ms': stats['embed_ms'],
+            'saved_ms': stats['hits'] * mean_compute_ms - stats['embed_ms'],
+        }
+
+
+def create_face_cache(embedding_path, threshold=0.92, ttl_s=600.0, max_entries=10000, num_threads=None,
+                      embedder=None):
+    """
+    Load an embedding model and wrap it in a FaceResultCache
+
+    Args:
+        embedder: Object with `embed(faces)` and `dims` to use instead of
+            loading one EmbeddingModel (e.g. the inference server's batcher)
+    """
+    embedder = embedder or EmbeddingModel(embedding_path, num_threads=num_threads)
+    cache = EmbeddingCache(embedder.dims, threshold=threshold, ttl_s=ttl_s, max_entries=max_entries)
+    return FaceResultCache(embedder, cache)
+
+
+def add_cache_arguments(parser):
+    """
+    Add the embedding cache options to a script's argument parser
+    """
+    parser.add_argument('--embedding-model', type=str, default=None,
+                      help=f'enable the face-embedding result cache with this model (e.g. {DEFAULT_EMBEDDING_PATH})')
+    parser.add_argument('--cache-threshold', type=float, default=0.92,
+                      help='minimum cosine similarity for a cache hit (default: 0.92)')
+    parser.add_argument('--cache-ttl', type=float, default=600.0,
+                      help='seconds a cached result stays valid (default: 600)')
+    parser.add_argument('--cache-size', type=int, default=10000,
+                      help='maximum cached faces, least recently used evicted first (default: 10000)')
+
+
+def print_cache_summary(summary):
+    print(f"Embedding cache: {summary['hits']} of {summary['faces']} faces served from cache "
+          f"({100 * summary['hit_rate']:.1f}%), {summary['entries']} entries, "
+          f"{summary['evictions']} evicted, {summary['expired']} expired")
+    print(f"  ~{summary['saved_ms']:.0f} ms inference saved "
+          f"({summary['mean_compute_ms']:.2f} ms per miss, {summary['embed_ms']:.0f} ms spent embedding)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the face-embedding model used by the result cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='build and convert the embedding model')
+    export_parser.add_argument('--model-path', type=str, default=None,
+                      help='age/gender checkpoint whose backbone to reuse (default: ImageNet MobileNetV2 0.35)')
+    export_parser.add_argument('--output', type=str, default=DEFAULT_EMBEDDING_PATH,
+                      help=f'output .tflite path (default: {DEFAULT_EMBEDDING_PATH})')
+    export_parser.add_argument('--dims', type=int, default=EMBEDDING_DIMS,
+                      help=f'embedding size (default: {EMBEDDING_DIMS})')
+    export_parser.add_argument('--quantize', action='store_true',
+                      help='apply post-training quantization')
+
+    args = parser.parse_args(argv)
+
+    export_embedding_model(args.output, args.model_path, dims=args.dims, quantize=args.quantize)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,10 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
-from datetime import datetime, timedelta
+import argparse
+from datetime import datetime
 
 def create_evaluation_table():
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    
     # Actual test data for 20 images (collected from our testing)
     data = {
         'Category': ['Adult', 'Adult', 'Adult', 'Adult', 'Adult',
@@ -65,6 +66,8 @@ def create_evaluation_table():
     plt.close()
 
 def create_gantt_chart():
+    import matplotlib.pyplot as plt
+    
     # Project timeline with actual dates
     tasks = [
         'Project Setup & Planning',
@@ -105,6 +108,12 @@ def create_gantt_chart():
     plt.savefig('gantt_chart.png', dpi=300, bbox_inches='tight')
     plt.close()
 
-if __name__ == "__main__":
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render the accuracy summary chart and project timeline')
+    parser.parse_args(argv)
+    
     create_evaluation_table()
-    create_gantt_chart() 
\ No newline at end of file
+    create_gantt_chart()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Face Crop Precomputation and Content-Addressed Store
+
+This script detects, aligns and crops faces once and stores the crops in a
+content-addressed store, so training runs read ready-made crops instead of
+re-running detection on every experiment:
+
+    <store>/objects/<hash[:2]>/<hash>.png   one file per unique crop
+    <store>/index.csv                       hash, perceptual hash, label, source, ...
+
+Crops are keyed by the SHA-256 of their pixels, so identical crops are stored
+once. A 64-bit difference hash (dHash) of each crop is compared against the
+store to flag near-duplicates (e.g. consecutive video frames or re-encoded
+copies); those are recorded in the index with `duplicate_of` set and are
+skipped by training. Only crops with the same label are matched: a crop whose
+label conflicts with a stored one is kept as its own row (sharing the stored
+object when the pixels are identical) rather than dropped as a duplicate.
+
+The input directory uses the same layout as `flow_from_directory`: one
+sub-directory per class. `train_model.py --face-index <store>/index.csv`
+trains directly from the store.
+
+Usage:
+    python face_store.py build model/data/fer --store model/data/faces_fer
+    python face_store.py stats --store model/data/faces_fer
+"""
+
+import os
+import csv
+import math
+import hashlib
+import argparse
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Crops are stored at the largest model input size; smaller inputs are
+# produced by resizing at load time
+CROP_SIZE = 224
+
+INDEX_FIELDS = ['hash', 'phash', 'label', 'source', 'path', 'duplicate_of', 'aligned']
+
+
+def create_face_detector():
+    """
+    Load OpenCV's frontal face and eye Haar cascades
+    """
+    import cv2
+
+    faces = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    eyes = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+    return faces, eyes
+
+
+def detect_and_align(image, detector, margin=0.15):
+    """
+    Find the largest face, rotate it so the eyes are level and crop it
+
+    Images in which no face is detected are assumed to be pre-cropped faces
+    (e.g. FER2013) and are used whole.
+
+    Args:
+        image (np.array): BGR image
+        detector: (face cascade, eye cascade) from create_face_detector
+        margin (float): Extra border around the detected box
+
+    Returns:
+        Tuple of (RGB crop of CROP_SIZE x CROP_SIZE, whether it was aligned)
+    """
+    import cv2
+
+    face_cascade, eye_cascade = detector
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    boxes = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(32, 32))
+    height, width = gray.shape
+    if len(boxes):
+        x, y, w, h = max(boxes, key=lambda b: b[2] * b[3])
+    else:
+        x, y, w, h = 0, 0, width, height
+
+    aligned = False
+    eyes = eye_cascade.detectMultiScale(gray[y:y + h // 2, x:x + w], scaleFactor=1.1, minNeighbors=5)
+    if len(eyes) >= 2:
+        # Two largest eye detections, left to right
+        eyes = sorted(sorted(eyes, key=lambda e: -e[2] * e[3])[:2], key=lambda e: e[0])
+        (lx, ly, lw, lh), (rx, ry, rw, rh) = eyes
+        left = (x + lx + lw / 2, y + ly + lh / 2)
+        right = (x + rx + rw / 2, y + ry + rh / 2)
+        angle = math.degrees(math.atan2(right[1] - left[1], right[0] - left[0]))
+        center = (x + w / 2, y + h / 2)
+        rotation = cv2.getRotationMatrix2D(center, angle, 1.0)
+        image = cv2.warpAffine(image, rotation, (width, height), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+        aligned = True
+
+    dx, dy = int(w * margin), int(h * margin)
+    crop = image[max(0, y - dy):min(height, y + h + dy), max(0, x - dx):min(width, x + w + dx)]
+    crop = cv2.resize(crop, (CROP_SIZE, CROP_SIZE), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(crop, cv2.COLOR_BGR2RGB), aligned
+
+
+def content_hash(crop):
+    """
+    SHA-256 of a crop's pixels and shape (independent of PNG encoding)
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(crop.shape).encode('ascii'))
+    digest.update(crop.tobytes())
+    return digest.hexdigest()
+
+
+def perceptual_hash(crop):
+    """
+    64-bit difference hash: compare adjacent pixels of a 9x8 grayscale
+    thumbnail. Robust to re-encoding, small shifts and brightness changes.
+    """
+    import cv2
+
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateIndex:
+    """
+    Find perceptual hashes within a Hamming distance using band lookup
+
+    The 64-bit hash is split into `max_distance + 1` bands; by the pigeonhole
+    principle any hash within `max_distance` bits matches at least one band
+    exactly, so only hashes sharing a band are compared.
+    """
+
+    def __init__(self, max_distance=4):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = math.ceil(64 / self.bands)
+        self.tables = [dict() for _ in range(self.bands)]
+
+    def _band_keys(self, value):
+        mask = (1 << self.band_bits) - 1
+        return [(value >> (i * self.band_bits)) & mask for i in range(self.bands)]
+
+    def add(self, value, key):
+        for table, band in zip(self.tables, self._band_keys(value)):
+            table.setdefault(band, []).append((value, key))
+
+    def find(self, value):
+        """
+        Return the key of the closest stored hash within max_distance, or None
+        """
+        best = None
+        for table, band in zip(self.tables, self._band_keys(value)):
+            for candidate, key in table.get(band, ()):
+                distance = hamming(value, candidate)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, key)
+        return best[1] if best else None
+
+
+class FaceStore:
+    """
+    Content-addressed crop store with a CSV index
+    """
+
+    def __init__(self, root, max_distance=4):
+        self.root = root
+        self.index_path = os.path.join(root, 'index.csv')
+        self.rows = []
+        self.by_hash = {}
+        self.labelled = set()
+        self.sources = set()
+        self.max_distance = max_distance
+        self.near = {}
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, newline='') as f:
+                for row in csv.DictReader(f):
+                    self._track(row)
+
+    def _track(self, row):
+        self.rows.append(row)
+        self.sources.add(row['source'])
+        if not row['duplicate_of']:
+            # The first stored row of a crop owns its object file
+            self.by_hash.setdefault(row['hash'], row)
+            self.labelled.add((row['hash'], row['label']))
+            self._near_index(row['label']).add(int(row['phash'], 16), row['hash'])
+
+    def _near_index(self, label):
+        # Near-duplicates are only matched within a label
+        if label not in self.near:
+            self.near[label] = NearDuplicateIndex(self.max_distance)
+        return self.near[label]
+
+    def object_path(self, crop_hash):
+        return os.path.join('objects', crop_hash[:2], f'{crop_hash}.png')
+
+    def add(self, crop, label, source, aligned=False):
+        """
+        Add a crop, storing it only if no identical or near-identical crop exists
+
+        Returns:
+            dict: The index row written for this crop
+        """
+        import cv2
+
+        crop_hash = content_hash(crop)
+        phash = perceptual_hash(crop)
+
+        if (crop_hash, label) in self.labelled:
+            duplicate_of = crop_hash
+        else:
+            duplicate_of = self._near_index(label).find(phash) or ''
+
+        if duplicate_of:
+            path = self.by_hash[duplicate_of]['path']
+        elif crop_hash in self.by_hash:
+            # Identical pixels under a different label: keep the row, reuse the object
+            path = self.by_hash[crop_hash]['path']
+        else:
+            path = self.object_path(crop_hash)
+            full_path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            cv2.imwrite(full_path, cv2.cvtColor(crop, cv2.COLOR_RGB2BGR))
+
+        row = {
+            'hash': crop_hash,
+            'phash': f'{phash:016x}',
+            'label': label,
+            'source': source,
+            'path': path,
+            'duplicate_of': duplicate_of,
+            'aligned': int(aligned),
+        }
+        self._track(row)
+        return row
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=INDEX_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+        os.replace(tmp_path, self.index_path)
+
+
+def iter_images(data_dir):
+    """
+    Yield (path, label) for every image, labelled by its class sub-directory
+    """
+    for dirpath, _, filenames in sorted(os.walk(data_dir)):
+        label = os.path.relpath(dirpath, data_dir)
+        label = '' if label == '.' else label.split(os.sep)[0]
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, filename), label
+
+
+def build_store(data_dir, store_dir, max_distance=4, save_every=1000):
+    """
+    Detect, align and crop every image under data_dir into the store
+
+    Sources already present in the index are skipped, so the build can be
+    resumed or re-run after new images are added.
+
+    Returns:
+        FaceStore: The updated store
+    """
+    import cv2
+
+    store = FaceStore(store_dir, max_distance=max_distance)
+    detector = create_face_detector()
+    added = duplicates = skipped = 0
+
+    for i, (path, label) in enumerate(iter_images(data_dir)):
+        source = os.path.relpath(path, data_dir)
+        if source in store.sources:
+            skipped += 1
+            continue
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            print(f"Warning: could not read {path}")
+            continue
+        crop, aligned = detect_and_align(image, detector)
+        row = store.add(crop, label, source, aligned=aligned)
+        if row['duplicate_of']:
+            duplicates += 1
+        else:
+            added += 1
+        if (added + duplicates) % save_every == 0:
+            store.save()
+            print(f"Processed {i + 1} images ({added} stored, {duplicates} duplicates)")
+
+    store.save()
+    print(f"Stored {added} new crops, {duplicates} duplicates, {skipped} already indexed")
+    return store
+
+
+def read_face_index(index_path, include_duplicates=False):
+    """
+    Load a store index as a DataFrame for `flow_from_dataframe`
+
+    Paths are made absolute and near-duplicates are dropped unless requested.
+
+    Returns:
+        pd.DataFrame: Columns 'path' (absolute) and 'label', plus index metadata
+    """
+    import pandas as pd
+
+    df = pd.read_csv(index_path, dtype=str, keep_default_na=False)
+    if not include_duplicates:
+        df = df[df['duplicate_of'] == '']
+    root = os.path.dirname(os.path.abspath(index_path))
+    df = df.assign(path=[os.path.join(root, p) for p in df['path']])
+    return df.reset_index(drop=True)
+
+
+def split_face_index(df, validation_split=0.2, seed=0):
+    """
+    Split an index per class, as flow_from_directory does, so every class
+    is represented in both subsets (the index itself is grouped by class)
+
+    Args:
+        df (pd.DataFrame): Index from read_face_index
+        validation_split (float): Share of each class used for validation
+        seed (int): Seed for the per-class shuffle
+
+    Returns:
+        Tuple of (training DataFrame, validation DataFrame)
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    validation = np.zeros(len(df), dtype=bool)
+    for _, positions in sorted(df.groupby('label').indices.items()):
+        positions = rng.permutation(positions)
+        validation[positions[:int(validation_split * len(positions))]] = True
+    return df[~validation].reset_index(drop=True), df[validation].reset_index(drop=True)
+
+
+def print_stats(store):
+    unique = [r for r in store.rows if not r['duplicate_of']]
+    exact = sum(1 for r in store.rows if r['duplicate_of'] == r['hash'])
+    near = len(store.rows) - len(unique) - exact
+    labels = {}
+    for row in unique:
+        labels[row['label']] = labels.get(row['label'], 0) + 1
+    size = sum(os.path.getsize(os.path.join(store.root, r['path'])) for r in unique
+               if os.path.exists(os.path.join(store.root, r['path'])))
+
+    print(f"Store: {store.root}")
+    print(f"Indexed images: {len(store.rows)}")
+    print(f"Unique crops: {len(unique)} ({size / (1024 * 1024):.1f} MB)")
+    print(f"Exact duplicates: {exact}, near-duplicates: {near}")
+    for label, count in sorted(labels.items()):
+        print(f"  {label or '(unlabelled)'}: {count}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precompute aligned face crops into a deduplicated store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='detect, align and store face crops')
+    build_parser.add_argument('data_dir', type=str,
+                      help='image directory with one sub-directory per class')
+    build_parser.add_argument('--store', type=str, required=True,
+                      help='store directory (created if missing)')
+    build_parser.add_argument('--max-distance', type=int, default=4,
+                      help='dHash Hamming distance treated as a near-duplicate (default: 4)')
+
+    stats_parser = subparsers.add_parser('stats', help='summarize a store')
+    stats_parser.add_argument('--store', type=str, required=True,
+                      help='store directory')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        store = build_store(args.data_dir, args.store, max_distance=args.max_distance)
+        print_stats(store)
+        print(f"\nTrain from this store with: python train_model.py --face-index {store.index_path}")
+    else:
+        print_stats(FaceStore(args.store))
+
+
+if __name__ == '__main__':
+    main()
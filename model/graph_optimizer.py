@@ -0,0 +1,381 @@
+"""
+Inference-Graph Optimizer
+
+`convert_model_to_tflite` leaves BatchNormalization and Dropout cleanup to
+the TFLite converter, whose fusion rules change between versions. This
+script rewrites a Keras model into an inference graph before conversion:
+
+- training-only layers (Dropout variants, GaussianNoise, ActivityRegularization
+  and the augmentation wrapper) are removed
+- BatchNormalization is folded into the weights of the preceding Conv2D /
+  DepthwiseConv2D / Dense when that layer has a linear activation (every BN
+  in the MobileNetV2 backbone)
+- a BN that follows an activation (the expression model's conv blocks) is
+  folded forward into the next Dense, or Conv2D with 'valid' padding, when
+  only Flatten, pooling or removed layers sit in between. Max pooling is
+  crossed only if every BN scale is positive. Folding forward into a 'same'
+  padded convolution would change its zero-padded borders, so those BNs are
+  kept and reported
+- the rewritten model is checked against the original on sample inputs and
+  rejected if any output differs by more than `--tolerance`
+
+The `report` command converts the model with and without the pass and
+compares TFLite op counts by type and invoke latency.
+
+Usage:
+    python graph_optimizer.py optimize --model-path models/expression/expression_model_best.h5
+    python graph_optimizer.py report --model-path models/expression/expression_model_best.h5
+"""
+
+import os
+import argparse
+import tempfile
+from collections import Counter
+
+# Layers that are the identity at inference time
+TRAINING_ONLY_LAYERS = ('Dropout', 'SpatialDropout1D', 'SpatialDropout2D', 'SpatialDropout3D', 'GaussianDropout',
+                        'GaussianNoise', 'AlphaDropout', 'ActivityRegularization')
+
+# Layers an affine per-channel BN output can be moved through unchanged
+# (MaxPooling2D only when every scale is positive)
+AFFINE_TRANSPARENT_LAYERS = ('Flatten', 'AveragePooling2D', 'GlobalAveragePooling2D', 'MaxPooling2D')
+
+
+def batch_norm_affine(layer):
+    """
+    Inference-time BatchNormalization as a per-channel `x * scale + shift`
+    """
+    import numpy as np
+
+    weights = {w.name.split('/')[-1].split(':')[0]: w.numpy() for w in layer.weights}
+    variance, mean = weights['moving_variance'], weights['moving_mean']
+    gamma = weights.get('gamma', np.ones_like(variance))
+    beta = weights.get('beta', np.zeros_like(mean))
+    scale = gamma / np.sqrt(variance + layer.epsilon)
+    return scale.astype(np.float32), (beta - mean * scale).astype(np.float32)
+
+
+def _class_name(layer):
+    return layer.__class__.__name__
+
+
+def _input_tensors(layer):
+    inputs = layer.input
+    return list(inputs) if isinstance(inputs, (list, tuple)) else [inputs]
+
+
+def _is_linear(layer):
+    return layer.get_config().get('activation', 'linear') == 'linear'
+
+
+class GraphPlan:
+    """
+    Producer/consumer view of a functional model and the folds to apply
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.layers = [layer for layer in model.layers if _class_name(layer) != 'InputLayer']
+        # Recorded up front: once layers are reused in the rebuilt model they
+        # have two inbound nodes and `layer.input`/`layer.output` are ambiguous
+        self.inputs = {layer.name: _input_tensors(layer) for layer in self.layers}
+        self.output_ids = {layer.name: id(layer.output) for layer in model.layers}
+        self.producer = {}
+        for layer in model.layers:
+            self.producer[id(layer.output)] = layer
+        self.consumers = {layer.name: [] for layer in model.layers}
+        for layer in self.layers:
+            for tensor in self.inputs[layer.name]:
+                self.consumers[self.producer[id(tensor)].name].append(layer)
+        self.output_layers = {self.producer[id(tensor)].name for tensor in model.outputs}
+
+        self.removed = set()        # layers replaced by their input
+        self.backward = {}          # target layer name -> (scale, shift) folded into its output
+        self.forward = {}           # target layer name -> (scale, shift, repeats) folded into its input
+        self.kept = {}              # BN name -> reason it could not be folded
+        self._plan()
+
+    def _only_consumer(self, layer):
+        consumers = self.consumers[layer.name]
+        if len(consumers) != 1 or layer.name in self.output_layers:
+            return None
+        return consumers[0]
+
+    def _plan(self):
+        import numpy as np
+
+        for layer in self.layers:
+            if _class_name(layer) in TRAINING_ONLY_LAYERS:
+                self.removed.add(layer.name)
+
+        for layer in self.layers:
+            if _class_name(layer) != 'BatchNormalization':
+                continue
+            axis = layer.axis[0] if isinstance(layer.axis, (list, tuple)) else layer.axis
+            if axis not in (-1, len(layer.input.shape) - 1):
+                self.kept[layer.name] = f'normalizes axis {axis}, not channels'
+                continue
+            scale, shift = batch_norm_affine(layer)
+
+            source = self.producer[id(layer.input)]
+            if (_class_name(source) in ('Conv2D', 'DepthwiseConv2D', 'Dense') and _is_linear(source)
+                    and self._only_consumer(source) is layer and source.name not in self.backward):
+                self.backward[source.name] = (scale, shift)
+                self.removed.add(layer.name)
+                continue
+
+            target, repeats, reason = self._forward_target(layer, bool(np.all(scale > 0)))
+            if target is not None and target.name not in self.forward:
+                self.forward[target.name] = (scale, shift, repeats)
+                self.removed.add(layer.name)
+            else:
+                self.kept[layer.name] = reason or f'{target.name} already absorbs another BN'
+
+    def _forward_target(self, layer, positive):
+        """
+        Follow single-consumer, affine-transparent layers from a BN to a
+        Dense / valid Conv2D that can absorb it
+
+        Returns:
+            Tuple of (target layer or None, flatten repeats, reason if None)
+        """
+        import numpy as np
+
+        repeats = 1
+        current = layer
+        while True:
+            consumer = self._only_consumer(current)
+            if consumer is None:
+                return None, 1, 'output is used by several layers or is a model output'
+            name = _class_name(consumer)
+            if consumer.name in self.removed and name in TRAINING_ONLY_LAYERS:
+                current = consumer
+            elif name == 'MaxPooling2D' and not positive:
+                return None, 1, 'negative scale cannot move through max pooling'
+            elif name in AFFINE_TRANSPARENT_LAYERS:
+                if name == 'Flatten':
+                    repeats = int(np.prod(consumer.input.shape[1:-1]))
+                current = consumer
+            elif name == 'Dense':
+                return consumer, repeats, None
+            elif name == 'Conv2D' and consumer.padding == 'valid' and repeats == 1:
+                return consumer, 1, None
+            elif name == 'Conv2D':
+                return None, 1, f"followed by {consumer.name} with '{consumer.padding}' padding"
+            else:
+                return None, 1, f'followed by {name} {consumer.name}'
+
+
+def folded_weights(layer, backward=None, forward=None):
+    """
+    Kernel and bias of a Conv2D / DepthwiseConv2D / Dense with BN affines
+    folded into its output (backward) and/or its input (forward)
+    """
+    import numpy as np
+
+    kernel = layer.kernel.numpy() if _class_name(layer) != 'DepthwiseConv2D' else layer.depthwise_kernel.numpy()
+    if layer.use_bias:
+        bias = layer.bias.numpy()
+    else:
+        # Depthwise output channels are input channels x depth multiplier
+        bias = np.zeros(int(np.prod(kernel.shape[2:])) if _class_name(layer) == 'DepthwiseConv2D'
+                        else kernel.shape[-1], dtype=np.float32)
+    if forward is not None:
+        scale, shift, repeats = forward
+        scale, shift = np.tile(scale, repeats), np.tile(shift, repeats)
+        if _class_name(layer) == 'Dense':
+            bias = bias + shift @ kernel
+            kernel = kernel * scale[:, np.newaxis]
+        else:
+            bias = bias + np.einsum('hwio,i->o', kernel, shift)
+            kernel = kernel * scale[np.newaxis, np.newaxis, :, np.newaxis]
+    if backward is not None:
+        scale, shift = backward
+        if _class_name(layer) == 'DepthwiseConv2D':
+            kernel = kernel * scale.reshape(kernel.shape[2:])
+        else:
+            kernel = kernel * scale
+        bias = bias * scale + shift
+    return kernel.astype(np.float32), bias.astype(np.float32)
+
+
+def optimize_for_inference(model):
+    """
+    Rebuild a Keras model with training-only layers removed and BatchNorm
+    folded where it is exact
+
+    Returns:
+        Tuple of (optimized tf.keras.Model, summary dict)
+    """
+    import tensorflow as tf
+    from model_export import inference_model
+
+    model = inference_model(model)
+    plan = GraphPlan(model)
+
+    tensors = {}
+    new_inputs = []
+    for tensor in model.inputs:
+        new_input = tf.keras.Input(shape=tensor.shape[1:], dtype=tensor.dtype, name=plan.producer[id(tensor)].name)
+        tensors[id(tensor)] = new_input
+        new_inputs.append(new_input)
+
+    for layer in plan.layers:
+        inputs = [tensors[id(tensor)] for tensor in plan.inputs[layer.name]]
+        if layer.name in plan.removed:
+            output = inputs[0]
+        elif layer.name in plan.backward or layer.name in plan.forward:
+            config = layer.get_config()
+            config['use_bias'] = True
+            rebuilt = layer.__class__.from_config(config)
+            output = rebuilt(inputs[0])
+            folded = folded_weights(layer, plan.backward.get(layer.name), plan.forward.get(layer.name))
+            rebuilt.set_weights(list(folded))
+        else:
+            output = layer(inputs if len(inputs) > 1 else inputs[0])
+        tensors[plan.output_ids[layer.name]] = output
+
+    outputs = [tensors[id(tensor)] for tensor in model.outputs]
+    optimized = tf.keras.Model(inputs=new_inputs if len(new_inputs) > 1 else new_inputs[0],
+                               outputs=outputs if len(outputs) > 1 else outputs[0], name=model.name)
+    summary = {
+        'layers_before': len(model.layers),
+        'layers_after': len(optimized.layers),
+        'removed_training_layers': sum(_class_name(layer) in TRAINING_ONLY_LAYERS for layer in plan.layers),
+        'folded_backward': len(plan.backward),
+        'folded_forward': len(plan.forward),
+        'kept_batch_norm': plan.kept,
+    }
+    return optimized, summary
+
+
+def verify_equivalence(original, optimized, samples=None, count=16, tolerance=1e-4, seed=0):
+    """
+    Compare both models' outputs on sample inputs
+
+    Args:
+        samples (np.array): Inputs to compare on (default: `count` uniform
+            random inputs in [0, 1], the models' preprocessed input range)
+        tolerance (float): Largest allowed absolute output difference
+
+    Returns:
+        float: Maximum absolute difference
+
+    Raises:
+        ValueError: If the difference exceeds tolerance
+    """
+    import numpy as np
+
+    if samples is None:
+        rng = np.random.default_rng(seed)
+        samples = rng.random((count, *original.inputs[0].shape[1:]), dtype=np.float32)
+    expected = np.asarray(original(samples, training=False))
+    actual = np.asarray(optimized(samples, training=False))
+    difference = float(np.abs(expected - actual).max())
+    if difference > tolerance:
+        raise ValueError(f"Optimized graph differs from the original by {difference:.2e} (tolerance {tolerance:.0e})")
+    return difference
+
+
+def optimize_and_verify(model, tolerance=1e-4, samples=None):
+    """
+    optimize_for_inference plus verify_equivalence; the summary gains
+    'max_abs_difference'
+    """
+    optimized, summary = optimize_for_inference(model)
+    summary['max_abs_difference'] = verify_equivalence(model, optimized, samples=samples, tolerance=tolerance)
+    return optimized, summary
+
+
+def print_optimization(summary):
+    print(f"Layers: {summary['layers_before']} -> {summary['layers_after']} "
+          f"({summary['removed_training_layers']} training-only removed, "
+          f"{summary['folded_backward']} BN folded into the preceding layer, "
+          f"{summary['folded_forward']} into the following layer)")
+    for name, reason in summary['kept_batch_norm'].items():
+        print(f"  kept {name}: {reason}")
+    if 'max_abs_difference' in summary:
+        print(f"Max output difference on sample inputs: {summary['max_abs_difference']:.2e}")
+
+
+def compare_conversions(model_path, runs=50, num_threads=None, tolerance=1e-4, work_dir=None):
+    """
+    Convert a checkpoint with and without the pass and compare TFLite op
+    counts and invoke latency
+
+    Returns:
+        dict: Optimization summary, per-op-type counts and latency of both
+    """
+    from tensorflow.keras.models import load_model
+    from convert_to_tflite import convert_model_to_tflite
+    from tflite_profiler import inspect_model, measure_invoke
+
+    work_dir = work_dir or tempfile.mkdtemp(prefix='graph_optimizer_')
+    model = load_model(model_path, compile=False)
+    optimized, summary = optimize_and_verify(model, tolerance=tolerance)
+    optimized_path = os.path.join(work_dir, 'optimized.keras')
+    optimized.save(optimized_path)
+
+    result = {'summary': summary}
+    for name, path in (('before', model_path), ('after', optimized_path)):
+        tflite_path = convert_model_to_tflite(path, os.path.join(work_dir, f'{name}.tflite'), optimize_graph=False)
+        ops = Counter(op['op'] for op in inspect_model(tflite_path)['ops'])
+        result[name] = {'ops': dict(ops), 'op_count': sum(ops.values()),
+                        'invoke': measure_invoke(tflite_path, runs=runs, num_threads=num_threads)}
+    return result
+
+
+def print_conversion_report(result):
+    print_optimization(result['summary'])
+    before, after = result['before']['ops'], result['after']['ops']
+    print(f"\n{'TFLite op':<28}{'Before':>8}{'After':>8}")
+    for op in sorted(set(before) | set(after)):
+        if before.get(op, 0) != after.get(op, 0):
+            print(f"{op:<28}{before.get(op, 0):>8}{after.get(op, 0):>8}")
+    print(f"{'Total':<28}{result['before']['op_count']:>8}{result['after']['op_count']:>8}")
+    before_ms, after_ms = result['before']['invoke']['mean_ms'], result['after']['invoke']['mean_ms']
+    print(f"\nInvoke latency: {before_ms:.2f} ms -> {after_ms:.2f} ms ({before_ms / after_ms:.2f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fold BatchNorm and strip training-only layers before conversion')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    optimize_parser = subparsers.add_parser('optimize', help='write the optimized inference model')
+    optimize_parser.add_argument('--model-path', type=str, required=True,
+                      help='path to the Keras checkpoint (.h5 or .keras)')
+    optimize_parser.add_argument('--output', type=str, default=None,
+                      help='output .keras path (default: <checkpoint>_optimized.keras)')
+    optimize_parser.add_argument('--tolerance', type=float, default=1e-4,
+                      help='largest allowed output difference on sample inputs (default: 1e-4)')
+
+    report_parser = subparsers.add_parser('report',
+                                          help='compare TFLite op counts and latency with and without the pass')
+    report_parser.add_argument('--model-path', type=str, required=True,
+                      help='path to the Keras checkpoint (.h5 or .keras)')
+    report_parser.add_argument('--runs', type=int, default=50,
+                      help='timed invokes per model (default: 50)')
+    report_parser.add_argument('--threads', type=int, default=None,
+                      help='interpreter threads')
+    report_parser.add_argument('--tolerance', type=float, default=1e-4,
+                      help='largest allowed output difference on sample inputs (default: 1e-4)')
+    report_parser.add_argument('--work-dir', type=str, default=None,
+                      help='where to write the converted models (default: a temporary directory)')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'optimize':
+        from tensorflow.keras.models import load_model
+
+        optimized, summary = optimize_and_verify(load_model(args.model_path, compile=False), tolerance=args.tolerance)
+        print_optimization(summary)
+        output = args.output or os.path.splitext(args.model_path)[0] + '_optimized.keras'
+        optimized.save(output)
+        print(f"Optimized model saved to {output}")
+    else:
+        print_conversion_report(compare_conversions(args.model_path, runs=args.runs, num_threads=args.threads,
+                                                    tolerance=args.tolerance, work_dir=args.work_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""
+Hyperparameter Search for the Recognition Models
+
+This script searches over learning rate, batch size, classification head
+widths and dropout rates for one task. Trials run in a process pool, each
+process limited to a fixed number of TensorFlow threads so parallel trials
+do not oversubscribe the CPU. Three strategies are available:
+
+- random: every sampled config trains for the full epoch budget
+- halving: successive halving; all configs train for a few epochs, the best
+  1/eta continue (from their saved model) with eta times the budget, and so on
+- hyperband: several successive-halving brackets trading off the number of
+  configs against the epochs each starts with
+
+Within a run, a trial is also stopped as soon as its val_loss is worse than
+the median val_loss other trials have reached at the same epoch. Trials
+publish each epoch's val_loss to a dict shared through a multiprocessing
+manager as they train, so running trials are compared with each other, not
+only with trials that finished before them.
+
+Results (config, epochs, best val_loss/val_accuracy, parameter count) are
+written to `<output-dir>/<task>_search.csv`, sorted by val_loss, so a smaller
+head with equal accuracy is easy to spot. With --latency-budget-ms and/or
+--size-budget-mb, the trials are then converted, benchmarked and the most
+accurate one within budget is written out (see model_selection.py).
+
+Usage:
+    python hparam_search.py --task age --data-dir model/data --strategy hyperband --workers 4 --threads 2
+"""
+
+import os
+import csv
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from train_model import BATCH_SIZE, EPOCHS, LEARNING_RATE
+from model_registry import options_digest
+from model_selection import add_budget_arguments, run_selection, search_candidates
+
+# Candidate classification heads per task (units of each dense layer)
+HEAD_CHOICES = {
+    'age': [(1024, 512), (512, 256), (256, 128), (256,), (128,)],
+    'gender': [(512,), (256,), (128,), (64,)],
+    'expression': [(512, 256), (256, 128), (128, 64), (128,)],
+}
+
+RESULT_FIELDS = ['trial', 'learning_rate', 'batch_size', 'head_units', 'dropout', 'epochs',
+                 'val_loss', 'val_accuracy', 'params', 'stopped_early', 'seconds']
+
+
+def sample_config(task, rng):
+    """
+    Draw one hyperparameter configuration
+    """
+    head_units = rng.choice(HEAD_CHOICES[task])
+    return {
+        'learning_rate': 10 ** rng.uniform(math.log10(LEARNING_RATE) - 1, math.log10(LEARNING_RATE) + 0.5),
+        'batch_size': rng.choice([16, BATCH_SIZE, 64]),
+        'head_units': list(head_units),
+        'dropout': [round(rng.uniform(0.1, 0.6), 2) for _ in head_units],
+    }
+
+
+def _init_worker(threads):
+    """
+    Limit TensorFlow's thread pools in a trial process (must run before any op)
+    """
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def median_val_loss(val_losses, epoch, exclude=None, min_trials=3):
+    """
+    Median val_loss at an epoch over the trials that reached it
+
+    Args:
+        val_losses: Mapping of 'trial:epoch' -> val_loss (shared between trials)
+        epoch (int): 1-based epoch
+        exclude (int): Trial to leave out (the one being compared)
+        min_trials (int): Trials required before the median is meaningful
+
+    Returns:
+        float: The median, or None with fewer than min_trials trials
+    """
+    losses = []
+    # One proxy call copies the whole dict; it holds a float per trial epoch
+    for key, loss in val_losses.items():
+        trial, _, reached = key.partition(':')
+        if int(reached) == epoch and int(trial) != exclude:
+            losses.append(loss)
+    losses.sort()
+    return losses[len(losses) // 2] if len(losses) >= min_trials else None
+
+
+def run_trial(trial_id, task, config, epochs, data_dir, face_index, trial_dir, val_losses):
+    """
+    Train one trial up to `epochs` total epochs, resuming from its saved model
+
+    The trial's config and data source are hashed into state.json; a trial
+    directory left by a different search is cleared instead of resumed.
+
+    Args:
+        trial_id (int): Trial number
+        task (str): 'age', 'gender', or 'expression'
+        config (dict): Sampled hyperparameters
+        epochs (int): Total epochs the trial should have completed when this returns
+        data_dir (str): Dataset directory (or None with face_index)
+        face_index (str): Face store index (or None)
+        trial_dir (str): Where the trial keeps its model between rungs
+        val_losses: Shared 'trial:epoch' -> val_loss dict; this trial publishes
+            its losses and stops once worse than the others' median
+
+    Returns:
+        dict: Trial result, including the full val_loss history
+    """
+    import tensorflow as tf
+    from train_model import create_data_generators, create_model
+
+    start = time.perf_counter()
+    model_path = os.path.join(trial_dir, 'model.keras')
+    state_path = os.path.join(trial_dir, 'state.json')
+    trial_config = {'task': task, 'config': config, 'data_dir': data_dir, 'face_index': face_index}
+    config_hash = options_digest(trial_config)
+
+    state = {'config': trial_config, 'config_hash': config_hash,
+             'history': {'val_loss': [], 'val_accuracy': []}, 'stopped_early': False}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            saved = json.load(f)
+        if saved.get('config_hash') == config_hash:
+            state = saved
+        else:
+            print(f"Trial {trial_id}: {trial_dir} holds a different config; starting it afresh")
+            shutil.rmtree(trial_dir)
+    elif os.path.exists(model_path):
+        # A model without state cannot be matched to a config
+        os.remove(model_path)
+    os.makedirs(trial_dir, exist_ok=True)
+    done = len(state['history']['val_loss'])
+    for epoch, loss in enumerate(state['history']['val_loss'], start=1):
+        val_losses[f'{trial_id}:{epoch}'] = loss
+
+    if done < epochs and not state['stopped_early']:
+        train_generator, validation_generator = create_data_generators(
+            data_dir, task, face_index=face_index, batch_size=config['batch_size']
+        )
+        if done:
+            model = tf.keras.models.load_model(model_path)
+        else:
+            model = create_model(task, head_units=config['head_units'], dropout=config['dropout'],
+                                 learning_rate=config['learning_rate'])
+
+        class MedianStopping(tf.keras.callbacks.Callback):
+            def on_epoch_end(self, epoch, logs=None):
+                if 'val_loss' not in (logs or {}):
+                    return
+                val_losses[f'{trial_id}:{epoch + 1}'] = float(logs['val_loss'])
+                threshold = median_val_loss(val_losses, epoch + 1, exclude=trial_id)
+                if threshold is not None and logs['val_loss'] > threshold:
+                    state['stopped_early'] = True
+                    self.model.stop_training = True
+
+        history = model.fit(
+            train_generator,
+            validation_data=validation_generator,
+            initial_epoch=done,
+            epochs=epochs,
+            callbacks=[MedianStopping()],
+            verbose=0
+        )
+        for name in ('val_loss', 'val_accuracy'):
+            state['history'][name].extend(float(v) for v in history.history.get(name, []))
+        state['params'] = int(model.count_params())
+        model.save(model_path)
+        with open(state_path, 'w') as f:
+            json.dump(state, f)
+
+    val_loss = state['history']['val_loss']
+    best = min(range(len(val_loss)), key=val_loss.__getitem__) if val_loss else None
+    return {
+        'trial': trial_id,
+        **config,
+        'epochs': len(val_loss),
+        'val_loss': val_loss[best] if best is not None else float('inf'),
+        'val_accuracy': state['history']['val_accuracy'][best] if best is not None else 0.0,
+        'params': state.get('params'),
+        'stopped_early': state['stopped_early'],
+        'seconds': time.perf_counter() - start,
+        'history': val_loss,
+    }
+
+
+class SearchRunner:
+    """
+    Run trials in a process pool, sharing their per-epoch val_loss for
+    early stopping
+    """
+
+    def __init__(self, task, data_dir=None, face_index=None, output_dir='models/search',
+                 workers=2, threads=2, seed=0):
+        import multiprocessing
+
+        self.task = task
+        self.data_dir = data_dir
+        self.face_index = face_index
+        self.output_dir = os.path.join(output_dir, task)
+        self.rng = random.Random(seed)
+        self.results = {}
+        self.configs = {}
+        context = multiprocessing.get_context('spawn')
+        # Live 'trial:epoch' -> val_loss, written and read by the trials as they train
+        self.manager = context.Manager()
+        self.val_losses = self.manager.dict()
+        # Spawned workers start with a fresh TensorFlow runtime each
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(threads,)
+        )
+
+    def new_trials(self, count):
+        ids = []
+        for _ in range(count):
+            trial_id = len(self.configs)
+            self.configs[trial_id] = sample_config(self.task, self.rng)
+            ids.append(trial_id)
+        return ids
+
+    def run(self, trial_ids, epochs):
+        """
+        Train the given trials to `epochs` total epochs in parallel
+
+        Returns:
+            list: Results of those trials
+        """
+        futures = {
+            trial_id: self.pool.submit(
+                run_trial, trial_id, self.task, self.configs[trial_id], epochs, self.data_dir,
+                self.face_index, os.path.join(self.output_dir, f'trial_{trial_id:03d}'), self.val_losses
+            )
+            for trial_id in trial_ids
+        }
+        for trial_id, future in futures.items():
+            result = future.result()
+            self.results[trial_id] = result
+            print(f"  trial {trial_id:3d}: {result['epochs']:3d} epochs, val_loss {result['val_loss']:.4f}, "
+                  f"val_acc {result['val_accuracy']:.4f}, head {result['head_units']}"
+                  f"{' (stopped early)' if result['stopped_early'] else ''}")
+        return [self.results[trial_id] for trial_id in trial_ids]
+
+    def shutdown(self):
+        self.pool.shutdown()
+        self.manager.shutdown()
+
+
+def random_search(runner, trials, max_epochs):
+    print(f"Random search: {trials} trials x {max_epochs} epochs")
+    runner.run(runner.new_trials(trials), max_epochs)
+
+
+def successive_halving(runner, trials, min_epochs, max_epochs, eta=3):
+    """
+    Train all trials for min_epochs, keep the best 1/eta, multiply the
+    budget by eta, and repeat until max_epochs
+    """
+    trial_ids = runner.new_trials(trials)
+    epochs = min_epochs
+    while trial_ids:
+        print(f"Rung: {len(trial_ids)} trial(s) to {epochs} epochs")
+        results = runner.run(trial_ids, epochs)
+        if epochs >= max_epochs:
+            break
+        survivors = [r for r in results if not r['stopped_early']]
+        survivors.sort(key=lambda r: r['val_loss'])
+        trial_ids = [r['trial'] for r in survivors[:max(1, len(results) // eta)]]
+        epochs = min(max_epochs, epochs * eta)
+
+
+def hyperband(runner, max_epochs, eta=3):
+    """
+    Run successive-halving brackets from many short trials to few full ones
+    """
+    s_max = int(math.log(max_epochs) / math.log(eta) + 1e-9)
+    for s in range(s_max, -1, -1):
+        trials = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+        min_epochs = max(1, int(round(max_epochs * eta ** -s)))
+        print(f"\nBracket s={s}: {trials} trials starting at {min_epochs} epochs")
+        successive_halving(runner, trials, min_epochs, max_epochs, eta)
+
+
+def write_results(results, path):
+    """
+    Write trial results sorted by val_loss to CSV
+    """
+    rows = sorted(results, key=lambda r: r['val_loss'])
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, head_units='x'.join(map(str, row['head_units'])),
+                                 dropout='/'.join(map(str, row['dropout']))))
+    return rows
+
+
+def print_results(rows, top=10):
+    print(f"\n{'Trial':>5} {'LR':>9} {'Batch':>5} {'Head':<12}{'Epochs':>6} {'val_loss':>9} "
+          f"{'val_acc':>8} {'Params':>10}")
+    for row in rows[:top]:
+        head = 'x'.join(map(str, row['head_units']))
+        params = f"{row['params']:,}" if row['params'] else '-'
+        print(f"{row['trial']:>5} {row['learning_rate']:>9.2e} {row['batch_size']:>5} {head:<12}"
+              f"{row['epochs']:>6} {row['val_loss']:>9.4f} {row['val_accuracy']:>8.4f} {params:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hyperparameter search with early-stopped parallel trials')
+    parser.add_argument('--task', type=str, choices=['age', 'gender', 'expression'], required=True,
+                      help='model to tune')
+    parser.add_argument('--data-dir', type=str, default=None,
+                      help='dataset directory with one sub-directory per class')
+    parser.add_argument('--face-index', type=str, default=None,
+                      help='train from a face store index.csv instead of --data-dir')
+    parser.add_argument('--strategy', type=str, choices=['random', 'halving', 'hyperband'], default='hyperband',
+                      help='search strategy (default: hyperband)')
+    parser.add_argument('--trials', type=int, default=27,
+                      help='configs to sample for random search and successive halving (default: 27)')
+    parser.add_argument('--max-epochs', type=int, default=27,
+                      help=f'epoch budget of a fully trained trial (default: 27, full training uses {EPOCHS})')
+    parser.add_argument('--min-epochs', type=int, default=1,
+                      help='epochs in the first successive-halving rung (default: 1)')
+    parser.add_argument('--eta', type=int, default=3,
+                      help='keep 1/eta of the trials per rung (default: 3)')
+    parser.add_argument('--workers', type=int, default=2,
+                      help='trials trained in parallel (default: 2)')
+    parser.add_argument('--threads', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                      help='TensorFlow threads per trial (default: half the CPUs)')
+    parser.add_argument('--output-dir', type=str, default=os.path.join('models', 'search'),
+                      help='directory for trial checkpoints and the results table (default: models/search)')
+    parser.add_argument('--seed', type=int, default=0,
+                      help='random seed for config sampling (default: 0)')
+    add_budget_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    if not args.data_dir and not args.face_index:
+        parser.error('one of --data-dir or --face-index is required')
+
+    runner = SearchRunner(args.task, data_dir=args.data_dir, face_index=args.face_index,
+                          output_dir=args.output_dir, workers=args.workers, threads=args.threads, seed=args.seed)
+    start = time.perf_counter()
+    try:
+        if args.strategy == 'random':
+            random_search(runner, args.trials, args.max_epochs)
+        elif args.strategy == 'halving':
+            successive_halving(runner, args.trials, args.min_epochs, args.max_epochs, args.eta)
+        else:
+            hyperband(runner, args.max_epochs, args.eta)
+    finally:
+        runner.shutdown()
+
+    results_path = os.path.join(runner.output_dir, f'{args.task}_search.csv')
+    rows = write_results(runner.results.values(), results_path)
+    print_results(rows)
+    total_epochs = sum(r['epochs'] for r in rows)
+    print(f"\n{len(rows)} trials, {total_epochs} epochs in {time.perf_counter() - start:.0f} s; "
+          f"results written to {results_path}")
+
+    if args.latency_budget_ms is not None or args.size_budget_mb is not None:
+        run_selection(
+            search_candidates(args.output_dir, args.task), args.task,
+            latency_budget_ms=args.latency_budget_ms,
+            size_budget_mb=args.size_budget_mb,
+            latency_metric=args.latency_metric,
+            quantize=args.quantize,
+            runs=args.benchmark_runs,
+            threads=args.benchmark_threads
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,446 @@
+"""
+Local Inference Server with Dynamic Request Batching
+
+This script serves the converted age, gender and expression models over HTTP
+on the local CPU. Each request carries a single face crop; requests arriving
+within a short latency window are coalesced into micro-batches and run
+through a pool of interpreters (one per worker thread, per task), so a busy
+server invokes each model once per batch instead of once per face.
+
+Endpoints:
+    POST /predict   body: image bytes (Content-Type image/*) or JSON
+                    {"image": "<base64 PNG/JPEG>"}; returns age, gender and
+                    expression labels with confidences
+    GET  /metrics   request count, p50/p99 latency, queue depth and batch sizes
+    GET  /health    liveness check
+
+With --embedding-model, age and gender are served from a face-embedding
+cache when a similar face was seen recently (embedding_cache.py); /metrics
+then includes its hit rate and estimated time saved. Embeddings are
+micro-batched on their own interpreter pool like the task models.
+
+The `load-test` command sends concurrent requests from a local client and
+reports client-side latency and throughput.
+
+Usage:
+    python inference_server.py serve --models-dir models --max-batch-size 16 --max-latency-ms 5
+    python inference_server.py load-test --image face.jpg --requests 2000 --concurrency 32
+"""
+
+import io
+import os
+import json
+import time
+import queue
+import base64
+import argparse
+import threading
+from collections import deque, Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from embedding_cache import EmbeddingModel, add_cache_arguments, create_face_cache
+from tflite_inference import TASKS, TFLiteModel, default_model_path
+
+
+class LatencyStats:
+    """
+    Thread-safe rolling window of latency samples
+    """
+
+    def __init__(self, window=10000):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, latency_ms):
+        with self._lock:
+            self._samples.append(latency_ms)
+            self.count += 1
+
+    def percentiles(self, *points):
+        """
+        Return the requested percentiles (0-100) of the current window
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return [None for _ in points]
+        return [samples[min(len(samples) - 1, int(len(samples) * p / 100))] for p in points]
+
+
+class MicroBatcher:
+    """
+    Coalesce single-face requests for one task into batches
+
+    A worker takes the first pending request, then keeps collecting until the
+    batch is full or `max_latency_ms` has passed since that first request,
+    and runs the batch on its own interpreter.
+    """
+
+    def __init__(self, task, model_path, max_batch_size=16, max_latency_ms=5.0,
+                 num_workers=2, num_threads=None, max_threads=None, create_model=None):
+        """
+        Args:
+            task (str): 'age', 'gender', 'expression' (or 'embedding')
+            model_path (str): Path to the task's .tflite model
+            max_batch_size (int): Largest batch run in one invoke
+            max_latency_ms (float): How long to wait for a batch to fill
+            num_workers (int): Interpreters (and worker threads) in the pool
+            num_threads (int): Threads per interpreter (default: the host's
+                tuned setting for the model, capped at max_threads, else 1)
+            max_threads (int): Cap on the tuned thread count. The tuning
+                measures one interpreter alone, so interpreters sharing the
+                CPU get their share of the cores (default: CPUs / num_workers)
+            create_model: Callable(num_threads) returning a model with
+                preprocess / predict_preprocessed / decode (default: a
+                TFLiteModel for the task)
+        """
+        self.task = task
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.queue = queue.Queue()
+        self.batch_sizes = Counter()
+        self.latency = LatencyStats()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+        if num_threads is None:
+            from autotune import interpreter_settings
+
+            if max_threads is None:
+                max_threads = (os.cpu_count() or 1) // num_workers
+            num_threads = min(interpreter_settings(model_path).get('num_threads', 1), max(1, max_threads))
+        if create_model is None:
+            def create_model(num_threads):
+                return TFLiteModel(model_path, task, num_threads=num_threads)
+        self.models = [create_model(num_threads) for _ in range(num_workers)]
+        self.workers = [
+            threading.Thread(target=self._run, args=(model,), name=f'{task}-worker-{i}', daemon=True)
+            for i, model in enumerate(self.models)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, face):
+        """
+        Queue a raw face crop for inference
+
+        Returns:
+            Future resolving to {'label': ..., 'confidence': ...}
+        """
+        future = Future()
+        self.queue.put((self.models[0].preprocess(face), future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        """
+        Block for the first request, then gather more until the batch is
+        full or the latency window closes
+        """
+        try:
+            first = self.queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, model):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                probabilities = model.predict_preprocessed([item[0] for item in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            with self._lock:
+                self.batch_sizes[len(batch)] += 1
+            for (_, future, queued_at), row in zip(batch, probabilities):
+                self.latency.record((done - queued_at) * 1000)
+                future.set_result(model.decode(row))
+
+    def metrics(self):
+        p50, p99 = self.latency.percentiles(50, 99)
+        with self._lock:
+            batches = dict(self.batch_sizes)
+        total_batches = sum(batches.values())
+        return {
+            'requests': self.latency.count,
+            'queue_depth': self.queue.qsize(),
+            'p50_ms': p50,
+            'p99_ms': p99,
+            'batches': total_batches,
+            'mean_batch_size': (sum(k * v for k, v in batches.items()) / total_batches) if total_batches else None,
+            'batch_sizes': {str(k): v for k, v in sorted(batches.items())},
+        }
+
+    def stop(self):
+        self._stop.set()
+        for worker in self.workers:
+            worker.join()
+
+
+class BatchedEmbedder:
+    """
+    Embed faces through a MicroBatcher, so concurrent requests share invokes
+    """
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self.dims = batcher.models[0].dims
+
+    def embed(self, faces):
+        import numpy as np
+
+        futures = [self.batcher.submit(face) for face in faces]
+        return np.stack([future.result() for future in futures])
+
+
+class InferenceService:
+    """
+    Fan a face crop out to the age, gender and expression batchers
+    """
+
+    def __init__(self, models_dir='models', tasks=None, embedding_model=None, cache_options=None,
+                 **batcher_options):
+        """
+        Args:
+            models_dir (str): Directory of the converted task models
+            tasks (list): Tasks to serve (default: all)
+            embedding_model (str): Optional .tflite embedding model enabling
+                the face-embedding result cache for age and gender
+            cache_options (dict): create_face_cache arguments (threshold,
+                ttl_s, max_entries)
+            **batcher_options: MicroBatcher arguments
+        """
+        tasks = list(tasks or TASKS)
+        if batcher_options.get('num_threads') is None:
+            # Every interpreter of every batcher can be busy at once; split the cores between them
+            interpreters = batcher_options.get('num_workers', 2) * (len(tasks) + bool(embedding_model))
+            batcher_options['max_threads'] = max(1, (os.cpu_count() or 1) // interpreters)
+        self.batchers = {
+            task: MicroBatcher(task, default_model_path(models_dir, task), **batcher_options)
+            for task in tasks
+        }
+        self.latency = LatencyStats()
+        self.embedding_batcher = None
+        self.face_cache = None
+        if embedding_model:
+            self.embedding_batcher = MicroBatcher(
+                'embedding', embedding_model,
+                create_model=lambda num_threads: EmbeddingModel(embedding_model, num_threads=num_threads),
+                **batcher_options
+            )
+            self.face_cache = create_face_cache(embedding_model, embedder=BatchedEmbedder(self.embedding_batcher),
+                                                **(cache_options or {}))
+        # Tasks whose results are looked up by face embedding before inference
+        self.cached_tasks = [task for task in ('age', 'gender') if task in self.batchers] if self.face_cache else []
+
+    def _predict_cached(self, faces):
+        futures = [{task: self.batchers[task].submit(face) for task in self.cached_tasks} for face in faces]
+        return [{task: future.result() for task, future in tasks.items()} for tasks in futures]
+
+    def predict(self, face):
+        start = time.perf_counter()
+        futures = {task: batcher.submit(face) for task, batcher in self.batchers.items()
+                   if task not in self.cached_tasks}
+        result = {}
+        if self.cached_tasks:
+            result.update(self.face_cache.get([face], self._predict_cached)[0])
+        result.update({task: future.result() for task, future in futures.items()})
+        self.latency.record((time.perf_counter() - start) * 1000)
+        return result
+
+    def metrics(self):
+        p50, p99 = self.latency.percentiles(50, 99)
+        return {
+            'requests': self.latency.count,
+            'p50_ms': p50,
+            'p99_ms': p99,
+            'tasks': {task: batcher.metrics() for task, batcher in self.batchers.items()},
+            **({'embedding': self.embedding_batcher.metrics(),
+                'embedding_cache': self.face_cache.summary()} if self.face_cache else {}),
+        }
+
+    def stop(self):
+        for batcher in self.batchers.values():
+            batcher.stop()
+        if self.embedding_batcher is not None:
+            self.embedding_batcher.stop()
+
+
+def decode_image(body, content_type):
+    """
+    Decode a request body into an RGB uint8 array
+
+    Accepts raw image bytes or JSON with a base64-encoded image.
+    """
+    import numpy as np
+    from PIL import Image
+
+    if content_type.startswith('application/json'):
+        body = base64.b64decode(json.loads(body)['image'])
+    with Image.open(io.BytesIO(body)) as image:
+        return np.asarray(image.convert('RGB'))
+
+
+def make_handler(service):
+    from http.server import BaseHTTPRequestHandler
+
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send_json(200, service.metrics())
+            elif self.path == '/health':
+                self._send_json(200, {'status': 'ok'})
+            else:
+                self._send_json(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send_json(404, {'error': f'unknown path {self.path}'})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+            try:
+                face = decode_image(body, self.headers.get('Content-Type', ''))
+            except Exception as e:
+                self._send_json(400, {'error': f'could not decode image: {e}'})
+                return
+            try:
+                result = service.predict(face)
+            except Exception as e:
+                self._send_json(500, {'error': f'prediction failed: {type(e).__name__}: {e}'})
+                return
+            self._send_json(200, result)
+
+        def log_message(self, format, *args):
+            # Per-request access logs would dominate the load test's CPU time
+            pass
+
+    return InferenceHandler
+
+
+def serve(args):
+    from http.server import ThreadingHTTPServer
+
+    service = InferenceService(
+        args.models_dir,
+        tasks=args.tasks,
+        embedding_model=args.embedding_model,
+        cache_options=dict(threshold=args.cache_threshold, ttl_s=args.cache_ttl, max_entries=args.cache_size),
+        max_batch_size=args.max_batch_size,
+        max_latency_ms=args.max_latency_ms,
+        num_workers=args.workers,
+        num_threads=args.threads
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Serving {', '.join(service.batchers)} on http://{args.host}:{args.port} "
+          f"(batch <= {args.max_batch_size}, window {args.max_latency_ms} ms, {args.workers} interpreter(s)/task)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        print(json.dumps(service.metrics(), indent=2))
+
+
+def load_test(args):
+    """
+    Send concurrent /predict requests and report client-side latency
+    """
+    import urllib.request
+
+    with open(args.image, 'rb') as f:
+        body = f.read()
+    url = f'http://{args.host}:{args.port}/predict'
+    content_type = 'image/png' if args.image.lower().endswith('.png') else 'image/jpeg'
+
+    def send(_):
+        request = urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+        start = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return (time.perf_counter() - start) * 1000
+
+    stats = LatencyStats(window=args.requests)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for latency_ms in pool.map(send, range(args.requests)):
+            stats.record(latency_ms)
+    elapsed = time.perf_counter() - start
+
+    p50, p90, p99 = stats.percentiles(50, 90, 99)
+    print(f"{args.requests} requests, concurrency {args.concurrency}: "
+          f"{args.requests / elapsed:.1f} req/s, p50 {p50:.1f} ms, p90 {p90:.1f} ms, p99 {p99:.1f} ms")
+
+    with urllib.request.urlopen(f'http://{args.host}:{args.port}/metrics') as response:
+        print(json.dumps(json.loads(response.read()), indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local inference server with dynamic request batching')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                      help='address to bind / connect to (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8500,
+                      help='port to bind / connect to (default: 8500)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='run the inference server')
+    serve_parser.add_argument('--models-dir', type=str, default='models',
+                      help='directory containing <task>/<task>_model.tflite (default: models)')
+    serve_parser.add_argument('--tasks', nargs='+', choices=list(TASKS), default=None,
+                      help='tasks to serve (default: all)')
+    serve_parser.add_argument('--max-batch-size', type=int, default=16,
+                      help='largest micro-batch per invoke (default: 16)')
+    serve_parser.add_argument('--max-latency-ms', type=float, default=5.0,
+                      help='how long to wait for a micro-batch to fill (default: 5 ms)')
+    serve_parser.add_argument('--workers', type=int, default=2,
+                      help='interpreters per task (default: 2)')
+    serve_parser.add_argument('--threads', type=int, default=None,
+                      help='threads per interpreter (default: tuned host config capped at the CPUs '
+                           'divided by all interpreters, else 1)')
+    add_cache_arguments(serve_parser)
+
+    client_parser = subparsers.add_parser('load-test', help='load test a running server')
+    client_parser.add_argument('--image', type=str, required=True,
+                      help='face crop to send with every request')
+    client_parser.add_argument('--requests', type=int, default=1000,
+                      help='total requests (default: 1000)')
+    client_parser.add_argument('--concurrency', type=int, default=16,
+                      help='concurrent client connections (default: 16)')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args)
+    else:
+        load_test(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+Inference-Only Model Export
+
+Training writes HDF5 checkpoints that carry the optimizer state, and loading
+them with `load_model` deserializes the full Keras model and re-compiles it.
+This script exports a trained model in lighter formats:
+
+- a SavedModel with a single `serving_default` signature (batch-polymorphic
+  float32 `image` input, `probabilities` output), which
+  `TFLiteConverter.from_saved_model` converts without rebuilding Keras objects
+- a Keras v3 `.keras` archive of the uncompiled model
+
+Neither contains optimizer slots or training-only augmentation layers.
+
+With --fuse-preprocessing, a third export (`<task>_saved_model_raw`) takes
+raw uint8 RGB crops of any size and does the training pipeline's preprocessing in the graph:
+grayscale conversion (expression), resize to the task's input size with the
+same interpolation as `flow_from_directory`, and rescaling by 1/255. Clients
+then pass the crop straight to the interpreter without a float copy.
+
+The `compare` command reports file size, load time and TFLite conversion time for
+each format.
+
+Usage:
+    python model_export.py export --model-path models/age/age_model_best.h5
+    python model_export.py export --model-path models/expression/expression_model_best.h5 --fuse-preprocessing
+    python model_export.py compare --model-path models/age/age_model_best.h5
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+SIGNATURE_KEY = 'serving_default'
+
+# flow_from_directory / load_img default interpolation, used when fusing
+# preprocessing so exported models see the same pixels as in training
+TRAINING_INTERPOLATION = 'nearest'
+
+
+def inference_model(model):
+    """
+    Rebuild a model for inference: uncompiled (no optimizer) and without the
+    preprocessing layers added by augmentation.add_augmentation_layers
+    """
+    import tensorflow as tf
+
+    layer_names = [layer.name for layer in model.layers]
+    if 'augmentation' in layer_names:
+        # Input -> augmentation -> wrapped model; keep the wrapped model only
+        model = model.layers[-1]
+    return tf.keras.Model(inputs=model.inputs, outputs=model.outputs, name=model.name)
+
+
+def fused_preprocessing(image, input_shape, interpolation=TRAINING_INTERPOLATION):
+    """
+    Graph version of the training preprocessing for raw uint8 RGB crops
+
+    Args:
+        image: (batch, height, width, 3) uint8 tensor of any height/width
+        input_shape: The model's (size, size, channels) input shape
+
+    Returns:
+        tf.Tensor: float32 (batch, size, size, channels) in [0, 1]
+    """
+    import tensorflow as tf
+
+    size, channels = list(input_shape[:2]), input_shape[2]
+    x = tf.cast(image, tf.float32)
+    if channels == 1:
+        # load_img converts to grayscale before resizing
+        x = tf.image.rgb_to_grayscale(x)
+    x = tf.image.resize(x, size, method=interpolation)
+    return x * (1.0 / 255.0)
+
+
+def export_saved_model(model, export_dir, fuse_preprocessing=False):
+    """
+    Save an inference-only SavedModel with a batch-polymorphic signature
+
+    Args:
+        model: Trained Keras model
+        export_dir (str): Output directory (replaced if it exists)
+        fuse_preprocessing (bool): Accept raw uint8 RGB crops of any size and
+            resize, color-convert and rescale them inside the graph
+
+    Returns:
+        str: export_dir
+    """
+    import tensorflow as tf
+
+    model = inference_model(model)
+    input_shape = model.input_shape[1:]
+
+    if fuse_preprocessing:
+        input_spec = tf.TensorSpec([None, None, None, 3], tf.uint8, name='image')
+
+        @tf.function(input_signature=[input_spec])
+        def serve(image):
+            return {'probabilities': model(fused_preprocessing(image, input_shape), training=False)}
+    else:
+        input_spec = tf.TensorSpec([None, *input_shape], tf.float32, name='image')
+
+        @tf.function(input_signature=[input_spec])
+        def serve(image):
+            return {'probabilities': model(image, training=False)}
+
+    if os.path.isdir(export_dir):
+        shutil.rmtree(export_dir)
+    tf.saved_model.save(model, export_dir, signatures={SIGNATURE_KEY: serve})
+    return export_dir
+
+
+def export_keras(model, path):
+    """
+    Save the uncompiled inference model as a Keras v3 archive
+    """
+    inference_model(model).save(path)
+    return path
+
+
+def export_inference_model(model, output_dir, task, fuse_preprocessing=False):
+    """
+    Write `<task>_saved_model/` and `<task>_model.keras` into output_dir, plus
+    `<task>_saved_model_raw/` (uint8 crops in) with fuse_preprocessing
+
+    Returns:
+        dict: Paths of the exported artifacts by format
+    """
+    paths = {
+        'saved_model': export_saved_model(model, os.path.join(output_dir, f'{task}_saved_model')),
+        'keras': export_keras(model, os.path.join(output_dir, f'{task}_model.keras')),
+    }
+    if fuse_preprocessing:
+        paths['saved_model_raw'] = export_saved_model(
+            model, os.path.join(output_dir, f'{task}_saved_model_raw'), fuse_preprocessing=True
+        )
+    for name, path in paths.items():
+        print(f"Exported {name}: {path} ({artifact_size(path) / (1024 * 1024):.2f} MB)")
+    return paths
+
+
+def saved_model_input_spec(export_dir, sample_size=224):
+    """
+    Return a concrete input shape (batch size 1, dynamic height/width set to
+    sample_size) and the dtype of a SavedModel's serving signature
+    """
+    import tensorflow as tf
+
+    signature = tf.saved_model.load(export_dir).signatures[SIGNATURE_KEY]
+    spec = next(iter(signature.structured_input_signature[1].values()))
+    shape = [1] + [sample_size if d is None else d for d in spec.shape.as_list()[1:]]
+    return shape, spec.dtype
+
+
+def artifact_size(path):
+    """
+    Size in bytes of a model file or SavedModel directory
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(dirpath, name))
+               for dirpath, _, filenames in os.walk(path) for name in filenames)
+
+
+def _timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def compare_formats(model_path, work_dir=None):
+    """
+    Export a checkpoint to every format and measure size, load time and
+    TFLite conversion time
+
+    Returns:
+        list: One dict per format
+    """
+    import tensorflow as tf
+    from tensorflow.keras.models import load_model
+
+    work_dir = work_dir or tempfile.mkdtemp(prefix='model_export_')
+    model = load_model(model_path)
+    paths = {
+        'saved_model': export_saved_model(model, os.path.join(work_dir, 'saved_model')),
+        'keras': export_keras(model, os.path.join(work_dir, 'model.keras')),
+    }
+
+    loaders = {
+        'h5': lambda: load_model(model_path),
+        'h5 (compile=False)': lambda: load_model(model_path, compile=False),
+        'keras': lambda: load_model(paths['keras'], compile=False),
+        'saved_model': lambda: tf.saved_model.load(paths['saved_model']),
+    }
+    converters = {
+        'h5': lambda m: tf.lite.TFLiteConverter.from_keras_model(m),
+        'h5 (compile=False)': lambda m: tf.lite.TFLiteConverter.from_keras_model(m),
+        'keras': lambda m: tf.lite.TFLiteConverter.from_keras_model(m),
+        'saved_model': lambda m: tf.lite.TFLiteConverter.from_saved_model(
+            paths['saved_model'], signature_keys=[SIGNATURE_KEY]),
+    }
+
+    results = []
+    for name, loader in loaders.items():
+        loaded, load_ms = _timed(loader)
+        _, convert_ms = _timed(lambda: converters[name](loaded).convert())
+        path = model_path if name.startswith('h5') else paths[name]
+        results.append({
+            'format': name,
+            'size_mb': artifact_size(path) / (1024 * 1024),
+            'load_ms': load_ms,
+            'convert_ms': convert_ms,
+        })
+    return results
+
+
+def print_comparison(results):
+    print(f"{'Format':<20}{'Size MB':>9}{'Load ms':>10}{'Convert ms':>12}")
+    for row in results:
+        print(f"{row['format']:<20}{row['size_mb']:>9.2f}{row['load_ms']:>10.0f}{row['convert_ms']:>12.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export trained models as inference-only SavedModel / .keras')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='export a checkpoint for inference')
+    export_parser.add_argument('--model-path', type=str, required=True,
+                      help='path to the Keras checkpoint (.h5 or .keras)')
+    export_parser.add_argument('--output-dir', type=str, default=None,
+                      help='directory for the exported models (default: next to the checkpoint)')
+    export_parser.add_argument('--task', type=str, choices=['age', 'gender', 'expression'], required=True,
+                      help='task name used in the exported file names')
+    export_parser.add_argument('--fuse-preprocessing', action='store_true',
+                      help='also export <task>_saved_model_raw, which takes raw uint8 RGB crops of any size')
+
+    compare_parser = subparsers.add_parser('compare', help='compare size, load and conversion time per format')
+    compare_parser.add_argument('--model-path', type=str, required=True,
+                      help='path to the Keras checkpoint (.h5)')
+    compare_parser.add_argument('--work-dir', type=str, default=None,
+                      help='where to write the exported copies (default: a temporary directory)')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        from tensorflow.keras.models import load_model
+
+        output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.model_path))
+        os.makedirs(output_dir, exist_ok=True)
+        export_inference_model(load_model(args.model_path, compile=False), output_dir, args.task,
+                               fuse_preprocessing=args.fuse_preprocessing)
+    else:
+        print_comparison(compare_formats(args.model_path, args.work_dir))
+
+
+if __name__ == '__main__':
+    main()
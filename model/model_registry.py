@@ -0,0 +1,281 @@
+"""
+Local Model Artifact Registry
+
+This script keeps every trained and converted model in a content-addressed
+blob directory, indexed by a SQLite database:
+
+    <registry>/blobs/<hash[:2]>/<hash><ext>   one file per unique artifact
+    <registry>/registry.db                    artifacts and conversions tables
+
+Each artifact row records its task, kind (keras or tflite), the model it was
+derived from, and JSON training config, metrics and benchmark numbers.
+Conversions are keyed by (source hash, options hash), so
+`convert_model_to_tflite` can copy a previously built .tflite out of the
+registry instead of running the converter again for an identical model.
+
+Usage:
+    python model_registry.py list --task age
+    python model_registry.py show 3fa2c1
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+
+DEFAULT_REGISTRY_DIR = os.path.join('models', 'registry')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    hash TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    task TEXT,
+    name TEXT,
+    ext TEXT,
+    size INTEGER,
+    created REAL,
+    parent TEXT,
+    config TEXT DEFAULT '{}',
+    metrics TEXT DEFAULT '{}',
+    benchmarks TEXT DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS conversions (
+    source_hash TEXT NOT NULL,
+    options_hash TEXT NOT NULL,
+    options TEXT NOT NULL,
+    output_hash TEXT NOT NULL,
+    created REAL,
+    PRIMARY KEY (source_hash, options_hash)
+);
+CREATE INDEX IF NOT EXISTS artifacts_task ON artifacts (task, kind);
+"""
+
+JSON_FIELDS = ('config', 'metrics', 'benchmarks')
+
+
+def file_digest(path):
+    """
+    SHA-256 of a file's bytes
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tree_digest(root):
+    """
+    SHA-256 over the relative paths and contents of every file in a
+    directory (e.g. a SavedModel), independent of walk order
+    """
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            digest.update(os.path.relpath(path, root).replace(os.sep, '/').encode('utf-8'))
+            digest.update(file_digest(path).encode('ascii'))
+    return digest.hexdigest()
+
+
+def options_digest(options):
+    """
+    Stable hash of a JSON-compatible options dict
+    """
+    payload = json.dumps(options, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ModelRegistry:
+    """
+    SQLite index over a content-addressed directory of model files
+    """
+
+    def __init__(self, root=DEFAULT_REGISTRY_DIR):
+        self.root = root
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, 'registry.db'), timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def blob_path(self, artifact_hash, ext=None):
+        if ext is None:
+            ext = self.get(artifact_hash)['ext']
+        return os.path.join(self.root, 'blobs', artifact_hash[:2], f'{artifact_hash}{ext}')
+
+    def _row(self, row):
+        if row is None:
+            return None
+        artifact = dict(row)
+        for field in JSON_FIELDS:
+            artifact[field] = json.loads(artifact[field] or '{}')
+        return artifact
+
+    def get(self, artifact_hash):
+        """
+        Look up an artifact by its full hash or a unique prefix
+
+        Returns:
+            dict or None: The artifact row with JSON fields decoded
+        """
+        rows = self.db.execute('SELECT * FROM artifacts WHERE hash LIKE ?', (artifact_hash + '%',)).fetchall()
+        if len(rows) > 1:
+            raise ValueError(f"Hash prefix {artifact_hash} matches {len(rows)} artifacts")
+        return self._row(rows[0]) if rows else None
+
+    def add(self, path, kind, task=None, parent=None, config=None, metrics=None, benchmarks=None):
+        """
+        Copy a model file into the blob directory and record it
+
+        Adding a file that is already registered only merges the given
+        config, metrics and benchmarks into its row.
+
+        Returns:
+            str: The artifact's content hash
+        """
+        artifact_hash = file_digest(path)
+        ext = os.path.splitext(path)[1]
+        blob = self.blob_path(artifact_hash, ext)
+
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            tmp_path = f'{blob}.tmp{os.getpid()}'
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, blob)
+
+        with self.db:
+            self.db.execute(
+                'INSERT OR IGNORE INTO artifacts (hash, kind, task, name, ext, size, created, parent) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (artifact_hash, kind, task, os.path.basename(path), ext, os.path.getsize(path), time.time(), parent)
+            )
+        self.update(artifact_hash, config=config, metrics=metrics, benchmarks=benchmarks)
+        return artifact_hash
+
+    def update(self, artifact_hash, config=None, metrics=None, benchmarks=None):
+        """
+        Merge JSON fields into an existing artifact row
+        """
+        artifact = self.get(artifact_hash)
+        if artifact is None:
+            raise KeyError(f"No artifact {artifact_hash} in {self.root}")
+        changes = {'config': config, 'metrics': metrics, 'benchmarks': benchmarks}
+        with self.db:
+            for field, values in changes.items():
+                if values:
+                    merged = dict(artifact[field], **values)
+                    self.db.execute(f'UPDATE artifacts SET {field} = ? WHERE hash = ?',
+                                    (json.dumps(merged, sort_keys=True), artifact['hash']))
+
+    def find_conversion(self, source_hash, options):
+        """
+        Return the output hash of an earlier conversion with the same source
+        and options, or None if there is none (or its blob is missing)
+        """
+        row = self.db.execute(
+            'SELECT output_hash FROM conversions WHERE source_hash = ? AND options_hash = ?',
+            (source_hash, options_digest(options))
+        ).fetchone()
+        if row is None or self.get(row['output_hash']) is None:
+            return None
+        if not os.path.exists(self.blob_path(row['output_hash'])):
+            return None
+        return row['output_hash']
+
+    def record_conversion(self, source_hash, options, output_hash):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO conversions (source_hash, options_hash, options, output_hash, created) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (source_hash, options_digest(options), json.dumps(options, sort_keys=True), output_hash, time.time())
+            )
+
+    def export(self, artifact_hash, output_path):
+        """
+        Copy an artifact out of the registry to output_path
+        """
+        tmp_path = f'{output_path}.tmp{os.getpid()}'
+        shutil.copyfile(self.blob_path(artifact_hash), tmp_path)
+        os.replace(tmp_path, output_path)
+        return output_path
+
+    def list(self, task=None, kind=None):
+        """
+        Return artifact rows, newest first, optionally filtered
+        """
+        query = 'SELECT * FROM artifacts WHERE 1 = 1'
+        params = []
+        if task:
+            query += ' AND task = ?'
+            params.append(task)
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        query += ' ORDER BY created DESC'
+        return [self._row(row) for row in self.db.execute(query, params)]
+
+
+def open_registry(root):
+    """
+    Open the registry at root, or return None when root is empty/None
+    (used by scripts whose --registry option can be disabled)
+    """
+    return ModelRegistry(root) if root else None
+
+
+def print_artifacts(artifacts):
+    print(f"{'Hash':<14}{'Task':<12}{'Kind':<8}{'Size MB':>9}  {'Created':<17}{'Name'}")
+    for artifact in artifacts:
+        created = time.strftime('%Y-%m-%d %H:%M', time.localtime(artifact['created']))
+        print(f"{artifact['hash'][:12]:<14}{artifact['task'] or '-':<12}{artifact['kind']:<8}"
+              f"{artifact['size'] / (1024 * 1024):>9.2f}  {created:<17}{artifact['name']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect the local model artifact registry')
+    parser.add_argument('--registry', type=str, default=DEFAULT_REGISTRY_DIR,
+                      help=f'registry directory (default: {DEFAULT_REGISTRY_DIR})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list', help='list registered artifacts')
+    list_parser.add_argument('--task', type=str, choices=['age', 'gender', 'expression'], default=None,
+                      help='only show artifacts for this task')
+    list_parser.add_argument('--kind', type=str, choices=['keras', 'tflite'], default=None,
+                      help='only show artifacts of this kind')
+
+    show_parser = subparsers.add_parser('show', help='show one artifact with its config, metrics and benchmarks')
+    show_parser.add_argument('hash', type=str, help='artifact hash or unique prefix')
+    show_parser.add_argument('--export', type=str, default=None,
+                      help='also copy the artifact to this path')
+
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(args.registry)
+    if args.command == 'list':
+        print_artifacts(registry.list(task=args.task, kind=args.kind))
+        return
+
+    try:
+        artifact = registry.get(args.hash)
+    except ValueError as e:
+        parser.error(str(e))
+    if artifact is None:
+        parser.error(f"no artifact matching {args.hash}")
+    artifact['blob'] = registry.blob_path(artifact['hash'])
+    artifact['derived'] = [row['output_hash'] for row in registry.db.execute(
+        'SELECT output_hash FROM conversions WHERE source_hash = ?', (artifact['hash'],))]
+    print(json.dumps(artifact, indent=2))
+    if args.export:
+        registry.export(artifact['hash'], args.export)
+        print(f"Exported to {args.export}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""
+Latency-Constrained Model Selection
+
+`ModelCheckpoint` keeps the epoch with the best val_accuracy, whatever the
+model costs to run. This script takes a set of candidate Keras models
+(hyperparameter search trials, registered checkpoints, or explicit paths),
+converts each to TFLite, measures its invoke latency on this CPU, and picks
+the most accurate candidate that fits a latency and/or size budget.
+
+The chosen model is written to `models/<task>/<task>_model_selected.<ext>`
+(ready for `convert_to_tflite.py`) together with its converted
+`<task>_model_selected.tflite` and a `<task>_selection.json` report.
+
+Accuracy comes from the candidates' recorded validation metrics, or from
+re-evaluating every candidate on the same validation split with --data-dir.
+
+Usage:
+    python model_selection.py --task age --search-dir models/search --latency-budget-ms 15
+    python model_selection.py --task age --registry models/registry --latency-budget-ms 15 --size-budget-mb 4
+"""
+
+import os
+import json
+import shutil
+import argparse
+
+LATENCY_METRICS = ('mean', 'p50', 'p90')
+
+
+def search_candidates(search_dir, task):
+    """
+    Candidates from hparam_search.py trials (the model saved after each
+    trial's last epoch, with that epoch's val_accuracy)
+    """
+    task_dir = os.path.join(search_dir, task)
+    candidates = []
+    if not os.path.isdir(task_dir):
+        return candidates
+    for name in sorted(os.listdir(task_dir)):
+        model_path = os.path.join(task_dir, name, 'model.keras')
+        state_path = os.path.join(task_dir, name, 'state.json')
+        if not (os.path.exists(model_path) and os.path.exists(state_path)):
+            continue
+        with open(state_path) as f:
+            history = json.load(f)['history']
+        if history['val_accuracy']:
+            candidates.append({'name': name, 'path': model_path, 'val_accuracy': history['val_accuracy'][-1]})
+    return candidates
+
+
+def registry_candidates(registry, task):
+    """
+    Candidates from Keras checkpoints recorded in the model registry
+    """
+    candidates = []
+    for artifact in registry.list(task=task, kind='keras'):
+        if 'val_accuracy' in artifact['metrics']:
+            candidates.append({
+                'name': artifact['hash'][:12],
+                'path': registry.blob_path(artifact['hash']),
+                'val_accuracy': artifact['metrics']['val_accuracy'],
+            })
+    return candidates
+
+
+def evaluate_candidates(candidates, task, data_dir=None, face_index=None):
+    """
+    Replace recorded accuracies with val_accuracy on the same validation split
+
+    Candidates may differ in input size (e.g. 96 px `--variant fast`
+    checkpoints), so the split is read at each model's own size, with one
+    generator per size.
+    """
+    from tensorflow.keras.models import load_model
+    from train_model import create_data_generators
+
+    generators = {}
+    for candidate in candidates:
+        model = load_model(candidate['path'], compile=False)
+        model.compile(loss='categorical_crossentropy', metrics=['accuracy'])
+        size = model.input_shape[1]
+        if size not in generators:
+            _, generators[size] = create_data_generators(data_dir, task, face_index=face_index, img_size=size)
+        _, candidate['val_accuracy'] = model.evaluate(generators[size], verbose=0)
+    return candidates
+
+
+def benchmark_candidates(candidates, work_dir, task=None, quantize=False, runs=50, threads=1, registry=None):
+    """
+    Convert each candidate to TFLite and measure its size and invoke latency
+
+    Conversions go through the registry when one is given, so candidates
+    converted in an earlier selection run are not converted again.
+    """
+    from convert_to_tflite import convert_model_to_tflite
+    from tflite_profiler import measure_invoke
+
+    os.makedirs(work_dir, exist_ok=True)
+    for candidate in candidates:
+        tflite_path = os.path.join(work_dir, f"{candidate['name']}.tflite")
+        convert_model_to_tflite(candidate['path'], tflite_path, quantize=quantize, registry=registry, task=task)
+        latency = measure_invoke(tflite_path, runs=runs, num_threads=threads)
+        candidate.update(
+            tflite_path=tflite_path,
+            size_mb=os.path.getsize(tflite_path) / (1024 * 1024),
+            latency=latency
+        )
+        if registry is not None:
+            registry.add(tflite_path, 'tflite', task=task, benchmarks={f'invoke_threads{threads}': latency})
+    return candidates
+
+
+def select_candidate(candidates, latency_budget_ms=None, size_budget_mb=None, latency_metric='p90'):
+    """
+    Mark each candidate as within or over budget and return the most accurate
+    one within budget (None if no candidate fits)
+    """
+    for candidate in candidates:
+        latency_ms = candidate['latency'][f'{latency_metric}_ms']
+        candidate['within_budget'] = (
+            (latency_budget_ms is None or latency_ms <= latency_budget_ms)
+            and (size_budget_mb is None or candidate['size_mb'] <= size_budget_mb)
+        )
+    eligible = [c for c in candidates if c['within_budget']]
+    # Break accuracy ties in favour of the faster model
+    return max(eligible, key=lambda c: (c['val_accuracy'], -c['latency'][f'{latency_metric}_ms']), default=None)
+
+
+def print_candidates(candidates, choice, latency_metric='p90'):
+    print(f"\n{'Candidate':<16}{'val_acc':>8}{latency_metric + ' ms':>10}{'Size MB':>9}  Status")
+    for candidate in sorted(candidates, key=lambda c: -c['val_accuracy']):
+        status = 'selected' if candidate is choice else ('ok' if candidate['within_budget'] else 'over budget')
+        print(f"{candidate['name']:<16}{candidate['val_accuracy']:>8.4f}"
+              f"{candidate['latency'][f'{latency_metric}_ms']:>10.2f}{candidate['size_mb']:>9.2f}  {status}")
+
+
+def write_selection(choice, task, output_dir, budget):
+    """
+    Copy the selected Keras model and its TFLite conversion next to the
+    task's checkpoints and record why it was chosen
+
+    Returns:
+        str: Path of the selected Keras model
+    """
+    task_dir = os.path.join(output_dir, task)
+    os.makedirs(task_dir, exist_ok=True)
+    ext = os.path.splitext(choice['path'])[1]
+    model_path = os.path.join(task_dir, f'{task}_model_selected{ext}')
+    shutil.copyfile(choice['path'], model_path)
+    shutil.copyfile(choice['tflite_path'], os.path.join(task_dir, f'{task}_model_selected.tflite'))
+
+    with open(os.path.join(task_dir, f'{task}_selection.json'), 'w') as f:
+        json.dump({'budget': budget, 'source': choice['path'], **{
+            key: choice[key] for key in ('name', 'val_accuracy', 'size_mb', 'latency')
+        }}, f, indent=2)
+    return model_path
+
+
+def run_selection(candidates, task, latency_budget_ms=None, size_budget_mb=None, latency_metric='p90',
+                  output_dir='models', quantize=False, runs=50, threads=1, registry=None):
+    """
+    Benchmark candidates, pick the best within budget and write it out
+
+    Returns:
+        dict or None: The selected candidate
+    """
+    work_dir = os.path.join(output_dir, task, 'selection')
+    benchmark_candidates(candidates, work_dir, task=task, quantize=quantize, runs=runs,
+                         threads=threads, registry=registry)
+    choice = select_candidate(candidates, latency_budget_ms, size_budget_mb, latency_metric)
+    print_candidates(candidates, choice, latency_metric)
+
+    if choice is None:
+        print(f"\nNo candidate meets the budget ({latency_metric} <= {latency_budget_ms} ms, "
+              f"size <= {size_budget_mb} MB)")
+        return None
+
+    budget = {'latency_ms': latency_budget_ms, 'latency_metric': latency_metric, 'size_mb': size_budget_mb,
+              'threads': threads, 'quantize': quantize}
+    model_path = write_selection(choice, task, output_dir, budget)
+    print(f"\nSelected {choice['name']} (val_acc {choice['val_accuracy']:.4f}, "
+          f"{latency_metric} {choice['latency'][f'{latency_metric}_ms']:.2f} ms) -> {model_path}")
+    print(f"Convert it with: python convert_to_tflite.py --model-path {model_path} "
+          f"--output-path {os.path.join(output_dir, task, f'{task}_model.tflite')}"
+          f"{' --quantize' if quantize else ''}")
+    return choice
+
+
+def add_budget_arguments(parser):
+    """
+    Budget and benchmark options shared with hparam_search.py
+    """
+    parser.add_argument('--latency-budget-ms', type=float, default=None,
+                      help='maximum TFLite invoke latency on this CPU')
+    parser.add_argument('--size-budget-mb', type=float, default=None,
+                      help='maximum .tflite file size')
+    parser.add_argument('--latency-metric', type=str, choices=LATENCY_METRICS, default='p90',
+                      help='latency statistic compared to the budget (default: p90)')
+    parser.add_argument('--benchmark-threads', type=int, default=1,
+                      help='interpreter threads while benchmarking, as on the target (default: 1)')
+    parser.add_argument('--benchmark-runs', type=int, default=50,
+                      help='timed invocations per candidate (default: 50)')
+    parser.add_argument('--quantize', action='store_true',
+                      help='benchmark (and ship) quantized conversions')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pick the most accurate model within a latency/size budget')
+    parser.add_argument('--task', type=str, choices=['age', 'gender', 'expression'], required=True,
+                      help='task to select a model for')
+    parser.add_argument('--search-dir', type=str, default=None,
+                      help='use hparam_search.py trials under this directory as candidates')
+    parser.add_argument('--registry', type=str, default=None,
+                      help='use registered Keras checkpoints as candidates (and cache conversions)')
+    parser.add_argument('--model', type=str, action='append', default=[],
+                      help='additional candidate model path (repeatable; needs --data-dir or --face-index)')
+    parser.add_argument('--data-dir', type=str, default=None,
+                      help='re-evaluate every candidate on this dataset\'s validation split')
+    parser.add_argument('--face-index', type=str, default=None,
+                      help='re-evaluate every candidate on this face store\'s validation split')
+    parser.add_argument('--output-dir', type=str, default='models',
+                      help='where models/<task>/<task>_model_selected.* is written (default: models)')
+    add_budget_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    if args.latency_budget_ms is None and args.size_budget_mb is None:
+        parser.error('set --latency-budget-ms and/or --size-budget-mb')
+    evaluate = bool(args.data_dir or args.face_index)
+    if args.model and not evaluate:
+        parser.error('--model candidates have no recorded accuracy; add --data-dir or --face-index')
+
+    registry = None
+    candidates = []
+    if args.search_dir:
+        candidates += search_candidates(args.search_dir, args.task)
+    if args.registry:
+        from model_registry import ModelRegistry
+
+        registry = ModelRegistry(args.registry)
+        candidates += registry_candidates(registry, args.task)
+    candidates += [{'name': os.path.splitext(os.path.basename(path))[0], 'path': path, 'val_accuracy': None}
+                   for path in args.model]
+    if not candidates:
+        parser.error('no candidates found; pass --search-dir, --registry or --model')
+
+    if evaluate:
+        evaluate_candidates(candidates, args.task, data_dir=args.data_dir, face_index=args.face_index)
+
+    choice = run_selection(
+        candidates, args.task,
+        latency_budget_ms=args.latency_budget_ms,
+        size_budget_mb=args.size_budget_mb,
+        latency_metric=args.latency_metric,
+        output_dir=args.output_dir,
+        quantize=args.quantize,
+        runs=args.benchmark_runs,
+        threads=args.benchmark_threads,
+        registry=registry
+    )
+    if choice is None:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
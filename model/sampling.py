@@ -0,0 +1,159 @@
+"""
+Class-Balanced and Hard-Example Sampling
+
+`flow_from_directory` walks the dataset uniformly, so rare age bins and
+emotions are seen far less often than common ones. `BalancedSequence` wraps
+a Keras directory/dataframe iterator, keeps one index array per class and
+draws each epoch's batches so that classes are sampled equally (or with a
+tunable `balance_power` between natural and uniform frequencies).
+
+In hard-example mode, samples are additionally weighted within their class by
+their loss from the last scoring pass, stored as one float16 per sample. The
+`HardExampleMining` callback rescores a fraction of the training set with a
+forward pass at the end of each epoch.
+"""
+
+import numpy as np
+import tensorflow as tf
+
+
+class BalancedSequence(tf.keras.utils.Sequence):
+    """
+    Emit class-balanced batches from a Keras DirectoryIterator or
+    DataFrameIterator
+    """
+
+    def __init__(self, iterator, hard_examples=False, balance_power=1.0, hardness_power=1.0, seed=None):
+        """
+        Args:
+            iterator: Keras iterator exposing `classes` and
+                `_get_batches_of_transformed_samples`
+            hard_examples (bool): Weight samples within a class by their loss
+            balance_power (float): 1.0 samples classes uniformly, 0.0 keeps
+                their natural frequency; values in between interpolate
+            hardness_power (float): Exponent applied to losses in hard mode
+            seed (int): Seed for reproducible schedules
+        """
+        super().__init__()
+        self.iterator = iterator
+        self.batch_size = iterator.batch_size
+        self.hard_examples = hard_examples
+        self.balance_power = balance_power
+        self.hardness_power = hardness_power
+        self.rng = np.random.default_rng(seed)
+
+        classes = np.asarray(iterator.classes)
+        self.num_classes = int(classes.max()) + 1 if len(classes) else 0
+        # Sample indices grouped by class: order[offsets[c]:offsets[c] + counts[c]]
+        self.order = np.argsort(classes, kind='stable')
+        self.counts = np.bincount(classes, minlength=self.num_classes)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+        # Unscored samples start with a high loss so they are drawn early
+        self.losses = np.full(len(classes), 10.0, dtype=np.float16)
+
+        frequency = self.counts / max(self.counts.sum(), 1)
+        weights = np.where(self.counts > 0, frequency ** (1.0 - balance_power), 0.0)
+        self.class_probabilities = weights / weights.sum()
+
+        self.schedule = self._draw_schedule()
+
+    def __len__(self):
+        return len(self.iterator)
+
+    def _draw_schedule(self):
+        """
+        Draw the sample indices for a whole epoch
+        """
+        total = len(self) * self.batch_size
+        classes = self.rng.choice(self.num_classes, size=total, p=self.class_probabilities)
+
+        if not self.hard_examples:
+            positions = (self.rng.random(total) * self.counts[classes]).astype(np.int64)
+            return self.order[self.offsets[classes] + positions]
+
+        schedule = np.empty(total, dtype=np.int64)
+        for c in np.unique(classes):
+            slots = np.flatnonzero(classes == c)
+            members = self.order[self.offsets[c]:self.offsets[c] + self.counts[c]]
+            weights = self.losses[members].astype(np.float32) ** self.hardness_power + 1e-3
+            cdf = np.cumsum(weights)
+            picks = np.searchsorted(cdf, self.rng.random(len(slots)) * cdf[-1])
+            schedule[slots] = members[np.minimum(picks, len(members) - 1)]
+        return schedule
+
+    def __getitem__(self, index):
+        index_array = self.schedule[index * self.batch_size:(index + 1) * self.batch_size]
+        return self.iterator._get_batches_of_transformed_samples(index_array)
+
+    def on_epoch_end(self):
+        self.schedule = self._draw_schedule()
+
+    def __getattr__(self, name):
+        # Expose iterator attributes such as class_indices and samples
+        if name == 'iterator':
+            raise AttributeError(name)
+        return getattr(self.iterator, name)
+
+    def refresh_losses(self, model, fraction=1.0, chunk_size=None):
+        """
+        Rescore a random fraction of the training samples with a forward pass
+        and store their categorical cross-entropy
+
+        Args:
+            model: Keras model being trained
+            fraction (float): Share of the samples to rescore
+            chunk_size (int): Samples per predict call (default: batch size)
+        """
+        n = len(self.losses)
+        count = max(1, int(n * fraction))
+        indices = self.rng.choice(n, size=count, replace=False) if count < n else np.arange(n)
+        chunk_size = chunk_size or self.batch_size
+
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            images, labels = self.iterator._get_batches_of_transformed_samples(chunk)
+            probabilities = np.asarray(model.predict_on_batch(images))
+            true_probabilities = probabilities[np.arange(len(chunk)), labels.argmax(axis=1)]
+            self.losses[chunk] = -np.log(np.clip(true_probabilities, 1e-7, 1.0))
+
+    def class_distribution(self):
+        """
+        Return the share of each class in the current epoch's schedule
+        """
+        classes = np.asarray(self.iterator.classes)[self.schedule]
+        return np.bincount(classes, minlength=self.num_classes) / len(classes)
+
+
+class HardExampleMining(tf.keras.callbacks.Callback):
+    """
+    Rescore training samples at the end of each epoch so the next epoch's
+    schedule favours high-loss examples
+    """
+
+    def __init__(self, sequence, fraction=0.25):
+        """
+        Args:
+            sequence: BalancedSequence (or a wrapper delegating to one)
+            fraction (float): Share of samples rescored per epoch
+        """
+        super().__init__()
+        self.sequence = sequence
+        self.fraction = fraction
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.sequence.refresh_losses(self.model, fraction=self.fraction)
+        losses = self.sequence.losses.astype(np.float32)
+        print(f"\nHard-example losses: mean {losses.mean():.3f}, p90 {np.percentile(losses, 90):.3f}")
+
+
+def describe_balance(sequence, class_indices):
+    """
+    Print natural vs sampled class frequencies
+    """
+    names = sorted(class_indices, key=class_indices.get)
+    natural = sequence.counts / max(sequence.counts.sum(), 1)
+    sampled = sequence.class_distribution()
+    print("Class sampling (natural -> balanced):")
+    for i, name in enumerate(names):
+        print(f"  {name:<12} {natural[i]:6.1%} -> {sampled[i]:6.1%}")
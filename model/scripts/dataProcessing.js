@@ -16,97 +16,182 @@ const EMOTION_IMG_SIZE = 48; // Smaller size for emotion model
 const BATCH_SIZE = 32;
 
 /**
- * Process images from a directory into tensors
+ * List the image files in a directory
  * @param {string} dataDir - Directory with images
- * @param {number} imgSize - Target image size
- * @param {boolean} grayscale - Whether to convert to grayscale
- * @param {Function} labelExtractor - Function to extract labels from filenames
- * @returns {Promise<{xs: tf.Tensor, ys: tf.Tensor}>} - Tensors for training
+ * @returns {Promise<string[]>} - Image file names
  */
-async function processImagesFromDir(dataDir, imgSize, grayscale = false, labelExtractor) {
-  // Get all image files
+async function listImageFiles(dataDir) {
   const files = await fs.readdir(dataDir);
-  const imageFiles = files.filter(file => {
+  return files.filter(file => {
     const ext = path.extname(file).toLowerCase();
     return ext === '.jpg' || ext === '.png' || ext === '.jpeg';
   });
+}
+
+/**
+ * Decode, resize and normalize one image into a Float32Array (or into
+ * `target` at `offset`, to avoid a per-image allocation)
+ * @param {string} filePath - Image path
+ * @param {number} imgSize - Target image size
+ * @param {boolean} grayscale - Whether to convert to grayscale
+ * @param {Float32Array} [target] - Buffer to write into
+ * @param {number} [offset] - Start index in target
+ * @returns {Promise<Float32Array>} - The buffer written to
+ */
+async function loadImagePixels(filePath, imgSize, grayscale, target = null, offset = 0) {
+  const image = await Jimp.read(filePath);
   
-  console.log(`Found ${imageFiles.length} image files`);
+  // Resize image
+  image.resize(imgSize, imgSize);
   
-  if (imageFiles.length === 0) {
-    throw new Error('No image files found in the specified directory');
+  // Convert to grayscale if needed
+  if (grayscale) {
+    image.grayscale();
   }
   
-  // Process in batches to avoid memory issues
-  const batchSize = 100;
-  const numBatches = Math.ceil(imageFiles.length / batchSize);
-  
-  let allImages = [];
-  let allLabels = [];
+  // Convert to pixel buffer
+  const channels = grayscale ? 1 : 3;
+  const buffer = target || new Float32Array(imgSize * imgSize * channels);
   
-  for (let batchIdx = 0; batchIdx < numBatches; batchIdx++) {
-    const startIdx = batchIdx * batchSize;
-    const endIdx = Math.min(startIdx + batchSize, imageFiles.length);
-    const batchFiles = imageFiles.slice(startIdx, endIdx);
+  let idx = target ? offset : 0;
+  image.scan(0, 0, image.bitmap.width, image.bitmap.height, function(x, y, idx2) {
+    const r = this.bitmap.data[idx2 + 0] / 255.0;
     
-    console.log(`Processing batch ${batchIdx + 1}/${numBatches} (${batchFiles.length} images)`);
+    if (grayscale) {
+      buffer[idx++] = r;
+    } else {
+      const g = this.bitmap.data[idx2 + 1] / 255.0;
+      const b = this.bitmap.data[idx2 + 2] / 255.0;
+      buffer[idx++] = r;
+      buffer[idx++] = g;
+      buffer[idx++] = b;
+    }
+  });
+  
+  return buffer;
+}
+
+/**
+ * Stream images from a directory as fixed-size batches of tensors
+ * 
+ * Only one batch is decoded at a time, so memory stays constant regardless
+ * of how many images the directory holds. The caller owns the yielded
+ * tensors and must dispose them.
+ * @param {string} dataDir - Directory with images
+ * @param {number} imgSize - Target image size
+ * @param {boolean} grayscale - Whether to convert to grayscale
+ * @param {Function} labelExtractor - Function to extract labels from filenames
+ * @param {number} batchSize - Images per batch
+ * @yields {{xs: tf.Tensor, ys: tf.Tensor}} - One batch
+ */
+async function* streamImageBatches(dataDir, imgSize, grayscale = false, labelExtractor, batchSize = BATCH_SIZE) {
+  const imageFiles = await listImageFiles(dataDir);
+  const channels = grayscale ? 1 : 3;
+  const pixelsPerImage = imgSize * imgSize * channels;
+  
+  for (let startIdx = 0; startIdx < imageFiles.length; startIdx += batchSize) {
+    const batchFiles = imageFiles.slice(startIdx, startIdx + batchSize);
+    const pixels = new Float32Array(batchFiles.length * pixelsPerImage);
+    const labels = [];
     
-    // Process images in this batch
-    const batchPromises = batchFiles.map(async (file) => {
+    const loaded = await Promise.all(batchFiles.map(async (file, i) => {
       try {
-        const filePath = path.join(dataDir, file);
-        const image = await Jimp.read(filePath);
-        
-        // Resize image
-        image.resize(imgSize, imgSize);
-        
-        // Convert to grayscale if needed
-        if (grayscale) {
-          image.grayscale();
-        }
-        
-        // Convert to pixel buffer
-        const channels = grayscale ? 1 : 3;
-        const buffer = new Float32Array(imgSize * imgSize * channels);
-        
-        let idx = 0;
-        image.scan(0, 0, image.bitmap.width, image.bitmap.height, function(x, y, idx2) {
-          const r = this.bitmap.data[idx2 + 0] / 255.0;
-          
-          if (grayscale) {
-            buffer[idx++] = r;
-          } else {
-            const g = this.bitmap.data[idx2 + 1] / 255.0;
-            const b = this.bitmap.data[idx2 + 2] / 255.0;
-            buffer[idx++] = r;
-            buffer[idx++] = g;
-            buffer[idx++] = b;
-          }
-        });
-        
-        // Extract label from filename
-        const label = labelExtractor(file);
-        
-        return { image: buffer, label };
+        await loadImagePixels(path.join(dataDir, file), imgSize, grayscale, pixels, i * pixelsPerImage);
+        return true;
       } catch (error) {
         console.error(`Error processing image ${file}:`, error);
-        return null;
+        return false;
       }
+    }));
+    
+    // Compact the buffer if any image failed to load
+    let valid = 0;
+    loaded.forEach((ok, i) => {
+      if (!ok) return;
+      if (valid !== i) {
+        pixels.copyWithin(valid * pixelsPerImage, i * pixelsPerImage, (i + 1) * pixelsPerImage);
+      }
+      labels.push(labelExtractor(batchFiles[i]));
+      valid++;
     });
     
-    const batchResults = await Promise.all(batchPromises);
-    const validResults = batchResults.filter(result => result !== null);
+    if (valid === 0) continue;
     
-    // Add to accumulated data
-    allImages = allImages.concat(validResults.map(result => result.image));
-    allLabels = allLabels.concat(validResults.map(result => result.label));
+    yield {
+      xs: tf.tensor4d(pixels.subarray(0, valid * pixelsPerImage), [valid, imgSize, imgSize, channels]),
+      ys: tf.tensor2d(labels, [valid, labels[0].length])
+    };
   }
+}
+
+/**
+ * Evaluate a model over a directory without loading it into memory
+ * 
+ * Batches are streamed from disk and only running counts are kept.
+ * @param {tf.LayersModel} model - Model to evaluate
+ * @param {string} dataDir - Directory with images
+ * @param {number} imgSize - Target image size
+ * @param {boolean} grayscale - Whether to convert to grayscale
+ * @param {Function} labelExtractor - Function to extract labels from filenames
+ * @param {number} batchSize - Images per batch
+ * @returns {Promise<{accuracy: number, count: number}>} - Evaluation results
+ */
+async function evaluateModelStreaming(model, dataDir, imgSize, grayscale, labelExtractor, batchSize = BATCH_SIZE) {
+  let correct = 0;
+  let count = 0;
   
-  // Create tensors
+  for await (const { xs, ys } of streamImageBatches(dataDir, imgSize, grayscale, labelExtractor, batchSize)) {
+    const matches = tf.tidy(() => model.predict(xs).argMax(-1).equal(ys.argMax(-1)).sum());
+    correct += (await matches.data())[0];
+    count += xs.shape[0];
+    tf.dispose([xs, ys, matches]);
+  }
+  
+  return { accuracy: count ? correct / count : 0, count };
+}
+
+/**
+ * Process images from a directory into tensors
+ * 
+ * This materializes the whole directory; use streamImageBatches or
+ * evaluateModelStreaming for datasets that do not fit in memory.
+ * @param {string} dataDir - Directory with images
+ * @param {number} imgSize - Target image size
+ * @param {boolean} grayscale - Whether to convert to grayscale
+ * @param {Function} labelExtractor - Function to extract labels from filenames
+ * @returns {Promise<{xs: tf.Tensor, ys: tf.Tensor}>} - Tensors for training
+ */
+async function processImagesFromDir(dataDir, imgSize, grayscale = false, labelExtractor) {
+  // Get all image files
+  const imageFiles = await listImageFiles(dataDir);
+  
+  console.log(`Found ${imageFiles.length} image files`);
+  
+  if (imageFiles.length === 0) {
+    throw new Error('No image files found in the specified directory');
+  }
+  
+  // Decode batch by batch straight into one preallocated buffer instead of
+  // concatenating per-image arrays
   const channels = grayscale ? 1 : 3;
+  const pixelsPerImage = imgSize * imgSize * channels;
+  const pixels = new Float32Array(imageFiles.length * pixelsPerImage);
+  const allLabels = [];
+  let numImages = 0;
+  
+  const batchSize = 100;
+  for await (const { xs, ys } of streamImageBatches(dataDir, imgSize, grayscale, labelExtractor, batchSize)) {
+    console.log(`Processed ${numImages + xs.shape[0]}/${imageFiles.length} images`);
+    pixels.set(await xs.data(), numImages * pixelsPerImage);
+    allLabels.push(...(await ys.array()));
+    numImages += xs.shape[0];
+    tf.dispose([xs, ys]);
+  }
+  
+  // Create tensors
   const xs = tf.tensor4d(
-    allImages, 
-    [allImages.length, imgSize, imgSize, channels]
+    pixels.subarray(0, numImages * pixelsPerImage),
+    [numImages, imgSize, imgSize, channels]
   );
   
   const ys = tf.tensor2d(
@@ -292,6 +377,8 @@ module.exports = {
   EMOTION_IMG_SIZE,
   BATCH_SIZE,
   processImagesFromDir,
+  streamImageBatches,
+  evaluateModelStreaming,
   splitTrainValidation,
   createDataGenerator,
   extractAgeLabel,
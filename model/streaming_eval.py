@@ -0,0 +1,407 @@
+"""
+Memory-Bounded Streaming Evaluation
+
+`evaluate_tflite_model` takes the whole test set as in-memory arrays. This
+script evaluates a converted model over a dataset of any size with a fixed
+memory ceiling:
+
+- images are read lazily from a class-per-directory dataset, or from a
+  memory-mapped uint8 cache built once with the `cache` command, in chunks of
+  `--chunk-size` images written into one reused input buffer
+- only running counters are kept: a confusion matrix and the summed log loss,
+  from which accuracy, per-class precision/recall/F1 and mean loss are derived
+
+Peak memory therefore depends on the chunk size and input shape, not on the
+number of images.
+
+The `tta` command evaluates the same data under several test-time
+augmentation policies (tflite_inference.TTA_POLICIES; all variants of a batch
+run in one invoke) and reports each policy's accuracy gain and extra latency
+per image over the plain model.
+
+Usage:
+    python streaming_eval.py cache --data-dir model/data/test/age --task age --output eval_cache/age
+    python streaming_eval.py evaluate --model models/age/age_model.tflite --task age --cache eval_cache/age
+    python streaming_eval.py evaluate --model models/age/age_model.tflite --task age --data-dir model/data/test/age
+    python streaming_eval.py tta --model models/age/age_model.tflite --task age --cache eval_cache/age \\
+        --policies none flip crops
+"""
+
+import os
+import json
+import time
+import argparse
+
+from face_store import iter_images
+from tflite_inference import TASKS, TTA_POLICIES
+
+
+def class_names(data_dir):
+    """
+    Class sub-directories in `flow_from_directory` order (sorted), which is
+    the order of the model's outputs
+    """
+    return sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
+
+
+def peak_memory_mb():
+    """
+    Peak resident set size of this process in MB
+    """
+    import resource
+
+    # ru_maxrss is reported in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 if peak < 1 << 32 else peak / (1024 * 1024)
+
+
+class RunningMetrics:
+    """
+    Classification metrics accumulated chunk by chunk in O(classes^2) memory
+    """
+
+    def __init__(self, labels):
+        import numpy as np
+
+        self.labels = list(labels)
+        self.confusion = np.zeros((len(self.labels), len(self.labels)), dtype=np.int64)
+        self.log_loss_sum = 0.0
+        self.count = 0
+
+    def update(self, probabilities, targets):
+        """
+        Args:
+            probabilities (np.array): (n, classes) model outputs
+            targets (np.array): (n,) integer class indices
+        """
+        import numpy as np
+
+        predictions = probabilities.argmax(axis=1)
+        np.add.at(self.confusion, (targets, predictions), 1)
+        true_probabilities = probabilities[np.arange(len(targets)), targets]
+        self.log_loss_sum += float(-np.log(np.clip(true_probabilities, 1e-7, 1.0)).sum())
+        self.count += len(targets)
+
+    def summary(self):
+        import numpy as np
+
+        true_positives = np.diag(self.confusion).astype(np.float64)
+        predicted = self.confusion.sum(axis=0)
+        actual = self.confusion.sum(axis=1)
+        precision = np.divide(true_positives, predicted, out=np.zeros_like(true_positives), where=predicted > 0)
+        recall = np.divide(true_positives, actual, out=np.zeros_like(true_positives), where=actual > 0)
+        f1 = np.divide(2 * precision * recall, precision + recall,
+                       out=np.zeros_like(true_positives), where=(precision + recall) > 0)
+        return {
+            'images': self.count,
+            'accuracy': float(true_positives.sum() / self.count) if self.count else 0.0,
+            'log_loss': self.log_loss_sum / self.count if self.count else 0.0,
+            'per_class': {
+                label: {'precision': float(p), 'recall': float(r), 'f1': float(f), 'support': int(n)}
+                for label, p, r, f, n in zip(self.labels, precision, recall, f1, actual)
+            },
+            'confusion_matrix': self.confusion.tolist(),
+        }
+
+
+def load_crop(path, task, size=None):
+    """
+    Read an image the way flow_from_directory does: convert to the task's
+    color mode and resize with nearest interpolation
+
+    Args:
+        size (int): Output size (default: the task's full-model input size)
+
+    Returns:
+        np.array: uint8 (size, size, channels)
+    """
+    import numpy as np
+    from PIL import Image
+
+    _, task_size, color_mode = TASKS[task]
+    size = size or task_size
+    with Image.open(path) as image:
+        image = image.convert('L' if color_mode == 'grayscale' else 'RGB')
+        if image.size != (size, size):
+            image = image.resize((size, size), Image.NEAREST)
+        array = np.asarray(image, dtype=np.uint8)
+    return array[..., np.newaxis] if color_mode == 'grayscale' else array
+
+
+def input_shape(task, size=None):
+    _, task_size, color_mode = TASKS[task]
+    size = size or task_size
+    return (size, size, 1 if color_mode == 'grayscale' else 3)
+
+
+def iter_directory_chunks(data_dir, task, chunk_size=256, size=None):
+    """
+    Yield (uint8 images, class indices) chunks read lazily from disk, resized
+    to `size` (default: the task's input size; pass the model's own size for
+    reduced-resolution models)
+
+    The same two buffers are refilled for every chunk; consumers must finish
+    with a chunk before requesting the next.
+    """
+    import numpy as np
+
+    classes = {name: i for i, name in enumerate(class_names(data_dir))}
+    images = np.empty((chunk_size, *input_shape(task, size)), dtype=np.uint8)
+    targets = np.empty(chunk_size, dtype=np.int64)
+    filled = 0
+    for path, label in iter_images(data_dir):
+        if label not in classes:
+            continue
+        images[filled] = load_crop(path, task, size)
+        targets[filled] = classes[label]
+        filled += 1
+        if filled == chunk_size:
+            yield images, targets
+            filled = 0
+    if filled:
+        yield images[:filled], targets[:filled]
+
+
+def build_cache(data_dir, task, output_dir, size=None):
+    """
+    Decode and resize every image once into a memory-mapped uint8 array
+
+    Writes images.npy (N x size x size x channels uint8, opened as a memmap),
+    labels.npy and meta.json into output_dir. The image file is filled
+    through the memmap, so building it does not hold the dataset in memory.
+
+    Returns:
+        dict: The cache metadata
+    """
+    import numpy as np
+
+    classes = class_names(data_dir)
+    index = {name: i for i, name in enumerate(classes)}
+    samples = [(path, index[label]) for path, label in iter_images(data_dir) if label in index]
+    shape = (len(samples), *input_shape(task, size))
+
+    os.makedirs(output_dir, exist_ok=True)
+    images = np.lib.format.open_memmap(os.path.join(output_dir, 'images.npy'), mode='w+',
+                                       dtype=np.uint8, shape=shape)
+    labels = np.empty(len(samples), dtype=np.int16)
+    for i, (path, target) in enumerate(samples):
+        images[i] = load_crop(path, task, size)
+        labels[i] = target
+        if (i + 1) % 10000 == 0:
+            images.flush()
+            print(f"Cached {i + 1}/{len(samples)} images")
+    images.flush()
+    del images
+    np.save(os.path.join(output_dir, 'labels.npy'), labels)
+
+    meta = {'task': task, 'classes': classes, 'count': len(samples), 'shape': list(shape[1:])}
+    with open(os.path.join(output_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def iter_cache_chunks(cache_dir, chunk_size=256):
+    """
+    Yield (uint8 images, class indices) chunks from a memory-mapped cache;
+    only the pages of the current chunk need to be resident
+    """
+    import numpy as np
+
+    images = np.load(os.path.join(cache_dir, 'images.npy'), mmap_mode='r')
+    labels = np.load(os.path.join(cache_dir, 'labels.npy'), mmap_mode='r')
+    for start in range(0, len(images), chunk_size):
+        yield images[start:start + chunk_size], np.asarray(labels[start:start + chunk_size], dtype=np.int64)
+
+
+def evaluate_stream(model, chunks, labels, max_batch_size=64, tta_policy=None):
+    """
+    Run a TFLiteModel over uint8 chunks and accumulate metrics
+
+    Each chunk is rescaled into a single reused float32 buffer (or passed
+    through as uint8 for fused-preprocessing models) and invoked in batches
+    of at most max_batch_size. With tta_policy, each batch is invoked once
+    with all of its augmented variants (max_batch_size x variants inputs).
+
+    Returns:
+        dict: RunningMetrics summary plus throughput and peak memory
+    """
+    import numpy as np
+
+    metrics = RunningMetrics(labels)
+    buffer = None
+    invoke_seconds = 0.0
+    start = time.perf_counter()
+    for images, targets in chunks:
+        for offset in range(0, len(images), max_batch_size):
+            batch = images[offset:offset + max_batch_size]
+            if model.raw_input:
+                inputs = np.repeat(batch, 3, axis=-1) if batch.shape[-1] == 1 else batch
+            else:
+                if buffer is None or buffer.shape[0] < len(batch):
+                    buffer = np.empty((max_batch_size, *batch.shape[1:]), dtype=np.float32)
+                inputs = buffer[:len(batch)]
+                np.multiply(batch, 1.0 / 255.0, out=inputs, casting='unsafe')
+            invoke_start = time.perf_counter()
+            if tta_policy:
+                probabilities = model.predict_tta(inputs, tta_policy)
+            else:
+                probabilities = model.predict_batch(inputs)
+            invoke_seconds += time.perf_counter() - invoke_start
+            metrics.update(probabilities, targets[offset:offset + max_batch_size])
+
+    result = metrics.summary()
+    elapsed = time.perf_counter() - start
+    result['images_per_sec'] = metrics.count / elapsed if elapsed else 0.0
+    result['invoke_ms_per_image'] = 1000 * invoke_seconds / metrics.count if metrics.count else 0.0
+    result['peak_memory_mb'] = peak_memory_mb()
+    return result
+
+
+def compare_tta(model, make_chunks, labels, policies, max_batch_size=64):
+    """
+    Evaluate a model under each TTA policy
+
+    Args:
+        make_chunks: Callable returning a fresh chunk iterator per policy
+        policies (list): Keys of TTA_POLICIES; 'none' is added as the baseline
+
+    Returns:
+        list: One row per policy with accuracy, log loss, invoke latency per
+            image and both relative to 'none'
+    """
+    policies = ['none'] + [policy for policy in policies if policy != 'none']
+    rows = []
+    for policy in policies:
+        result = evaluate_stream(model, make_chunks(), labels, max_batch_size=max_batch_size, tta_policy=policy)
+        rows.append({
+            'policy': policy,
+            'variants': len(TTA_POLICIES[policy]),
+            'accuracy': result['accuracy'],
+            'log_loss': result['log_loss'],
+            'ms_per_image': result['invoke_ms_per_image'],
+        })
+    baseline = rows[0]
+    for row in rows:
+        row['accuracy_gain'] = row['accuracy'] - baseline['accuracy']
+        row['extra_ms_per_image'] = row['ms_per_image'] - baseline['ms_per_image']
+    return rows
+
+
+def print_tta(rows):
+    print(f"\n{'Policy':<12}{'Variants':>9}{'Accuracy':>10}{'Gain':>9}{'Log loss':>10}{'ms/image':>10}{'Extra ms':>10}")
+    for row in rows:
+        print(f"{row['policy']:<12}{row['variants']:>9}{row['accuracy']:>10.4f}{row['accuracy_gain']:>+9.4f}"
+              f"{row['log_loss']:>10.4f}{row['ms_per_image']:>10.3f}{row['extra_ms_per_image']:>+10.3f}")
+
+
+def print_summary(result):
+    print(f"\nImages: {result['images']}  accuracy: {result['accuracy']:.4f}  log loss: {result['log_loss']:.4f}")
+    print(f"{'Class':<12}{'Precision':>10}{'Recall':>8}{'F1':>8}{'Support':>9}")
+    for label, row in result['per_class'].items():
+        print(f"{label:<12}{row['precision']:>10.4f}{row['recall']:>8.4f}{row['f1']:>8.4f}{row['support']:>9}")
+    print(f"\n{result['images_per_sec']:.1f} images/sec, peak memory {result['peak_memory_mb']:.0f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate a TFLite model over a dataset with bounded memory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    cache_parser = subparsers.add_parser('cache', help='decode a dataset once into a memory-mapped cache')
+    cache_parser.add_argument('--data-dir', type=str, required=True,
+                      help='dataset directory with one sub-directory per class')
+    cache_parser.add_argument('--task', type=str, choices=list(TASKS), required=True,
+                      help='task whose input size and color mode to cache')
+    cache_parser.add_argument('--output', type=str, required=True,
+                      help='cache directory')
+    cache_parser.add_argument('--size', type=int, default=None,
+                      help="image size to cache, e.g. 96 for fast models (default: the task's input size)")
+
+    eval_parser = subparsers.add_parser('evaluate', help='stream a dataset through a model')
+    eval_parser.add_argument('--model', type=str, required=True,
+                      help='path to the .tflite model')
+    eval_parser.add_argument('--task', type=str, choices=list(TASKS), required=True,
+                      help='task the model predicts')
+    eval_parser.add_argument('--data-dir', type=str, default=None,
+                      help='read images lazily from this class-per-directory dataset')
+    eval_parser.add_argument('--cache', type=str, default=None,
+                      help='read images from a cache built with the cache command')
+    eval_parser.add_argument('--chunk-size', type=int, default=256,
+                      help='images read per chunk (default: 256)')
+    eval_parser.add_argument('--batch-size', type=int, default=64,
+                      help='images per invoke (default: 64)')
+    eval_parser.add_argument('--threads', type=int, default=None,
+                      help='interpreter threads')
+    eval_parser.add_argument('--json', type=str, default=None,
+                      help='also write the metrics to this JSON file')
+    eval_parser.add_argument('--tta', type=str, choices=list(TTA_POLICIES), default=None,
+                      help='evaluate with this test-time augmentation policy')
+
+    tta_parser = subparsers.add_parser('tta', help='compare accuracy and latency of test-time augmentation policies')
+    tta_parser.add_argument('--model', type=str, required=True,
+                      help='path to the .tflite model')
+    tta_parser.add_argument('--task', type=str, choices=list(TASKS), required=True,
+                      help='task the model predicts')
+    tta_parser.add_argument('--data-dir', type=str, default=None,
+                      help='read images lazily from this class-per-directory dataset')
+    tta_parser.add_argument('--cache', type=str, default=None,
+                      help='read images from a cache built with the cache command')
+    tta_parser.add_argument('--policies', type=str, nargs='+', choices=list(TTA_POLICIES), default=list(TTA_POLICIES),
+                      help='policies to compare against no augmentation (default: all)')
+    tta_parser.add_argument('--chunk-size', type=int, default=256,
+                      help='images read per chunk (default: 256)')
+    tta_parser.add_argument('--batch-size', type=int, default=16,
+                      help='images per invoke, before augmentation (default: 16)')
+    tta_parser.add_argument('--threads', type=int, default=None,
+                      help='interpreter threads')
+    tta_parser.add_argument('--json', type=str, default=None,
+                      help='also write the report to this JSON file')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'cache':
+        meta = build_cache(args.data_dir, args.task, args.output, size=args.size)
+        print(f"Cached {meta['count']} images of shape {meta['shape']} in {args.output}")
+        return
+
+    if bool(args.data_dir) == bool(args.cache):
+        parser.error('pass exactly one of --data-dir or --cache')
+
+    from tflite_inference import TFLiteModel
+
+    # Read images at the model's own input size, so reduced-size variants are evaluated correctly
+    model = TFLiteModel(args.model, args.task, num_threads=args.threads)
+    size = model.input_size
+
+    if args.cache:
+        with open(os.path.join(args.cache, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['task'] != args.task:
+            parser.error(f"cache {args.cache} was built for task {meta['task']}")
+        if size and meta['shape'][0] != size:
+            parser.error(f"cache {args.cache} holds {meta['shape'][0]}px images but {args.model} takes {size}px; "
+                         f"rebuild it with `cache --size {size}`")
+        labels = meta['classes']
+
+        def make_chunks():
+            return iter_cache_chunks(args.cache, args.chunk_size)
+    else:
+        labels = class_names(args.data_dir)
+
+        def make_chunks():
+            return iter_directory_chunks(args.data_dir, args.task, args.chunk_size, size=size)
+
+    if args.command == 'tta':
+        result = compare_tta(model, make_chunks, labels, args.policies, max_batch_size=args.batch_size)
+        print_tta(result)
+    else:
+        result = evaluate_stream(model, make_chunks(), labels, max_batch_size=args.batch_size, tta_policy=args.tta)
+        print_summary(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
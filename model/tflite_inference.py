@@ -0,0 +1,539 @@
+"""
+TensorFlow Lite Runtime Helpers
+
+Shared inference code for the converted age, gender and expression models:
+loading an interpreter, preprocessing face crops to each model's input
+format, (de)quantizing uint8/int8 models and running a batch of crops in a
+single invoke. Used by the inference server and the offline tools so that
+preprocessing is identical everywhere.
+
+Models exported with fused preprocessing (`model_export.py export
+--fuse-preprocessing`) take raw uint8 RGB crops of any size; for those the
+crop is passed through unchanged and the model resizes, converts and
+rescales it itself.
+
+`TFLiteModel.predict_tta` runs test-time augmentation (flips, small crops):
+all augmented variants of a batch are stacked into one input, invoked once,
+and their softmax outputs averaged.
+
+Models are always loaded by path, which TFLite memory-maps instead of
+reading into Python bytes, so worker processes share the model's pages
+through the page cache. With TFLITE_XNNPACK_WEIGHT_CACHE_DIR set (and the
+XNNPACK delegate library in TFLITE_XNNPACK_DELEGATE), the weights XNNPACK
+repacks at load time are persisted and mapped on later starts;
+`cold_start.py` measures the effect.
+
+`CascadeModel` runs a small fast age/gender model (`train_model.py
+--variant fast`) first and only escalates crops it is unsure about to the
+full model; `cascade.py sweep` picks the confidence threshold.
+"""
+
+import os
+import warnings
+import threading
+
+from train_model import AGE_RANGES, GENDERS, EMOTIONS, IMG_SIZE, EMOTION_IMG_SIZE
+
+# task -> (class labels, input size, color mode); mirrors create_data_generators
+TASKS = {
+    'age': (AGE_RANGES, IMG_SIZE, 'rgb'),
+    'gender': (GENDERS, IMG_SIZE, 'rgb'),
+    'expression': (EMOTIONS, EMOTION_IMG_SIZE, 'grayscale'),
+}
+
+# Test-time augmentation policies: (crop, horizontal flip) per variant. Crops
+# keep TTA_CROP_SCALE of each side and are resized back to the input size.
+TTA_CROP_SCALE = 0.9
+TTA_POLICIES = {
+    'none': (('full', False),),
+    'flip': (('full', False), ('full', True)),
+    'crops': (('full', False), ('top_left', False), ('top_right', False),
+              ('bottom_left', False), ('bottom_right', False)),
+    'flip_crops': tuple((crop, flip) for flip in (False, True)
+                        for crop in ('full', 'top_left', 'top_right', 'bottom_left', 'bottom_right')),
+}
+
+# XNNPACK built as a TFLite external delegate library. The built-in XNNPACK
+# delegate cannot be given a weight cache file from Python.
+XNNPACK_DELEGATE_ENV = 'TFLITE_XNNPACK_DELEGATE'
+
+# Directory of persisted XNNPACK weight caches (one file per model version)
+WEIGHT_CACHE_DIR_ENV = 'TFLITE_XNNPACK_WEIGHT_CACHE_DIR'
+
+
+def default_model_path(models_dir, task, model_name=None):
+    """
+    Conventional location of a converted model, next to the task's Keras
+    checkpoints: <models_dir>/<task>/<model_name>_model.tflite, where
+    model_name defaults to the task (`<task>_fast` for cascade first stages)
+    """
+    return os.path.join(models_dir, task, f'{model_name or task}_model.tflite')
+
+
+def weight_cache_path(model_path, cache_dir):
+    """
+    XNNPACK weight cache file for a model, keyed by its size and mtime so a
+    re-converted model never picks up stale packed weights (hashing the
+    file would cost more than the cache saves at startup)
+    """
+    stat = os.stat(model_path)
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f'{name}-{stat.st_size:x}-{stat.st_mtime_ns:x}.xnnpack_cache')
+
+
+def find_xnnpack_delegate(path=None):
+    """
+    Locate the XNNPACK external delegate library from an explicit path or
+    the TFLITE_XNNPACK_DELEGATE environment variable
+    """
+    candidate = path or os.environ.get(XNNPACK_DELEGATE_ENV)
+    if candidate and os.path.exists(candidate):
+        return candidate
+    return None
+
+
+def load_interpreter(model_path, num_threads=None, xnnpack=None, use_host_config=True, weight_cache_dir=None):
+    """
+    Create and allocate a TFLite interpreter
+
+    Settings left as None come from this host's tuned config
+    (`autotune.py tune`), else the TFLite defaults. The model file is
+    memory-mapped by TFLite, not read into Python.
+
+    Args:
+        model_path (str): Path to the .tflite model
+        num_threads (int): Interpreter threads
+        xnnpack (bool): Whether to apply TFLite's default XNNPACK delegate
+        use_host_config (bool): Read untuned settings from the host config
+        weight_cache_dir (str): Persist XNNPACK's packed weights here
+            (default: $TFLITE_XNNPACK_WEIGHT_CACHE_DIR); needs the delegate
+            library from $TFLITE_XNNPACK_DELEGATE
+    """
+    import tensorflow as tf
+
+    if use_host_config and (num_threads is None or xnnpack is None):
+        from autotune import interpreter_settings
+
+        tuned = interpreter_settings(model_path)
+        num_threads = tuned.get('num_threads') if num_threads is None else num_threads
+        xnnpack = tuned.get('xnnpack') if xnnpack is None else xnnpack
+
+    options = {}
+    if xnnpack is False:
+        options['experimental_op_resolver_type'] = (
+            tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+
+    weight_cache_dir = weight_cache_dir or os.environ.get(WEIGHT_CACHE_DIR_ENV)
+    if weight_cache_dir and xnnpack is not False:
+        library = find_xnnpack_delegate()
+        if library:
+            os.makedirs(weight_cache_dir, exist_ok=True)
+            delegate_options = {'weight_cache_file_path': weight_cache_path(model_path, weight_cache_dir)}
+            if num_threads:
+                delegate_options['num_threads'] = str(num_threads)
+            options['experimental_delegates'] = [tf.lite.experimental.load_delegate(library, delegate_options)]
+            # The external delegate replaces the built-in one
+            options['experimental_op_resolver_type'] = (
+                tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+        else:
+            warnings.warn(f"{WEIGHT_CACHE_DIR_ENV} is set but no XNNPACK delegate library was found "
+                          f"(set {XNNPACK_DELEGATE_ENV}); loading without a weight cache")
+    interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads, **options)
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+def preprocess_face(face, task, out=None, size=None):
+    """
+    Resize and color-convert a face crop to a model's input format
+
+    Matches the training pipeline: RGB or grayscale, resized to the task's
+    input size and rescaled to [0, 1].
+
+    Args:
+        face: HxWx3 / HxW uint8 array or PIL image
+        task (str): 'age', 'gender', or 'expression'
+        out (np.array): Optional float32 (size, size, channels) slot to write
+            into instead of allocating a new array
+        size (int): Input size override (e.g. for fast cascade models)
+
+    Returns:
+        np.array: float32 array of shape (size, size, channels)
+    """
+    import numpy as np
+    from PIL import Image
+
+    _, task_size, color_mode = TASKS[task]
+    size = size or task_size
+    image = face if isinstance(face, Image.Image) else Image.fromarray(np.asarray(face, dtype=np.uint8))
+    image = image.convert('L' if color_mode == 'grayscale' else 'RGB')
+    if image.size != (size, size):
+        image = image.resize((size, size), Image.BILINEAR)
+
+    pixels = np.asarray(image)
+    if color_mode == 'grayscale':
+        pixels = pixels[..., np.newaxis]
+    if out is None:
+        return pixels.astype(np.float32) / 255.0
+    np.multiply(pixels, 1.0 / 255.0, out=out, casting='unsafe')
+    return out
+
+
+def raw_rgb(face):
+    """
+    Return a face crop as an HxWx3 uint8 array, for models with fused
+    preprocessing
+    """
+    import numpy as np
+    from PIL import Image
+
+    if isinstance(face, Image.Image):
+        return np.asarray(face.convert('RGB'))
+    face = np.asarray(face, dtype=np.uint8)
+    if face.ndim == 2:
+        face = np.repeat(face[..., np.newaxis], 3, axis=-1)
+    return face
+
+
+def tta_batch(batch, policy):
+    """
+    Stack every augmented variant of a batch along the batch axis
+
+    Crops are resized back with nearest-neighbour index arrays, so building
+    the variants is a handful of vectorized gathers.
+
+    Args:
+        batch (np.array): (n, height, width, channels) inputs
+        policy (str): Key of TTA_POLICIES
+
+    Returns:
+        np.array: (variants * n, height, width, channels), variant-major
+    """
+    import numpy as np
+
+    height, width = batch.shape[1:3]
+    crop_h, crop_w = int(round(height * TTA_CROP_SCALE)), int(round(width * TTA_CROP_SCALE))
+    offsets = {
+        'top_left': (0, 0),
+        'top_right': (0, width - crop_w),
+        'bottom_left': (height - crop_h, 0),
+        'bottom_right': (height - crop_h, width - crop_w),
+    }
+    rows = (np.arange(height) * crop_h) // height
+    cols = (np.arange(width) * crop_w) // width
+
+    variants = []
+    for crop, flip in TTA_POLICIES[policy]:
+        if crop == 'full':
+            variant = batch
+        else:
+            top, left = offsets[crop]
+            variant = batch[:, (top + rows)[:, np.newaxis], left + cols]
+        variants.append(variant[:, :, ::-1] if flip else variant)
+    return np.concatenate(variants)
+
+
+def quantize(data, detail):
+    """
+    Convert float input to the tensor's dtype using its quantization parameters
+    """
+    import numpy as np
+
+    dtype = detail['dtype']
+    if not np.issubdtype(dtype, np.integer):
+        return data.astype(dtype, copy=False)
+    scale, zero_point = detail['quantization']
+    if scale == 0:
+        return data.astype(dtype)
+    info = np.iinfo(dtype)
+    return np.clip(np.round(data / scale + zero_point), info.min, info.max).astype(dtype)
+
+
+def dequantize(data, detail):
+    """
+    Convert an integer output tensor back to float
+    """
+    import numpy as np
+
+    if not np.issubdtype(detail['dtype'], np.integer):
+        return data.astype(np.float32, copy=False)
+    scale, zero_point = detail['quantization']
+    if scale == 0:
+        return data.astype(np.float32)
+    return (data.astype(np.float32) - zero_point) * scale
+
+
+class TFLiteModel:
+    """
+    A converted model plus the pre/post-processing for its task
+
+    An instance wraps a single interpreter; calls are serialized with a lock,
+    so use one instance per worker thread to run invokes in parallel.
+    """
+
+    def __init__(self, model_path, task, num_threads=None, xnnpack=None):
+        """
+        Args:
+            model_path (str): Path to the .tflite model
+            task (str): 'age', 'gender', or 'expression'
+            num_threads (int): Interpreter threads (default: host config)
+            xnnpack (bool): Use the XNNPACK delegate (default: host config)
+        """
+        self.model_path = model_path
+        self.task = task
+        self.labels = TASKS[task][0]
+        self.interpreter = load_interpreter(model_path, num_threads=num_threads, xnnpack=xnnpack)
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._input_shape = tuple(int(d) for d in self.input_detail['shape'])
+        self._lock = threading.Lock()
+        # Fused-preprocessing models declare a dynamic height and width
+        signature = self.input_detail.get('shape_signature', self.input_detail['shape'])
+        self.raw_input = any(int(d) == -1 for d in signature[1:3])
+        # Read from the model so reduced-resolution variants preprocess correctly
+        self.input_size = None if self.raw_input else int(self.input_detail['shape'][1])
+
+    def preprocess(self, face):
+        if self.raw_input:
+            return raw_rgb(face)
+        return preprocess_face(face, self.task, size=self.input_size)
+
+    def _ensure_input_shape(self, shape):
+        """
+        Resize the input tensor if the batch size (or, for raw-input models,
+        the crop size) changed
+        """
+        shape = tuple(int(d) for d in shape)
+        if shape == self._input_shape:
+            return
+        self.interpreter.resize_tensor_input(self.input_detail['index'], list(shape))
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._input_shape = shape
+
+    def predict_batch(self, batch):
+        """
+        Run a batch of preprocessed inputs in a single invoke
+
+        Args:
+            batch (np.array): float32 array of shape (n, size, size, channels),
+                or uint8 (n, height, width, 3) for raw-input models
+
+        Returns:
+            np.array: Class probabilities of shape (n, classes)
+        """
+        with self._lock:
+            self._ensure_input_shape(batch.shape)
+            self.interpreter.set_tensor(self.input_detail['index'], quantize(batch, self.input_detail))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_detail['index'])
+            return dequantize(output, self.output_detail)
+
+    def predict_tta(self, batch, policy):
+        """
+        Run every TTA variant of a batch in a single invoke and average the
+        softmax outputs
+
+        Args:
+            batch (np.array): Preprocessed inputs, as for predict_batch
+            policy (str): Key of TTA_POLICIES
+
+        Returns:
+            np.array: Averaged class probabilities of shape (n, classes)
+        """
+        if len(TTA_POLICIES[policy]) == 1:
+            return self.predict_batch(batch)
+        probabilities = self.predict_batch(tta_batch(batch, policy))
+        return probabilities.reshape(-1, len(batch), probabilities.shape[-1]).mean(axis=0)
+
+    def predict_preprocessed(self, inputs):
+        """
+        Run a list of preprocessed inputs, one invoke per distinct input shape
+        (always a single invoke unless raw crops of different sizes are mixed)
+
+        Returns:
+            np.array: Class probabilities of shape (n, classes), in input order
+        """
+        import numpy as np
+
+        groups = {}
+        for i, data in enumerate(inputs):
+            groups.setdefault(data.shape, []).append(i)
+        if len(groups) == 1:
+            return self.predict_batch(np.stack(inputs))
+
+        output = np.empty((len(inputs), len(self.labels)), dtype=np.float32)
+        for indices in groups.values():
+            output[indices] = self.predict_batch(np.stack([inputs[i] for i in indices]))
+        return output
+
+    def predict(self, faces):
+        """
+        Preprocess raw face crops and run them as one batch
+        """
+        return self.predict_preprocessed([self.preprocess(face) for face in faces])
+
+    def decode(self, probabilities):
+        """
+        Map one row of probabilities to a label and confidence
+        """
+        index = int(probabilities.argmax())
+        return {'label': self.labels[index], 'confidence': float(probabilities[index])}
+
+
+def batch_bucket(count, max_batch_size):
+    """
+    Round a batch size up to the next power of two (capped at
+    max_batch_size), so the interpreter is only re-allocated for a handful
+    of distinct batch sizes as the number of faces changes
+    """
+    bucket = 1
+    while bucket < count:
+        bucket *= 2
+    return min(bucket, max_batch_size)
+
+
+class BatchedFaceRunner:
+    """
+    Run every face crop of a frame through each task in one invoke
+
+    Crops are preprocessed straight into a preallocated per-task input buffer,
+    which is invoked once per task with the batch padded to a power-of-two
+    bucket. Requires models converted with a dynamic batch dimension
+    (`convert_to_tflite.py` default). Models with fused preprocessing take
+    variable-size crops and fall back to TFLiteModel.predict.
+    """
+
+    def __init__(self, models, max_batch_size=16):
+        """
+        Args:
+            models (dict): task -> TFLiteModel
+            max_batch_size (int): Faces per invoke; larger frames are split
+        """
+        import numpy as np
+
+        self.models = models
+        self.max_batch_size = max_batch_size
+        self.buffers = {}
+        self.cascade_stages = {}
+        for task, model in models.items():
+            if isinstance(model, CascadeModel):
+                # Each stage gets its own buffer at its own input size
+                self.cascade_stages[task] = tuple(
+                    BatchedFaceRunner({task: stage}, max_batch_size) for stage in (model.fast, model.full)
+                )
+                continue
+            if model.raw_input:
+                continue
+            channels = 1 if TASKS[task][2] == 'grayscale' else 3
+            size = model.input_size
+            self.buffers[task] = np.zeros((max_batch_size, size, size, channels), dtype=np.float32)
+
+    def predict(self, task, faces):
+        """
+        Class probabilities for a list of raw face crops
+
+        Returns:
+            np.array: (len(faces), classes)
+        """
+        import numpy as np
+
+        model = self.models[task]
+        if task in self.cascade_stages:
+            fast, full = self.cascade_stages[task]
+            return model.predict(faces, lambda crops: fast.predict(task, crops),
+                                 lambda crops: full.predict(task, crops))
+        if task not in self.buffers:
+            return model.predict(faces)
+
+        buffer = self.buffers[task]
+        outputs = []
+        for start in range(0, len(faces), self.max_batch_size):
+            chunk = faces[start:start + self.max_batch_size]
+            for i, face in enumerate(chunk):
+                preprocess_face(face, task, out=buffer[i], size=model.input_size)
+            # Rows past len(chunk) hold stale crops; their outputs are dropped
+            bucket = batch_bucket(len(chunk), self.max_batch_size)
+            outputs.append(model.predict_batch(buffer[:bucket])[:len(chunk)])
+        if not outputs:
+            return np.empty((0, len(model.labels)), dtype=np.float32)
+        return outputs[0] if len(outputs) == 1 else np.concatenate(outputs)
+
+    def predict_all(self, faces, tasks=None):
+        """
+        Decoded predictions for every task: one invoke per task per frame
+
+        Returns:
+            list: One {task: {'label', 'confidence'}} dict per face
+        """
+        results = [{} for _ in faces]
+        for task in tasks or self.models:
+            for result, row in zip(results, self.predict(task, faces)):
+                result[task] = self.models[task].decode(row)
+        return results
+
+
+def top_confidence(probabilities):
+    """
+    Highest class probability of each row
+    """
+    return probabilities.max(axis=1)
+
+
+class CascadeModel:
+    """
+    Confidence-gated two-stage model for one task
+
+    Every crop goes through the fast model; crops whose top-class confidence
+    is below `threshold` are re-run through the full model, whose
+    probabilities replace the fast ones. With a threshold of 0 this is the
+    fast model alone, above 1 it is the full model (plus the fast invoke).
+    """
+
+    def __init__(self, fast, full, threshold=0.8):
+        """
+        Args:
+            fast (TFLiteModel): Small first-stage model
+            full (TFLiteModel): Full model for low-confidence crops
+            threshold (float): Minimum fast-model confidence to accept
+        """
+        if fast.task != full.task:
+            raise ValueError(f"Cascade stages predict different tasks: {fast.task} and {full.task}")
+        self.fast = fast
+        self.full = full
+        self.task = full.task
+        self.labels = full.labels
+        self.threshold = threshold
+        self.stats = {'faces': 0, 'escalated': 0}
+
+    def predict(self, faces, fast_predict=None, full_predict=None):
+        """
+        Class probabilities for a list of raw face crops
+
+        Args:
+            faces (list): Raw face crops
+            fast_predict, full_predict: Optional replacements for the stages'
+                `predict` (BatchedFaceRunner passes its buffered runners)
+
+        Returns:
+            np.array: (len(faces), classes)
+        """
+        import numpy as np
+
+        fast_predict = fast_predict or self.fast.predict
+        full_predict = full_predict or self.full.predict
+        probabilities = np.array(fast_predict(faces), dtype=np.float32)
+        escalate = np.flatnonzero(top_confidence(probabilities) < self.threshold)
+        if len(escalate):
+            probabilities[escalate] = full_predict([faces[i] for i in escalate])
+        self.stats['faces'] += len(faces)
+        self.stats['escalated'] += len(escalate)
+        return probabilities
+
+    def escalation_rate(self):
+        return self.stats['escalated'] / self.stats['faces'] if self.stats['faces'] else 0.0
+
+    def decode(self, probabilities):
+        index = int(probabilities.argmax())
+        return {'label': self.labels[index], 'confidence': float(probabilities[index])}
@@ -0,0 +1,497 @@
+"""
+Op-Level Profiler for TensorFlow Lite Models
+
+This script inspects a converted .tflite model and reports, for every op:
+- the kernel it runs (quantized, float, hybrid, or a quantize/dequantize
+  conversion), so ops that fell back to non-quantized kernels stand out
+- its average invoke time, when the TFLite `benchmark_model` tool is available
+  (it is the only way to time individual ops; the Python interpreter exposes
+  end-to-end invoke time only)
+- the activation memory it keeps alive
+
+It also estimates the tensor arena size from tensor lifetimes and can diff two
+variants of the same model (e.g. float32 vs int8) by op type and by layer, to
+find which layer is responsible when quantization does not speed a model up.
+
+Usage:
+    python tflite_profiler.py profile models/expression.tflite
+    python tflite_profiler.py diff models/expression_float.tflite models/expression_int8.tflite
+"""
+
+import os
+import re
+import json
+import shutil
+import argparse
+import subprocess
+
+# Ops that only convert between float and integer representations
+CONVERSION_OPS = ('QUANTIZE', 'DEQUANTIZE')
+
+# Default location of the TFLite benchmark tool, if built/installed
+BENCHMARK_BINARY_ENV = 'TFLITE_BENCHMARK_MODEL'
+
+
+def _tensor_bytes(detail):
+    """
+    Size in bytes of a tensor from its interpreter details
+    """
+    import numpy as np
+
+    count = 1
+    for dim in detail['shape']:
+        count *= max(int(dim), 1)
+    return count * np.dtype(detail['dtype']).itemsize
+
+
+def _dtype_name(detail):
+    import numpy as np
+
+    return np.dtype(detail['dtype']).name
+
+
+def _layer_name(tensor_name):
+    """
+    Normalize an output tensor name to the Keras layer that produced it,
+    e.g. 'model/conv2d_1/Relu;model/conv2d_1/BiasAdd' -> 'conv2d_1'
+    """
+    first = tensor_name.split(';')[0]
+    parts = [p for p in first.split('/') if p]
+    if len(parts) >= 2:
+        return parts[1]
+    return first
+
+
+def _classify_kernel(op_name, input_dtypes, output_dtypes, weight_dtypes):
+    """
+    Classify the kernel an op runs from the dtypes of its tensors
+    """
+    if op_name in CONVERSION_OPS:
+        return 'conversion'
+    activation_dtypes = set(input_dtypes) | set(output_dtypes)
+    if 'float32' in activation_dtypes or 'float16' in activation_dtypes:
+        if any(d in ('int8', 'uint8') for d in weight_dtypes):
+            return 'hybrid'
+        return 'float'
+    return 'quantized'
+
+
+def inspect_model(tflite_path):
+    """
+    Describe the ops and tensors of a TFLite model
+
+    Args:
+        tflite_path (str): Path to the .tflite model
+
+    Returns:
+        dict: Ops (in execution order), arena estimates and model I/O details
+    """
+    import tensorflow as tf
+
+    interpreter = tf.lite.Interpreter(model_path=tflite_path)
+    interpreter.allocate_tensors()
+
+    tensors = {d['index']: d for d in interpreter.get_tensor_details()}
+    ops = interpreter._get_ops_details()
+    model_inputs = {d['index'] for d in interpreter.get_input_details()}
+    model_outputs = {d['index'] for d in interpreter.get_output_details()}
+
+    # Activations are produced by an op or fed in; everything else is a weight
+    produced = {int(t) for op in ops for t in op['outputs']}
+    activations = produced | model_inputs
+
+    # Lifetime of each activation: producing op index -> last consuming op index
+    first_use = {t: -1 for t in model_inputs}
+    last_use = {}
+    for op in ops:
+        for t in op['outputs']:
+            first_use.setdefault(int(t), op['index'])
+        for t in op['inputs']:
+            t = int(t)
+            if t in activations:
+                last_use[t] = op['index']
+    for t in model_outputs:
+        last_use[t] = len(ops)
+
+    op_reports = []
+    peak_live = 0
+    for op in ops:
+        inputs = [int(t) for t in op['inputs'] if int(t) >= 0]
+        outputs = [int(t) for t in op['outputs']]
+        input_dtypes = [_dtype_name(tensors[t]) for t in inputs if t in activations]
+        weight_dtypes = [_dtype_name(tensors[t]) for t in inputs if t not in activations]
+        output_dtypes = [_dtype_name(tensors[t]) for t in outputs]
+
+        live = sum(_tensor_bytes(tensors[t]) for t in activations
+                   if first_use.get(t, -1) <= op['index'] <= last_use.get(t, -1))
+        peak_live = max(peak_live, live)
+
+        output_name = tensors[outputs[0]]['name'] if outputs else ''
+        op_reports.append({
+            'index': op['index'],
+            'op': op['op_name'],
+            'layer': _layer_name(output_name),
+            'output': output_name,
+            'kernel': _classify_kernel(op['op_name'], input_dtypes, output_dtypes, weight_dtypes),
+            'input_dtypes': input_dtypes,
+            'output_dtypes': output_dtypes,
+            'live_activation_kb': live / 1024,
+            'avg_ms': None,
+        })
+
+    return {
+        'model': tflite_path,
+        'size_mb': os.path.getsize(tflite_path) / (1024 * 1024),
+        'inputs': [{'shape': d['shape'].tolist(), 'dtype': _dtype_name(d)}
+                   for d in interpreter.get_input_details()],
+        'ops': op_reports,
+        'weights_kb': sum(_tensor_bytes(d) for i, d in tensors.items() if i not in activations) / 1024,
+        # Sum of all activations is what a naive planner would allocate;
+        # the peak of simultaneously live activations is a lower bound
+        'arena_upper_kb': sum(_tensor_bytes(tensors[t]) for t in activations) / 1024,
+        'arena_peak_kb': peak_live / 1024,
+    }
+
+
+def measure_invoke(tflite_path, runs=50, warmup=5, num_threads=None, xnnpack=True, batch_size=None):
+    """
+    Measure end-to-end invoke latency with the Python interpreter
+
+    Args:
+        xnnpack (bool): Keep TFLite's default XNNPACK delegate
+        batch_size (int): Resize the input to this batch size first
+            (models converted with a dynamic batch dimension)
+
+    Returns:
+        dict: Mean, p50 and p90 invoke time in ms
+    """
+    import time
+    import numpy as np
+    from tflite_inference import load_interpreter
+
+    # Measure exactly the requested settings, not the host's tuned ones
+    interpreter = load_interpreter(tflite_path, num_threads=num_threads, xnnpack=xnnpack, use_host_config=False)
+    if batch_size:
+        detail = interpreter.get_input_details()[0]
+        interpreter.resize_tensor_input(detail['index'], [batch_size, *detail['shape'][1:]])
+        interpreter.allocate_tensors()
+    for detail in interpreter.get_input_details():
+        if np.issubdtype(detail['dtype'], np.integer):
+            info = np.iinfo(detail['dtype'])
+            data = np.random.randint(info.min, info.max + 1, size=detail['shape'], dtype=detail['dtype'])
+        else:
+            data = np.random.rand(*detail['shape']).astype(detail['dtype'])
+        interpreter.set_tensor(detail['index'], data)
+
+    for _ in range(warmup):
+        interpreter.invoke()
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        interpreter.invoke()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings = np.array(timings)
+    return {
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p90_ms': float(np.percentile(timings, 90)),
+        'runs': runs,
+    }
+
+
+def find_benchmark_binary(path=None):
+    """
+    Locate the TFLite `benchmark_model` tool from an explicit path, the
+    TFLITE_BENCHMARK_MODEL environment variable or PATH
+    """
+    candidate = path or os.environ.get(BENCHMARK_BINARY_ENV) or shutil.which('benchmark_model')
+    if candidate and os.path.exists(candidate):
+        return candidate
+    return None
+
+
+def parse_op_profile(output):
+    """
+    Parse the 'Run Order' table printed by `benchmark_model --enable_op_profiling`
+
+    Returns:
+        list: (op type, avg ms, node name) in execution order
+    """
+    rows = []
+    in_table = False
+    for line in output.splitlines():
+        if 'Run Order' in line:
+            in_table = True
+            continue
+        if not in_table:
+            continue
+        if line.startswith('=') or not line.strip():
+            if rows:
+                break
+            continue
+        fields = line.split()
+        if fields[0].startswith('[') or len(fields) < 8:
+            continue
+        try:
+            avg_ms = float(fields[2])
+        except ValueError:
+            continue
+        match = re.search(r'\[([^\]]*)\](?::\d+)?\s*$', line)
+        name = match.group(1) if match else fields[-1]
+        rows.append((fields[0], avg_ms, name))
+    return rows
+
+
+def profile_ops(tflite_path, benchmark_binary, runs=50, num_threads=1):
+    """
+    Run the TFLite benchmark tool with op profiling enabled
+
+    Returns:
+        list: Parsed per-op timings (see parse_op_profile), or None when the
+            tool could not be run or failed (its stderr is printed)
+    """
+    cmd = [
+        benchmark_binary,
+        f'--graph={tflite_path}',
+        f'--num_runs={runs}',
+        f'--num_threads={num_threads}',
+        '--enable_op_profiling=true',
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except OSError as e:
+        print(f"Warning: could not run {benchmark_binary}: {e}; per-op timing skipped")
+        return None
+    except subprocess.CalledProcessError as e:
+        # e.g. a binary built for another TFLite version, or an op it does not support
+        stderr = '\n'.join((e.stderr or '').strip().splitlines()[-10:])
+        print(f"Warning: benchmark_model exited with status {e.returncode}; per-op timing skipped")
+        if stderr:
+            print(stderr)
+        return None
+    return parse_op_profile(proc.stdout + proc.stderr)
+
+
+def profile_model(tflite_path, runs=50, num_threads=1, benchmark_binary=None):
+    """
+    Build the full op-level report for a model
+
+    Args:
+        tflite_path (str): Path to the .tflite model
+        runs (int): Timed invocations
+        num_threads (int): Interpreter threads
+        benchmark_binary (str): Optional path to `benchmark_model`
+
+    Returns:
+        dict: Report from inspect_model with per-op timings and invoke latency
+    """
+    report = inspect_model(tflite_path)
+    report['invoke'] = measure_invoke(tflite_path, runs=runs, num_threads=num_threads)
+    report['op_timing'] = 'unavailable'
+
+    binary = find_benchmark_binary(benchmark_binary)
+    if binary:
+        timings = profile_ops(tflite_path, binary, runs=runs, num_threads=num_threads)
+        # The tool reports ops in execution order, matching the interpreter's op list;
+        # if it failed, the report keeps the interpreter's end-to-end latency only
+        if timings is not None and len(timings) == len(report['ops']):
+            for op, (_, avg_ms, _) in zip(report['ops'], timings):
+                op['avg_ms'] = avg_ms
+            report['op_timing'] = 'benchmark_model'
+        elif timings is not None:
+            print(f"Warning: benchmark_model reported {len(timings)} ops, "
+                  f"interpreter has {len(report['ops'])}; per-op timing skipped")
+
+    return report
+
+
+def fallback_ops(report):
+    """
+    Return the ops running float or hybrid kernels in a model whose other
+    ops are quantized
+    """
+    kernels = {op['kernel'] for op in report['ops']}
+    if 'quantized' not in kernels:
+        return []
+    return [op for op in report['ops'] if op['kernel'] in ('float', 'hybrid')]
+
+
+def summarize_by_op_type(report):
+    """
+    Aggregate op count, time and kernel kinds per op type
+    """
+    summary = {}
+    for op in report['ops']:
+        entry = summary.setdefault(op['op'], {'count': 0, 'ms': 0.0, 'kernels': set()})
+        entry['count'] += 1
+        entry['ms'] += op['avg_ms'] or 0.0
+        entry['kernels'].add(op['kernel'])
+    for entry in summary.values():
+        entry['kernels'] = sorted(entry['kernels'])
+    return summary
+
+
+def summarize_by_layer(report):
+    """
+    Aggregate time per Keras layer; a layer may map to several ops
+    (e.g. CONV_2D followed by a DEQUANTIZE)
+    """
+    layers = {}
+    for op in report['ops']:
+        entry = layers.setdefault(op['layer'], {'ops': [], 'ms': 0.0, 'kernels': set()})
+        entry['ops'].append(op['op'])
+        entry['ms'] += op['avg_ms'] or 0.0
+        entry['kernels'].add(op['kernel'])
+    for entry in layers.values():
+        entry['kernels'] = sorted(entry['kernels'])
+    return layers
+
+
+def print_report(report, top=20):
+    """
+    Print a human-readable op-level report
+    """
+    print(f"\nModel: {report['model']} ({report['size_mb']:.2f} MB)")
+    inputs = ', '.join(f"{i['dtype']}{i['shape']}" for i in report['inputs'])
+    print(f"Inputs: {inputs}")
+    print(f"Invoke: mean {report['invoke']['mean_ms']:.2f} ms, "
+          f"p50 {report['invoke']['p50_ms']:.2f} ms, p90 {report['invoke']['p90_ms']:.2f} ms")
+    print(f"Tensor arena: ~{report['arena_peak_kb']:.0f} KB peak live activations "
+          f"({report['arena_upper_kb']:.0f} KB without reuse), weights {report['weights_kb']:.0f} KB")
+
+    timed = report['op_timing'] != 'unavailable'
+    ops = sorted(report['ops'], key=lambda op: -(op['avg_ms'] or 0)) if timed else report['ops']
+    print(f"\n{'#':>4} {'op':<24} {'kernel':<11} {'avg ms':>8} {'live KB':>9}  layer")
+    for op in ops[:top]:
+        avg = f"{op['avg_ms']:.3f}" if op['avg_ms'] is not None else '-'
+        print(f"{op['index']:>4} {op['op']:<24} {op['kernel']:<11} {avg:>8} "
+              f"{op['live_activation_kb']:>9.0f}  {op['layer']}")
+    if len(ops) > top:
+        print(f"  ... {len(ops) - top} more ops")
+    if not timed:
+        print(f"\nPer-op timing unavailable: set {BENCHMARK_BINARY_ENV} or pass --benchmark-binary "
+              "to the TFLite benchmark_model tool")
+
+    fallbacks = fallback_ops(report)
+    if fallbacks:
+        print(f"\n{len(fallbacks)} op(s) fell back to non-quantized kernels:")
+        for op in fallbacks:
+            print(f"  #{op['index']} {op['op']} ({op['kernel']}) in {op['layer']}")
+
+
+def diff_reports(base, other):
+    """
+    Compare two variants of a model by op type and by layer
+
+    Returns:
+        dict: Per-op-type and per-layer deltas (other - base)
+    """
+    def delta(a, b, keys):
+        rows = []
+        for key in sorted(set(a) | set(b)):
+            ea, eb = a.get(key), b.get(key)
+            rows.append({
+                'key': key,
+                'base_ms': ea['ms'] if ea else None,
+                'other_ms': eb['ms'] if eb else None,
+                'delta_ms': (eb['ms'] if eb else 0.0) - (ea['ms'] if ea else 0.0),
+                'base': {k: ea[k] for k in keys} if ea else None,
+                'other': {k: eb[k] for k in keys} if eb else None,
+            })
+        return sorted(rows, key=lambda r: -abs(r['delta_ms']))
+
+    return {
+        'base': base['model'],
+        'other': other['model'],
+        'invoke_delta_ms': other['invoke']['mean_ms'] - base['invoke']['mean_ms'],
+        'size_delta_mb': other['size_mb'] - base['size_mb'],
+        'arena_delta_kb': other['arena_peak_kb'] - base['arena_peak_kb'],
+        'by_op_type': delta(summarize_by_op_type(base), summarize_by_op_type(other), ('count', 'kernels')),
+        'by_layer': delta(summarize_by_layer(base), summarize_by_layer(other), ('ops', 'kernels')),
+    }
+
+
+def print_diff(diff, top=20):
+    """
+    Print a diff between two model variants
+    """
+    print(f"\nBase:  {diff['base']}")
+    print(f"Other: {diff['other']}")
+    print(f"Invoke delta: {diff['invoke_delta_ms']:+.2f} ms, size delta: {diff['size_delta_mb']:+.2f} MB, "
+          f"arena delta: {diff['arena_delta_kb']:+.0f} KB")
+
+    print(f"\n{'op type':<24} {'base':>12} {'other':>12} {'delta ms':>9}  kernels")
+    for row in diff['by_op_type'][:top]:
+        base = f"{row['base']['count']}x {row['base_ms']:.2f}" if row['base'] else '-'
+        other = f"{row['other']['count']}x {row['other_ms']:.2f}" if row['other'] else '-'
+        kernels = '/'.join(row['other']['kernels']) if row['other'] else 'removed'
+        print(f"{row['key']:<24} {base:>12} {other:>12} {row['delta_ms']:>+9.3f}  {kernels}")
+
+    print(f"\n{'layer':<32} {'base ms':>8} {'other ms':>9} {'delta ms':>9}  other kernels")
+    for row in diff['by_layer'][:top]:
+        base = f"{row['base_ms']:.3f}" if row['base_ms'] is not None else '-'
+        other = f"{row['other_ms']:.3f}" if row['other_ms'] is not None else '-'
+        kernels = '/'.join(row['other']['kernels']) if row['other'] else 'removed'
+        print(f"{row['key']:<32} {base:>8} {other:>9} {row['delta_ms']:>+9.3f}  {kernels}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Op-level latency profiler for TensorFlow Lite models')
+    parser.add_argument('--runs', type=int, default=50,
+                      help='number of timed invocations (default: 50)')
+    parser.add_argument('--threads', type=int, default=1,
+                      help='interpreter threads (default: 1)')
+    parser.add_argument('--benchmark-binary', type=str, default=None,
+                      help=f'path to the TFLite benchmark_model tool (default: ${BENCHMARK_BINARY_ENV} or PATH)')
+    parser.add_argument('--json', type=str, default=None,
+                      help='also write the report to this JSON file')
+    parser.add_argument('--top', type=int, default=20,
+                      help='rows to print per table (default: 20)')
+    parser.add_argument('--registry', type=str, default=None,
+                      help='record invoke latency and arena size with the profiled models in this model registry')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    profile_parser = subparsers.add_parser('profile', help='profile one or more models')
+    profile_parser.add_argument('models', nargs='+', help='.tflite model paths')
+
+    diff_parser = subparsers.add_parser('diff', help='compare two variants of a model')
+    diff_parser.add_argument('base', help='baseline .tflite model (e.g. float32)')
+    diff_parser.add_argument('other', help='variant .tflite model (e.g. int8)')
+
+    args = parser.parse_args(argv)
+
+    options = dict(runs=args.runs, num_threads=args.threads, benchmark_binary=args.benchmark_binary)
+
+    if args.command == 'profile':
+        result = [profile_model(path, **options) for path in args.models]
+        for report in result:
+            print_report(report, top=args.top)
+    else:
+        base = profile_model(args.base, **options)
+        other = profile_model(args.other, **options)
+        result = diff_reports(base, other)
+        print_diff(result, top=args.top)
+
+    if args.registry:
+        from model_registry import ModelRegistry
+
+        registry = ModelRegistry(args.registry)
+        reports = result if args.command == 'profile' else [base, other]
+        for report in reports:
+            benchmarks = {
+                f'invoke_threads{args.threads}': report['invoke'],
+                'arena_peak_kb': report['arena_peak_kb'],
+            }
+            artifact_hash = registry.add(report['model'], 'tflite', benchmarks=benchmarks)
+            print(f"Recorded benchmarks for {report['model']} as {artifact_hash[:12]} in {args.registry}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
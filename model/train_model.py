@@ -8,55 +8,93 @@ the models that are later converted to TensorFlow Lite format for mobile deploym
 
 import os
 import argparse
-import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import Model
-from tensorflow.keras.layers import Input, Conv2D, MaxPooling2D, Flatten, Dense, Dropout, BatchNormalization
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.applications import MobileNetV2
+
+# TensorFlow/Keras are imported inside the functions that need them so that
+# `--help` and argument errors return without paying TensorFlow's import cost
 
 # Configuration
 IMG_SIZE = 224  # Standard size for age and gender models
 EMOTION_IMG_SIZE = 48  # Smaller size for emotion model
+FAST_IMG_SIZE = 96  # Input size of the fast age/gender models used as a cascade's first stage
 BATCH_SIZE = 32
 EPOCHS = 50
 LEARNING_RATE = 0.001
 
+# Training augmentation (ImageDataGenerator semantics: degrees, fractions of
+# width/height, shear angle in degrees, zoom range around 1.0)
+AUGMENTATION = {
+    'rotation_range': 20,
+    'width_shift_range': 0.2,
+    'height_shift_range': 0.2,
+    'shear_range': 0.2,
+    'zoom_range': 0.2,
+    'horizontal_flip': True,
+}
+
 # Age ranges for classification
 AGE_RANGES = ['0-10', '11-20', '21-30', '31-40', '41-50', '51-60', '61+']
 GENDERS = ['Female', 'Male']
 EMOTIONS = ['Angry', 'Disgust', 'Fear', 'Happy', 'Sad', 'Surprise', 'Neutral']
 
-def create_base_model(input_shape=(IMG_SIZE, IMG_SIZE, 3)):
+# Pretrained backbone weights per (input_shape, alpha), loaded once per process
+_BACKBONE_WEIGHTS = {}
+
+def create_base_model(input_shape=(IMG_SIZE, IMG_SIZE, 3), alpha=1.0):
     """
     Create a base model using MobileNetV2 as feature extractor
+    
+    The ImageNet weights come from the offline bundle (backbone_weights.py)
+    the first time a variant is built; later calls build a fresh backbone and
+    copy those weights instead of reading and verifying the file again.
+    
+    Args:
+        input_shape: Model input shape
+        alpha: MobileNetV2 width multiplier
     """
-    base_model = MobileNetV2(
-        input_shape=input_shape,
-        include_top=False,
-        weights='imagenet'
-    )
+    from tensorflow.keras.applications import MobileNetV2
+    
+    key = (tuple(input_shape), alpha)
+    if key in _BACKBONE_WEIGHTS:
+        base_model = MobileNetV2(input_shape=input_shape, alpha=alpha, include_top=False, weights=None)
+        base_model.set_weights(_BACKBONE_WEIGHTS[key])
+    else:
+        from backbone_weights import resolve_weights
+        
+        base_model = MobileNetV2(
+            input_shape=input_shape,
+            alpha=alpha,
+            include_top=False,
+            weights=resolve_weights(input_shape, alpha)
+        )
+        _BACKBONE_WEIGHTS[key] = base_model.get_weights()
     
     # Freeze the base model
     base_model.trainable = False
     
     return base_model
 
-def create_age_model():
+def create_age_model(head_units=(1024, 512), dropout=(0.5, 0.3), learning_rate=LEARNING_RATE):
     """
     Create the age classification model
+    
+    Args:
+        head_units: Width of each dense layer in the classification head
+        dropout: Dropout rate after each dense layer
+        learning_rate: Adam learning rate
     """
+    import tensorflow as tf
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.layers import Dense, Dropout
+    from tensorflow.keras.optimizers import Adam
+    
     base_model = create_base_model()
     
     # Add classification layers
     x = base_model.output
     x = tf.keras.layers.GlobalAveragePooling2D()(x)
-    x = Dense(1024, activation='relu')(x)
-    x = Dropout(0.5)(x)
-    x = Dense(512, activation='relu')(x)
-    x = Dropout(0.3)(x)
+    for units, rate in zip(head_units, dropout):
+        x = Dense(units, activation='relu')(x)
+        x = Dropout(rate)(x)
     predictions = Dense(len(AGE_RANGES), activation='softmax')(x)
     
     # Combine base model and new layers
@@ -64,24 +102,35 @@ def create_age_model():
     
     # Compile the model
     model.compile(
-        optimizer=Adam(learning_rate=LEARNING_RATE),
+        optimizer=Adam(learning_rate=learning_rate),
         loss='categorical_crossentropy',
         metrics=['accuracy']
     )
     
     return model
 
-def create_gender_model():
+def create_gender_model(head_units=(512,), dropout=(0.5,), learning_rate=LEARNING_RATE):
     """
     Create the gender classification model
+    
+    Args:
+        head_units: Width of each dense layer in the classification head
+        dropout: Dropout rate after each dense layer
+        learning_rate: Adam learning rate
     """
+    import tensorflow as tf
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.layers import Dense, Dropout
+    from tensorflow.keras.optimizers import Adam
+    
     base_model = create_base_model()
     
     # Add classification layers
     x = base_model.output
     x = tf.keras.layers.GlobalAveragePooling2D()(x)
-    x = Dense(512, activation='relu')(x)
-    x = Dropout(0.5)(x)
+    for units, rate in zip(head_units, dropout):
+        x = Dense(units, activation='relu')(x)
+        x = Dropout(rate)(x)
     predictions = Dense(len(GENDERS), activation='softmax')(x)
     
     # Combine base model and new layers
@@ -89,17 +138,26 @@ def create_gender_model():
     
     # Compile the model
     model.compile(
-        optimizer=Adam(learning_rate=LEARNING_RATE),
+        optimizer=Adam(learning_rate=learning_rate),
         loss='categorical_crossentropy',
         metrics=['accuracy']
     )
     
     return model
 
-def create_expression_model():
+def create_expression_model(head_units=(512, 256), dropout=(0.5, 0.5), learning_rate=LEARNING_RATE):
     """
     Create the expression recognition model (custom CNN)
+    
+    Args:
+        head_units: Width of each fully connected layer after the conv blocks
+        dropout: Dropout rate after each fully connected layer
+        learning_rate: Adam learning rate
     """
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.layers import Input, Conv2D, MaxPooling2D, Flatten, Dense, Dropout, BatchNormalization
+    from tensorflow.keras.optimizers import Adam
+    
     # Input layer
     inputs = Input(shape=(EMOTION_IMG_SIZE, EMOTION_IMG_SIZE, 1))
     
@@ -129,12 +187,10 @@ def create_expression_model():
     
     # Fully connected layers
     x = Flatten()(x)
-    x = Dense(512, activation='relu')(x)
-    x = BatchNormalization()(x)
-    x = Dropout(0.5)(x)
-    x = Dense(256, activation='relu')(x)
-    x = BatchNormalization()(x)
-    x = Dropout(0.5)(x)
+    for units, rate in zip(head_units, dropout):
+        x = Dense(units, activation='relu')(x)
+        x = BatchNormalization()(x)
+        x = Dropout(rate)(x)
     
     # Output layer
     predictions = Dense(len(EMOTIONS), activation='softmax')(x)
@@ -144,24 +200,98 @@ def create_expression_model():
     
     # Compile model
     model.compile(
-        optimizer=Adam(learning_rate=LEARNING_RATE),
+        optimizer=Adam(learning_rate=learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    
+    return model
+
+def create_fast_model(task, head_units=(64,), dropout=(0.3,), learning_rate=LEARNING_RATE):
+    """
+    Create a small, fast age or gender model (MobileNetV2 alpha 0.35 at
+    FAST_IMG_SIZE) used as the first stage of a confidence-gated cascade
+    
+    Args:
+        task: 'age' or 'gender'
+        head_units: Width of each dense layer in the classification head
+        dropout: Dropout rate after each dense layer
+        learning_rate: Adam learning rate
+    """
+    import tensorflow as tf
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.layers import Dense, Dropout
+    from tensorflow.keras.optimizers import Adam
+    
+    base_model = create_base_model((FAST_IMG_SIZE, FAST_IMG_SIZE, 3), alpha=0.35)
+    labels = AGE_RANGES if task == 'age' else GENDERS
+    
+    x = tf.keras.layers.GlobalAveragePooling2D()(base_model.output)
+    for units, rate in zip(head_units, dropout):
+        x = Dense(units, activation='relu')(x)
+        x = Dropout(rate)(x)
+    predictions = Dense(len(labels), activation='softmax')(x)
+    
+    model = Model(inputs=base_model.input, outputs=predictions, name=f'{task}_fast')
+    model.compile(
+        optimizer=Adam(learning_rate=learning_rate),
         loss='categorical_crossentropy',
         metrics=['accuracy']
     )
     
     return model
 
-def create_data_generators(data_dir, task):
+def create_model(task, **hyperparameters):
+    """
+    Create the model for a task, passing head_units, dropout and
+    learning_rate overrides through to its create_*_model function
+    """
+    builders = {
+        'age': create_age_model,
+        'gender': create_gender_model,
+        'expression': create_expression_model,
+    }
+    return builders[task](**hyperparameters)
+
+def create_data_generators(data_dir, task, face_index=None, augmentation='generator', sampling='uniform',
+                           batch_size=BATCH_SIZE, img_size=None, loader='keras', decode_workers=None, archives=None,
+                           archive_labels='directory'):
     """
     Create data generators for training and validation
     
     Args:
         data_dir: Path to the dataset directory
         task: 'age', 'gender', or 'expression'
+        face_index: Optional face store index.csv (see face_store.py); when
+            given, precomputed crops are read from the store instead of data_dir
+        augmentation: Where training augmentation runs:
+            'generator' - per image in ImageDataGenerator (default)
+            'batch' - one vectorized affine warp per batch (see augmentation.py)
+            'layers' - none here; Keras preprocessing layers are added to the
+                model with augmentation.add_augmentation_layers
+        sampling: How training batches are drawn:
+            'uniform' - walk the dataset as-is (default)
+            'balanced' - equal share of each class per epoch (see sampling.py)
+            'hard' - balanced, and weighted towards high-loss samples
+        batch_size: Images per batch
+        img_size: Override the task's input size (e.g. FAST_IMG_SIZE)
+        loader: Where images are decoded:
+            'keras' - in ImageDataGenerator (default)
+            'shared-memory' - in worker processes writing batches into
+                shared memory (see data_loader.py)
+        decode_workers: Decode processes per generator with the
+            shared-memory loader (default: CPUs - 1)
+        archives: Optional tar/zip shards (paths, directories or glob
+            patterns); when given, samples are streamed from the archives
+            instead of data_dir (see archive_dataset.py)
+        archive_labels: How archive samples are labelled: 'directory'
+            (parent directory name) or 'utkface' (UTKFace file names)
     
     Returns:
         Tuple of (train_generator, validation_generator)
     """
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+    
     # Determine input size and color mode based on task
     if task == 'expression':
         target_size = (EMOTION_IMG_SIZE, EMOTION_IMG_SIZE)
@@ -169,17 +299,14 @@ def create_data_generators(data_dir, task):
     else:  # age or gender
         target_size = (IMG_SIZE, IMG_SIZE)
         color_mode = 'rgb'
+    if img_size:
+        target_size = (img_size, img_size)
     
     # Data augmentation for training
     train_datagen = ImageDataGenerator(
         rescale=1./255,
-        rotation_range=20,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        shear_range=0.2,
-        zoom_range=0.2,
-        horizontal_flip=True,
-        validation_split=0.2
+        validation_split=0.2,
+        **(AUGMENTATION if augmentation == 'generator' else {})
     )
     
     # Only rescaling for validation
@@ -188,29 +315,103 @@ def create_data_generators(data_dir, task):
         validation_split=0.2
     )
     
-    # Create generators
-    train_generator = train_datagen.flow_from_directory(
-        data_dir,
-        target_size=target_size,
-        batch_size=BATCH_SIZE,
-        class_mode='categorical',
-        color_mode=color_mode,
-        subset='training'
-    )
-    
-    validation_generator = valid_datagen.flow_from_directory(
-        data_dir,
-        target_size=target_size,
-        batch_size=BATCH_SIZE,
-        class_mode='categorical',
-        color_mode=color_mode,
-        subset='validation'
-    )
+    if archives:
+        # Stream samples straight out of tar/zip shards instead of extracted files
+        from archive_dataset import create_reader
+        from data_loader import ArchiveSequence
+        
+        if sampling != 'uniform' or loader != 'keras':
+            raise ValueError("Archive shards are streamed in order; use uniform sampling and the keras loader")
+        
+        transform = dict(rescale=1./255, **(AUGMENTATION if augmentation == 'generator' else {}))
+        train_reader = create_reader(archives, task, target_size, color_mode, labels=archive_labels,
+                                     subset='training', transform=transform)
+        validation_reader = create_reader(archives, task, target_size, color_mode, labels=archive_labels,
+                                          subset='validation', transform={'rescale': 1./255}, shuffle=False,
+                                          repeat=False)
+        print(f"Streaming {len(train_reader.classes)} training and {len(validation_reader.classes)} validation "
+              f"images from {len(train_reader.shards)} shard(s)")
+        
+        train_generator = ArchiveSequence(train_reader, batch_size)
+        validation_generator = ArchiveSequence(validation_reader, batch_size)
+    elif face_index:
+        # Read precomputed, deduplicated crops from a face store
+        from face_store import read_face_index, split_face_index
+        
+        faces = read_face_index(face_index)
+        print(f"Using {len(faces)} unique face crops from {face_index}")
+        
+        # The index is grouped by class, so split each class rather than by row position
+        train_faces, validation_faces = split_face_index(faces, validation_split=0.2)
+        classes = sorted(faces['label'].unique())
+        
+        train_generator = train_datagen.flow_from_dataframe(
+            train_faces,
+            x_col='path',
+            y_col='label',
+            classes=classes,
+            target_size=target_size,
+            batch_size=batch_size,
+            class_mode='categorical',
+            color_mode=color_mode
+        )
+        
+        validation_generator = valid_datagen.flow_from_dataframe(
+            validation_faces,
+            x_col='path',
+            y_col='label',
+            classes=classes,
+            target_size=target_size,
+            batch_size=batch_size,
+            class_mode='categorical',
+            color_mode=color_mode
+        )
+    else:
+        # Create generators
+        train_generator = train_datagen.flow_from_directory(
+            data_dir,
+            target_size=target_size,
+            batch_size=batch_size,
+            class_mode='categorical',
+            color_mode=color_mode,
+            subset='training'
+        )
+        
+        validation_generator = valid_datagen.flow_from_directory(
+            data_dir,
+            target_size=target_size,
+            batch_size=batch_size,
+            class_mode='categorical',
+            color_mode=color_mode,
+            subset='validation'
+        )
+        
+        # For UTKFace dataset, we need to map filenames to age ranges
+        if task == 'age' and 'utkface' in data_dir.lower():
+            train_generator = map_class_to_age(train_generator)
+            validation_generator = map_class_to_age(validation_generator)
+    
+    # Draw class-balanced batches from per-class index arrays
+    if sampling in ('balanced', 'hard'):
+        from sampling import BalancedSequence, describe_balance
+        
+        train_generator = BalancedSequence(train_generator, hard_examples=(sampling == 'hard'))
+        describe_balance(train_generator, train_generator.class_indices)
     
-    # For UTKFace dataset, we need to map filenames to age ranges
-    if task == 'age' and 'utkface' in data_dir.lower():
-        train_generator = map_class_to_age(train_generator)
-        validation_generator = map_class_to_age(validation_generator)
+    # Decode in worker processes straight into shared-memory batch buffers
+    if loader == 'shared-memory':
+        from data_loader import SharedMemorySequence
+        
+        transform = dict(rescale=1./255, **(AUGMENTATION if augmentation == 'generator' else {}))
+        train_generator = SharedMemorySequence(train_generator, transform=transform, workers=decode_workers)
+        validation_generator = SharedMemorySequence(validation_generator, transform={'rescale': 1./255},
+                                                    workers=decode_workers)
+    
+    # Augment whole batches with a single vectorized warp
+    if augmentation == 'batch':
+        from augmentation import BatchAugmentedSequence
+        
+        train_generator = BatchAugmentedSequence(train_generator)
     
     return train_generator, validation_generator
 
@@ -222,7 +423,8 @@ def map_class_to_age(generator):
     # This would need to be implemented based on the specific dataset format
     return generator
 
-def train_model(model, train_generator, validation_generator, task):
+def train_model(model, train_generator, validation_generator, task, telemetry=None, extra_callbacks=None,
+                model_name=None):
     """
     Train the model using the provided generators
     
@@ -231,18 +433,24 @@ def train_model(model, train_generator, validation_generator, task):
         train_generator: Training data generator
         validation_generator: Validation data generator
         task: 'age', 'gender', or 'expression'
+        telemetry: Optional TrainingTelemetry callback recording per-step timing
+        extra_callbacks: Optional list of additional Keras callbacks
+        model_name: File name prefix under models/<task>/ (default: task)
     
     Returns:
         Trained model and training history
     """
+    from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau
+    
     # Create the model output directory
     models_dir = os.path.join('models', task)
     os.makedirs(models_dir, exist_ok=True)
+    model_name = model_name or task
     
     # Define callbacks
     callbacks = [
         ModelCheckpoint(
-            os.path.join(models_dir, f'{task}_model_best.h5'),
+            os.path.join(models_dir, f'{model_name}_model_best.h5'),
             monitor='val_accuracy',
             save_best_only=True,
             mode='max',
@@ -261,7 +469,12 @@ def train_model(model, train_generator, validation_generator, task):
             min_lr=1e-6,
             verbose=1
         )
-    ]
+    ] + list(extra_callbacks or [])
+    
+    # Per-step timing needs the generator wrapped to measure batch fetch time
+    if telemetry is not None:
+        train_generator = telemetry.wrap(train_generator)
+        callbacks.append(telemetry)
     
     # Train the model
     history = model.fit(
@@ -272,10 +485,26 @@ def train_model(model, train_generator, validation_generator, task):
     )
     
     # Save the final model
-    model.save(os.path.join(models_dir, f'{task}_model_final.h5'))
+    model.save(os.path.join(models_dir, f'{model_name}_model_final.h5'))
+    
+    # Inference-only SavedModel and .keras exports load and convert faster than the .h5
+    from model_export import export_inference_model
+    export_inference_model(model, models_dir, model_name)
     
     return model, history
 
+def history_metrics(history):
+    """
+    Summarize a Keras History at the epoch with the best validation accuracy
+    """
+    values = history.history
+    if not values.get('val_accuracy'):
+        return {'epochs': len(values.get('loss', []))}
+    best = max(range(len(values['val_accuracy'])), key=values['val_accuracy'].__getitem__)
+    metrics = {name: float(series[best]) for name, series in values.items() if len(series) > best}
+    metrics.update(best_epoch=best + 1, epochs=len(values['val_accuracy']))
+    return metrics
+
 def fine_tune_model(model, train_generator, validation_generator, task):
     """
     Fine-tune the model by unfreezing some layers of the base model
@@ -293,24 +522,87 @@ def fine_tune_model(model, train_generator, validation_generator, task):
     # For simplicity, this is left as a placeholder
     return model, None
 
-def main():
+def main(argv=None):
     """
     Main function to train models
+    
+    Args:
+        argv: Argument list (defaults to sys.argv[1:])
     """
     parser = argparse.ArgumentParser(description='Train models for age, gender, and expression recognition')
     parser.add_argument('--task', type=str, choices=['age', 'gender', 'expression', 'all'], default='all',
                       help='which model to train (default: all)')
-    parser.add_argument('--data-dir', type=str, required=True,
+    parser.add_argument('--data-dir', type=str, default=None,
                       help='path to dataset directory')
+    parser.add_argument('--face-index', type=str, default=None,
+                      help='train from a face store index.csv instead of --data-dir; '
+                           '"{task}" in the path is replaced by the task name')
+    parser.add_argument('--archives', type=str, nargs='+', default=None,
+                      help='stream samples from tar/zip shards (paths, directories or glob patterns) instead of '
+                           '--data-dir; "{task}" in a path is replaced by the task name')
+    parser.add_argument('--archive-labels', type=str, choices=['directory', 'utkface'], default='directory',
+                      help='label archive samples by parent directory or by UTKFace file name (default: directory)')
     parser.add_argument('--output-dir', type=str, default='models',
                       help='output directory for trained models')
-    
-    args = parser.parse_args()
+    parser.add_argument('--augmentation', type=str, choices=['generator', 'batch', 'layers'], default='generator',
+                      help='run augmentation per image in ImageDataGenerator, as one vectorized warp per batch, '
+                           'or as Keras preprocessing layers inside the model (default: generator)')
+    parser.add_argument('--variant', type=str, choices=['full', 'fast'], default='full',
+                      help='train the full model, or the small fast age/gender model used as the first stage '
+                           'of a cascade (saved as <task>_fast_model_*; default: full)')
+    parser.add_argument('--sampling', type=str, choices=['uniform', 'balanced', 'hard'], default='uniform',
+                      help='draw training batches uniformly, class-balanced, or class-balanced and weighted '
+                           'towards high-loss examples (default: uniform)')
+    parser.add_argument('--loader', type=str, choices=['keras', 'shared-memory'], default='keras',
+                      help='decode images in ImageDataGenerator, or in worker processes writing batches into '
+                           'shared memory (default: keras)')
+    parser.add_argument('--decode-workers', type=int, default=None,
+                      help='decode processes per generator with --loader shared-memory (default: CPUs - 1)')
+    parser.add_argument('--hard-example-fraction', type=float, default=0.25,
+                      help='share of training samples rescored after each epoch with --sampling hard (default: 0.25)')
+    parser.add_argument('--registry', type=str, default=os.path.join('models', 'registry'),
+                      help='model registry recording each best checkpoint with its config and metrics '
+                           '(default: models/registry)')
+    parser.add_argument('--no-registry', action='store_true',
+                      help='do not record trained models in the registry')
+    parser.add_argument('--intra-op-threads', type=int, default=None,
+                      help='TensorFlow intra-op threads (default: tuned host config, see autotune.py)')
+    parser.add_argument('--inter-op-threads', type=int, default=None,
+                      help='TensorFlow inter-op threads (default: tuned host config, see autotune.py)')
+    parser.add_argument('--profile', action='store_true',
+                      help='record per-step timing, input wait, throughput and host memory')
+    parser.add_argument('--profile-steps', type=str, default=None, metavar='START:END',
+                      help='run the TensorFlow profiler for this global step window (implies --profile)')
+    
+    args = parser.parse_args(argv)
+    
+    if not args.data_dir and not args.face_index and not args.archives:
+        parser.error('one of --data-dir, --face-index or --archives is required')
+    if args.archives and (args.sampling != 'uniform' or args.loader != 'keras'):
+        parser.error('--archives streams shards in order and needs --sampling uniform and --loader keras')
+    
+    profile_steps = None
+    if args.profile or args.profile_steps:
+        from training_telemetry import parse_profile_steps
+        try:
+            profile_steps = parse_profile_steps(args.profile_steps)
+        except ValueError as e:
+            parser.error(str(e))
     
     # Create output directory
     os.makedirs(args.output_dir, exist_ok=True)
     
     tasks = ['age', 'gender', 'expression'] if args.task == 'all' else [args.task]
+    if args.variant == 'fast':
+        if args.task == 'expression':
+            parser.error('--variant fast is only available for age and gender')
+        tasks = [task for task in tasks if task != 'expression']
+    
+    # Thread pools must be configured before TensorFlow runs its first op
+    from autotune import apply_training_settings
+    threads = apply_training_settings(args.intra_op_threads, args.inter_op_threads, task=tasks[0])
+    if threads:
+        print(f"TensorFlow threads: {threads}")
     
     for task in tasks:
         print(f"\n\n{'='*50}")
@@ -318,30 +610,86 @@ def main():
         print(f"{'='*50}\n")
         
         # Create data generators
-        data_dir = os.path.join(args.data_dir, task)
-        if not os.path.exists(data_dir):
-            print(f"Data directory {data_dir} does not exist. Using parent directory.")
-            data_dir = args.data_dir
+        face_index = args.face_index.replace('{task}', task) if args.face_index else None
+        archives = [pattern.replace('{task}', task) for pattern in args.archives] if args.archives else None
+        data_dir = None
+        if not face_index and not archives:
+            data_dir = os.path.join(args.data_dir, task)
+            if not os.path.exists(data_dir):
+                print(f"Data directory {data_dir} does not exist. Using parent directory.")
+                data_dir = args.data_dir
         
-        train_generator, validation_generator = create_data_generators(data_dir, task)
+        fast = args.variant == 'fast'
+        model_name = f'{task}_fast' if fast else task
+        train_generator, validation_generator = create_data_generators(
+            data_dir, task, face_index=face_index, augmentation=args.augmentation, sampling=args.sampling,
+            img_size=FAST_IMG_SIZE if fast else None, loader=args.loader, decode_workers=args.decode_workers,
+            archives=archives, archive_labels=args.archive_labels
+        )
         
         # Create and train model
-        if task == 'age':
-            model = create_age_model()
-        elif task == 'gender':
-            model = create_gender_model()
-        elif task == 'expression':
-            model = create_expression_model()
+        model = create_fast_model(task) if fast else create_model(task)
+        
+        # Run augmentation inside the compiled training graph
+        if args.augmentation == 'layers':
+            from augmentation import add_augmentation_layers
+            model = add_augmentation_layers(model)
         
         # Summary
         model.summary()
         
+        # Optional per-step telemetry, written next to the task's checkpoints
+        telemetry = None
+        if args.profile or args.profile_steps:
+            from training_telemetry import TrainingTelemetry
+            telemetry = TrainingTelemetry(
+                task,
+                os.path.join('models', task, 'telemetry'),
+                batch_size=train_generator.batch_size,
+                profile_steps=profile_steps,
+                model_name=model_name
+            )
+        
+        # Rescore training samples after each epoch so the next one favours hard examples
+        extra_callbacks = []
+        if args.sampling == 'hard':
+            from sampling import HardExampleMining
+            extra_callbacks.append(HardExampleMining(train_generator, fraction=args.hard_example_fraction))
+        
         # Train
-        model, history = train_model(model, train_generator, validation_generator, task)
+        model, history = train_model(model, train_generator, validation_generator, task,
+                                     telemetry=telemetry, extra_callbacks=extra_callbacks, model_name=model_name)
         
         # Fine-tune if applicable
         model, ft_history = fine_tune_model(model, train_generator, validation_generator, task)
         
+        # Stop this task's decode workers or shard readers before the next task starts its own
+        if args.loader == 'shared-memory' or archives:
+            train_generator.close()
+            validation_generator.close()
+        
+        # Record the best checkpoint with the config and metrics that produced it
+        checkpoint = os.path.join('models', task, f'{model_name}_model_best.h5')
+        if not args.no_registry and os.path.exists(checkpoint):
+            from model_registry import ModelRegistry
+            from backbone_weights import bundle_version
+            
+            config = {
+                'epochs': EPOCHS,
+                'batch_size': BATCH_SIZE,
+                'learning_rate': LEARNING_RATE,
+                'augmentation': args.augmentation,
+                'sampling': args.sampling,
+                'loader': args.loader,
+                'variant': args.variant,
+                'backbone_weights': bundle_version(),
+                'data': face_index or data_dir or archives,
+            }
+            artifact_hash = ModelRegistry(args.registry).add(
+                checkpoint, 'keras', task=task, config=config, metrics=history_metrics(history)
+            )
+            print(f"Registered {checkpoint} as {artifact_hash[:12]} in {args.registry}")
+        
         print(f"\n{task.upper()} model training complete. Model saved to {os.path.join(args.output_dir, task)}")
 
 if __name__ == '__main__':
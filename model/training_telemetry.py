@@ -0,0 +1,267 @@
+"""
+Training Telemetry for Age, Gender, and Expression Models
+
+This module provides an optional Keras callback that records per-step timing
+while `train_model` runs, so we can see where the `ImageDataGenerator` input
+pipeline and the model's forward/backward pass spend their time.
+
+For every training step it records:
+- step time: wall time between `on_train_batch_begin` and `on_train_batch_end`
+- fetch time: time the data generator spent producing the batches fetched
+  during that step. Keras fetches Sequence batches on a prefetching
+  background thread that overlaps the train step, so this is generator cost,
+  not time the trainer stalled; a generator that cannot keep up shows as
+  fetch time approaching step time
+- host gap: time between the end of one step and the start of the next
+- examples/sec and resident host memory
+
+It can also start the TensorFlow profiler for a configurable step window.
+Results are written as a per-step CSV and a JSON summary for each task.
+"""
+
+import os
+import csv
+import json
+import time
+import threading
+
+import tensorflow as tf
+
+
+def host_memory_mb():
+    """
+    Return the resident set size of this process in MB
+
+    Uses /proc when available and falls back to the peak RSS reported by
+    the resource module on other platforms.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is reported in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 if peak < 1 << 32 else peak / (1024 * 1024)
+
+
+class TimedSequence(tf.keras.utils.Sequence):
+    """
+    Wrap a Keras Sequence (e.g. a DirectoryIterator) and time each batch fetch
+
+    Fetch times are accumulated until the telemetry callback collects them at
+    the end of the step, which attributes decode/augmentation cost to the step
+    during which the prefetch thread did it (usually a later batch's).
+    """
+
+    def __init__(self, sequence):
+        super().__init__()
+        self.sequence = sequence
+        self._lock = threading.Lock()
+        self._pending_fetch_time = 0.0
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        batch = self.sequence[index]
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._pending_fetch_time += elapsed
+        return batch
+
+    def on_epoch_end(self):
+        self.sequence.on_epoch_end()
+
+    def __getattr__(self, name):
+        # Expose generator attributes such as class_indices and samples
+        if name == 'sequence':
+            raise AttributeError(name)
+        return getattr(self.sequence, name)
+
+    def collect_fetch_time(self):
+        """
+        Return and reset the fetch time accumulated since the last call
+        """
+        with self._lock:
+            elapsed = self._pending_fetch_time
+            self._pending_fetch_time = 0.0
+        return elapsed
+
+
+class TrainingTelemetry(tf.keras.callbacks.Callback):
+    """
+    Keras callback recording per-step wall time, generator fetch time, throughput and
+    host memory, with an optional TensorFlow profiler window
+    """
+
+    FIELDS = ['epoch', 'step', 'global_step', 'step_ms', 'fetch_ms',
+              'host_gap_ms', 'examples_per_sec', 'host_memory_mb', 'loss']
+
+    def __init__(self, task, output_dir, batch_size, profile_steps=None, model_name=None):
+        """
+        Args:
+            task (str): 'age', 'gender', or 'expression'
+            output_dir (str): Directory for the trace files
+            batch_size (int): Examples per training step
+            profile_steps (tuple): Optional (start, end) global steps for the
+                TensorFlow profiler; the trace is written under output_dir
+            model_name (str): File name prefix (default: task), so that e.g.
+                the fast variant does not overwrite the full model's trace
+        """
+        super().__init__()
+        self.task = task
+        self.model_name = model_name or task
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.profile_steps = profile_steps
+        self.records = []
+        self.epoch_times = []
+        self.sequence = None
+
+        self._epoch = 0
+        self._global_step = 0
+        self._step_start = None
+        self._last_step_end = None
+        self._epoch_start = None
+        self._profiling = False
+
+    def wrap(self, generator):
+        """
+        Wrap the training generator so batch fetch time can be measured
+        """
+        self.sequence = TimedSequence(generator)
+        return self.sequence
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+        self._epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_times.append(time.perf_counter() - self._epoch_start)
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.profile_steps and self._global_step == self.profile_steps[0]:
+            self._start_profiler()
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        step_time = now - self._step_start
+        host_gap = self._step_start - self._last_step_end if self._last_step_end else 0.0
+        fetch_time = self.sequence.collect_fetch_time() if self.sequence else 0.0
+        self._last_step_end = now
+
+        self.records.append({
+            'epoch': self._epoch,
+            'step': batch,
+            'global_step': self._global_step,
+            'step_ms': step_time * 1000,
+            'fetch_ms': fetch_time * 1000,
+            'host_gap_ms': host_gap * 1000,
+            'examples_per_sec': self.batch_size / step_time if step_time > 0 else 0.0,
+            'host_memory_mb': host_memory_mb(),
+            'loss': float((logs or {}).get('loss', float('nan'))),
+        })
+
+        self._global_step += 1
+        if self._profiling and self._global_step >= self.profile_steps[1]:
+            self._stop_profiler()
+
+    def on_train_end(self, logs=None):
+        if self._profiling:
+            self._stop_profiler()
+        self.write()
+
+    def _start_profiler(self):
+        logdir = os.path.join(self.output_dir, f'{self.model_name}_profile')
+        print(f"Starting TensorFlow profiler at step {self._global_step} (logdir: {logdir})")
+        tf.profiler.experimental.start(logdir)
+        self._profiling = True
+
+    def _stop_profiler(self):
+        tf.profiler.experimental.stop()
+        self._profiling = False
+        print(f"Stopped TensorFlow profiler at step {self._global_step}")
+
+    def summary(self):
+        """
+        Aggregate the recorded steps
+
+        The first step of each run is excluded from the averages because it
+        includes graph tracing.
+
+        Returns:
+            dict: Mean timings and throughput
+        """
+        steps = self.records[1:] or self.records
+        if not steps:
+            return {'task': self.task, 'model': self.model_name, 'steps': 0}
+
+        def mean(field):
+            return sum(r[field] for r in steps) / len(steps)
+
+        step_ms = mean('step_ms')
+        fetch_ms = mean('fetch_ms')
+
+        return {
+            'task': self.task,
+            'model': self.model_name,
+            'steps': len(self.records),
+            'epochs': len(self.epoch_times),
+            'batch_size': self.batch_size,
+            'mean_step_ms': step_ms,
+            'mean_fetch_ms': fetch_ms,
+            'mean_host_gap_ms': mean('host_gap_ms'),
+            'mean_examples_per_sec': mean('examples_per_sec'),
+            'peak_host_memory_mb': max(r['host_memory_mb'] for r in self.records),
+            'epoch_seconds': self.epoch_times,
+            # Fetches overlap the step, so this is not a share of the step;
+            # near 1 means the generator is only just keeping up
+            'fetch_step_ratio': fetch_ms / step_ms if step_ms > 0 else 0.0,
+            'profile_steps': list(self.profile_steps) if self.profile_steps else None,
+        }
+
+    def write(self):
+        """
+        Write the per-step CSV and JSON summary for this model
+
+        Returns:
+            Tuple of (csv path, json path)
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        csv_path = os.path.join(self.output_dir, f'{self.model_name}_steps.csv')
+        json_path = os.path.join(self.output_dir, f'{self.model_name}_telemetry.json')
+
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+        summary = self.summary()
+        with open(json_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        if self.records:
+            print(f"Telemetry: {summary['mean_step_ms']:.1f} ms/step, "
+                  f"{summary['mean_fetch_ms']:.1f} ms generator fetch, "
+                  f"{summary['mean_examples_per_sec']:.1f} examples/sec")
+        print(f"Telemetry written to {csv_path} and {json_path}")
+
+        return csv_path, json_path
+
+
+def parse_profile_steps(value):
+    """
+    Parse a 'START:END' step window for the TensorFlow profiler
+    """
+    if not value:
+        return None
+    start, _, end = value.partition(':')
+    start = int(start)
+    end = int(end) if end else start + 1
+    if start < 0 or end <= start:
+        raise ValueError(f"Invalid profiler step window '{value}', expected START:END with END > START")
+    return start, end
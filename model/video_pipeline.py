@@ -0,0 +1,372 @@
+"""
+Video Inference Pipeline with Temporal Result Caching
+
+This script runs the converted age, gender and expression models over a
+video file as a chain of bounded generator stages:
+
+    decode (reader thread) -> face detect -> track -> crop + infer
+
+Frames are decoded on a background thread into a bounded queue so decoding
+overlaps inference without buffering the whole video. Faces are tracked
+across frames by bounding-box overlap; expression runs on every frame, while
+age and gender, which do not change from frame to frame, are only re-inferred
+for a track every N frames or when the track is new. All faces of a frame are
+preprocessed into a preallocated buffer and run in one invoke per model
+(see tflite_inference.BatchedFaceRunner). With --cascade-threshold, age and
+gender run through the fast `<task>_fast_model.tflite` first and only
+low-confidence crops are escalated to the full models. With
+--embedding-model, age and gender for new or stale tracks are first looked
+up by face embedding (embedding_cache.py), so people who leave and re-enter
+the frame are not re-inferred.
+
+Face detection uses OpenCV's Haar cascade (the app itself uses the platform
+face detector, which is not available to the Python tooling).
+
+Usage:
+    python video_pipeline.py input.mp4 --models-dir models --attribute-interval 15 --output results.jsonl
+"""
+
+import json
+import time
+import queue
+import argparse
+import threading
+from dataclasses import dataclass, field
+
+from embedding_cache import add_cache_arguments, create_face_cache, print_cache_summary
+from tflite_inference import BatchedFaceRunner, CascadeModel, TFLiteModel, default_model_path
+
+# Sentinel marking the end of the decoded stream
+_END = object()
+
+
+@dataclass
+class Track:
+    """
+    A face followed across frames, with its cached age/gender predictions
+    """
+    track_id: int
+    box: tuple
+    last_seen: int  # processed-frame count of the last matching detection
+    attributes_frame: int = -1
+    attributes_step: int = -1  # processed-frame count when attributes were last inferred
+    attributes: dict = field(default_factory=dict)
+
+
+def read_frames(video_path, max_buffered=8, stride=1):
+    """
+    Decode frames on a reader thread and yield them through a bounded queue
+
+    Args:
+        video_path (str): Path to the video file
+        max_buffered (int): Decoded frames held ahead of the consumer
+        stride (int): Yield every Nth frame
+
+    Yields:
+        Tuple of (frame index, BGR frame)
+    """
+    import cv2
+
+    frames = queue.Queue(maxsize=max_buffered)
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        capture = cv2.VideoCapture(video_path)
+        try:
+            if not capture.isOpened():
+                raise IOError(f"Could not open video {video_path}")
+            index = 0
+            while not stop.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                if index % stride == 0:
+                    frames.put((index, frame))
+                index += 1
+        except Exception as e:
+            errors.append(e)
+        finally:
+            capture.release()
+            frames.put(_END)
+
+    thread = threading.Thread(target=reader, name='video-reader', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is _END:
+                break
+            yield item
+    finally:
+        # Unblock the reader if the consumer stopped early
+        stop.set()
+        while thread.is_alive():
+            try:
+                frames.get_nowait()
+            except queue.Empty:
+                thread.join(timeout=0.05)
+    if errors:
+        raise errors[0]
+
+
+def detect_faces(frames, min_size=48, scale_factor=1.1, min_neighbors=5):
+    """
+    Detect faces in each frame with OpenCV's frontal face Haar cascade
+
+    Yields:
+        Tuple of (frame index, frame, list of (x, y, w, h) boxes)
+    """
+    import cv2
+
+    detector = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    for index, frame in frames:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        boxes = detector.detectMultiScale(gray, scaleFactor=scale_factor, minNeighbors=min_neighbors,
+                                          minSize=(min_size, min_size))
+        yield index, frame, [tuple(int(v) for v in box) for box in boxes]
+
+
+def iou(a, b):
+    """
+    Intersection over union of two (x, y, w, h) boxes
+    """
+    ax2, ay2 = a[0] + a[2], a[1] + a[3]
+    bx2, by2 = b[0] + b[2], b[1] + b[3]
+    iw = max(0, min(ax2, bx2) - max(a[0], b[0]))
+    ih = max(0, min(ay2, by2) - max(a[1], b[1]))
+    inter = iw * ih
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union else 0.0
+
+
+class FaceTracker:
+    """
+    Greedy IoU tracker assigning stable ids to faces across frames
+    """
+
+    def __init__(self, iou_threshold=0.3, max_missed=10):
+        """
+        Args:
+            iou_threshold (float): Minimum overlap to continue a track
+            max_missed (int): Processed frames a track survives without a
+                detection (skipped frames do not count)
+        """
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = {}
+        self._next_id = 0
+
+    def update(self, step, boxes):
+        """
+        Match detections to tracks
+
+        Args:
+            step (int): Processed-frame count, not the decoded frame index,
+                so that a stride does not shorten a track's lifetime
+            boxes (list): Detected (x, y, w, h) boxes
+
+        Returns:
+            list: Track for each box, in the order of `boxes`
+        """
+        pairs = sorted(
+            ((iou(track.box, box), track_id, i)
+             for track_id, track in self.tracks.items()
+             for i, box in enumerate(boxes)),
+            reverse=True
+        )
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for overlap, track_id, i in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if assigned[i] is not None or track_id in used_tracks:
+                continue
+            track = self.tracks[track_id]
+            track.box = boxes[i]
+            track.last_seen = step
+            assigned[i] = track
+            used_tracks.add(track_id)
+
+        for i, box in enumerate(boxes):
+            if assigned[i] is None:
+                track = Track(self._next_id, box, step)
+                self.tracks[track.track_id] = track
+                self._next_id += 1
+                assigned[i] = track
+
+        self.tracks = {tid: t for tid, t in self.tracks.items()
+                       if step - t.last_seen <= self.max_missed}
+        return assigned
+
+
+def crop_face(frame, box, margin=0.1):
+    """
+    Crop a face with a small margin and convert BGR to RGB
+    """
+    x, y, w, h = box
+    dx, dy = int(w * margin), int(h * margin)
+    height, width = frame.shape[:2]
+    crop = frame[max(0, y - dy):min(height, y + h + dy), max(0, x - dx):min(width, x + w + dx)]
+    return crop[..., ::-1]
+
+
+class VideoAnalyzer:
+    """
+    Run the face models over tracked faces, re-inferring age and gender only
+    every `attribute_interval` processed frames per track (with a stride,
+    skipped frames do not count)
+    """
+
+    def __init__(self, models_dir='models', attribute_interval=15, num_threads=None, tracker=None,
+                 max_batch_size=16, cascade_threshold=None, face_cache=None):
+        self.models = {
+            task: TFLiteModel(default_model_path(models_dir, task), task, num_threads=num_threads)
+            for task in ('age', 'gender', 'expression')
+        }
+        if cascade_threshold is not None:
+            for task in ('age', 'gender'):
+                fast = TFLiteModel(default_model_path(models_dir, task, f'{task}_fast'), task,
+                                   num_threads=num_threads)
+                self.models[task] = CascadeModel(fast, self.models[task], threshold=cascade_threshold)
+        self.runner = BatchedFaceRunner(self.models, max_batch_size=max_batch_size)
+        self.attribute_interval = attribute_interval
+        self.face_cache = face_cache
+        self.tracker = tracker or FaceTracker()
+        self.stats = {'frames': 0, 'faces': 0, 'attribute_inferences': 0, 'attribute_cache_hits': 0}
+
+    def _needs_attributes(self, track, step):
+        return track.attributes_step < 0 or step - track.attributes_step >= self.attribute_interval
+
+    def _infer_attributes(self, crops):
+        """
+        Age and gender for a list of crops, one {task: decoded} dict per crop
+        """
+        self.stats['attribute_inferences'] += len(crops)
+        attributes = [{} for _ in crops]
+        for task in ('age', 'gender'):
+            for result, row in zip(attributes, self.runner.predict(task, crops)):
+                result[task] = self.models[task].decode(row)
+        return attributes
+
+    def process(self, detections):
+        """
+        Consume (frame index, frame, boxes) and yield per-frame results
+        """
+        for frame_index, frame, boxes in detections:
+            self.stats['frames'] += 1
+            step = self.stats['frames']
+            tracks = self.tracker.update(step, boxes)
+            crops = [crop_face(frame, box) for box in boxes]
+            self.stats['faces'] += len(crops)
+
+            faces = [{'track_id': t.track_id, 'box': list(box)} for t, box in zip(tracks, boxes)]
+            if crops:
+                expression = self.runner.predict('expression', crops)
+                for face, row in zip(faces, expression):
+                    face['expression'] = self.models['expression'].decode(row)
+
+                stale = [i for i, t in enumerate(tracks) if self._needs_attributes(t, step)]
+                if stale:
+                    stale_crops = [crops[i] for i in stale]
+                    if self.face_cache:
+                        attributes = self.face_cache.get(stale_crops, self._infer_attributes)
+                    else:
+                        attributes = self._infer_attributes(stale_crops)
+                    for i, result in zip(stale, attributes):
+                        tracks[i].attributes.update(result)
+                        tracks[i].attributes_frame = frame_index
+                        tracks[i].attributes_step = step
+                self.stats['attribute_cache_hits'] += len(crops) - len(stale)
+
+                for face, track in zip(faces, tracks):
+                    face.update(track.attributes)
+                    face['attributes_frame'] = track.attributes_frame
+
+            yield {'frame': frame_index, 'faces': faces}
+
+
+def run_pipeline(video_path, models_dir='models', attribute_interval=15, stride=1,
+                 max_buffered=8, num_threads=None, cascade_threshold=None, face_cache=None):
+    """
+    Build the full decode -> detect -> track -> infer generator chain
+
+    Returns:
+        Tuple of (result generator, VideoAnalyzer with running stats)
+    """
+    analyzer = VideoAnalyzer(models_dir, attribute_interval=attribute_interval, num_threads=num_threads,
+                             cascade_threshold=cascade_threshold, face_cache=face_cache)
+    frames = read_frames(video_path, max_buffered=max_buffered, stride=stride)
+    return analyzer.process(detect_faces(frames)), analyzer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run age, gender and expression recognition over a video file')
+    parser.add_argument('video', type=str,
+                      help='path to the input video')
+    parser.add_argument('--models-dir', type=str, default='models',
+                      help='directory containing <task>/<task>_model.tflite (default: models)')
+    parser.add_argument('--attribute-interval', type=int, default=15,
+                      help='re-infer age/gender for a track every N processed frames (default: 15)')
+    parser.add_argument('--stride', type=int, default=1,
+                      help='process every Nth decoded frame (default: 1)')
+    parser.add_argument('--max-buffered', type=int, default=8,
+                      help='decoded frames buffered ahead of inference (default: 8)')
+    parser.add_argument('--threads', type=int, default=None,
+                      help='threads per interpreter')
+    parser.add_argument('--cascade-threshold', type=float, default=None,
+                      help='run age/gender as a cascade: escalate crops whose fast-model confidence is '
+                           'below this to the full model (pick it with cascade.py sweep)')
+    parser.add_argument('--output', type=str, default=None,
+                      help='write per-frame results as JSON lines to this file')
+    add_cache_arguments(parser)
+
+    args = parser.parse_args(argv)
+
+    face_cache = None
+    if args.embedding_model:
+        face_cache = create_face_cache(args.embedding_model, threshold=args.cache_threshold, ttl_s=args.cache_ttl,
+                                       max_entries=args.cache_size, num_threads=args.threads)
+
+    results, analyzer = run_pipeline(
+        args.video,
+        models_dir=args.models_dir,
+        attribute_interval=args.attribute_interval,
+        stride=args.stride,
+        max_buffered=args.max_buffered,
+        num_threads=args.threads,
+        cascade_threshold=args.cascade_threshold,
+        face_cache=face_cache
+    )
+
+    output = open(args.output, 'w') if args.output else None
+    start = time.perf_counter()
+    try:
+        for result in results:
+            if output:
+                output.write(json.dumps(result) + '\n')
+    finally:
+        if output:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    stats = analyzer.stats
+    # Each face is a track-cache hit, an embedding-cache hit or an inference
+    attribute_total = stats['faces']
+    print(f"Processed {stats['frames']} frames ({stats['frames'] / elapsed:.1f} fps), {stats['faces']} faces")
+    if attribute_total:
+        print(f"Age/gender inferred for {stats['attribute_inferences']} of {attribute_total} faces "
+              f"({100 * stats['attribute_cache_hits'] / attribute_total:.1f}% served from track cache)")
+    for task in ('age', 'gender'):
+        model = analyzer.models[task]
+        if isinstance(model, CascadeModel) and model.stats['faces']:
+            print(f"{task} cascade escalated {model.stats['escalated']} of {model.stats['faces']} faces "
+                  f"({100 * model.escalation_rate():.1f}%) to the full model")
+    if face_cache:
+        print_cache_summary(face_cache.summary())
+    if args.output:
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
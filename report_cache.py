@@ -0,0 +1,138 @@
+"""
+Build cache for the evaluation report scripts
+
+Each generated artifact (PNG, CSV, Markdown) is keyed by a SHA-256 hash of the
+content it is rendered from, the rendering parameters and the source of the
+function that renders it. When a report script is re-run, artifacts whose key
+is unchanged and whose file on disk still matches the recorded output hash are
+skipped, so only the tables affected by new predictions are redrawn.
+"""
+
+import os
+import json
+import hashlib
+import inspect
+
+CACHE_FILE = '.report_cache.json'
+
+
+def _canonical(obj):
+    """
+    Convert objects that json cannot serialise into a stable representation
+
+    DataFrames/Series are serialised with their index and columns, NumPy arrays
+    as nested lists and callables as their source code, so editing a renderer
+    invalidates every artifact it produces.
+    """
+    if hasattr(obj, 'to_json'):
+        return obj.to_json(orient='split')
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if callable(obj):
+        try:
+            return inspect.getsource(obj)
+        except (OSError, TypeError):
+            return getattr(obj, '__qualname__', repr(obj))
+    return repr(obj)
+
+
+def fingerprint(*parts):
+    """
+    Compute a content hash over any mix of JSON-compatible values,
+    DataFrames, arrays and functions
+    """
+    payload = json.dumps(parts, sort_keys=True, default=_canonical)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def file_digest(path):
+    """
+    Hash the bytes of an artifact on disk
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ReportCache:
+    """
+    Content-hash cache mapping artifact paths to the key they were built from
+    """
+
+    def __init__(self, path=CACHE_FILE, force=False):
+        """
+        Args:
+            path (str): Location of the JSON cache index
+            force (bool): Rebuild every artifact regardless of the cache
+        """
+        self.path = path
+        self.force = force or os.environ.get('REPORT_CACHE_DISABLE') == '1'
+        self.entries = {}
+        self.built = []
+        self.skipped = []
+
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                # A corrupt index only costs a full rebuild
+                self.entries = {}
+
+    def is_fresh(self, artifact, key):
+        """
+        Check whether an artifact was built from the given key and has not
+        been modified since
+        """
+        if self.force:
+            return False
+
+        entry = self.entries.get(artifact)
+        if not entry or entry.get('key') != key or not os.path.exists(artifact):
+            return False
+
+        return file_digest(artifact) == entry.get('output')
+
+    def build(self, artifact, render, *args, depends_on=(), **kwargs):
+        """
+        Call ``render(*args, **kwargs)`` unless its inputs are unchanged
+
+        Args:
+            artifact (str): Output path written by ``render``
+            render (callable): Function that writes the artifact
+            *args: Positional arguments for ``render`` (data and parameters)
+            depends_on (tuple): Extra content ``render`` reads from elsewhere,
+                e.g. module-level tables
+            **kwargs: Keyword arguments for ``render``
+
+        Returns:
+            bool: True if the artifact was (re)built, False if skipped
+        """
+        key = fingerprint(artifact, render, args, kwargs, depends_on)
+
+        if self.is_fresh(artifact, key):
+            self.skipped.append(artifact)
+            return False
+
+        render(*args, **kwargs)
+        self.entries[artifact] = {'key': key, 'output': file_digest(artifact)}
+        self.built.append(artifact)
+        self.save()
+        return True
+
+    def save(self):
+        """
+        Persist the cache index atomically
+        """
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        """
+        Return a one-line description of what was rebuilt
+        """
+        return f"Report cache: {len(self.built)} rebuilt, {len(self.skipped)} unchanged"